@@ -1,5 +1,13 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import functools
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 import os
+import queue
 import re
+import threading
 import time
 import timeit
 
@@ -7,17 +15,104 @@ import imutils
 import click
 import cv2
 import numpy as np
-from pyzbar import pyzbar
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 from lib.crop import create_binary_mask, create_mask_overlay
 from lib.constants import config
+from lib.photo_index import UID_RE, next_photo_number
+from lib.qr import decode_qr_codes
 from lib.scalebar import measure_scalebar_new
-from lib.unskew import unskew
+from lib.unskew import get_lens_key, unskew_image
 from lib.utils import get_kv_pairs, get_kv_pairs_dict, show_image
 
-UID_RE = r"{uid_(?P<uid>.+?)}"
+# the tmp previews are overwritten for every box, compress them quickly
+PREVIEW_PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+# a new photo is read once its size did not change for this many seconds
+WRITE_SETTLE_SECONDS = 0.5
+# ... or for this many checks if it does not end like a jpeg
+WRITE_SETTLE_CHECKS = 4
+# give up on photos that are not written within this many seconds
+WRITE_TIMEOUT_SECONDS = 60
+JPEG_EOI = b"\xff\xd9"
+
+# photos unskewed and boxed at the same time
+INGEST_WORKERS = 2
+# photos prepared ahead of the operator
+MAX_PHOTOS_AHEAD = 3
+# seconds between the checks of a waiting ingest worker whether to stop
+INGEST_POLL_SECONDS = 0.5
+
+MANIFEST_FIELDS = ["photo", "status", "reason", "qr_codes", "saved", "seconds"]
+
+# set in the worker processes of a batch, which already keep every cpu busy
+_decode_qr_serially = False
+
+
+def report_timings(timings):
+    """
+    print the seconds spent per stage of the acquisition
+    """
+    stages = ", ".join(
+        "%s %.2fs" % (stage, seconds) for stage, seconds in timings.items()
+    )
+    click.secho("Timings: %s" % stages, fg="blue")
+
+
+def get_preview(box_image, preview_scale=1):
+    """
+    binary mask and mask overlay of a box to be previewed
+
+    Args:
+        box_image (np.array): the box as cropped from the photo
+        preview_scale (int): the box is shrunk by this factor for the preview
+    Returns:
+        (mask, overlay)
+    """
+    if preview_scale > 1:
+        box_image = cv2.resize(
+            box_image,
+            None,
+            fx=1 / preview_scale,
+            fy=1 / preview_scale,
+            interpolation=cv2.INTER_AREA,
+        )
+    mask = create_binary_mask(box_image)
+    overlay = create_mask_overlay(box_image)
+    return mask, overlay
+
+
+def measure_box_scalebar(box):
+    """
+    length of the scalebar of a box in px, None if it could not be read
+    """
+    try:
+        return measure_scalebar_new(box["mask"])
+    except Exception:
+        return None
+
+
+def prepare_box(box, preview_scale=1):
+    """
+    everything that can be done for a box before the operator sees it. This
+    runs for all boxes of a photo at once.
+
+    Returns:
+        dict with the preview mask and overlay (None if they could not be
+        created), the error if so and the scale of the box
+    """
+    try:
+        mask, overlay = get_preview(box["mask"], preview_scale)
+        error = None
+    except Exception as e:
+        mask, overlay, error = None, None, e
+    return {
+        "mask": mask,
+        "overlay": overlay,
+        "error": error,
+        "scale": measure_box_scalebar(box),
+    }
 
 
 def crop_boxes(image, expected_carrots):
@@ -35,11 +130,15 @@ def crop_boxes(image, expected_carrots):
     # put a white buffer around the image
     buffer_width = 100
 
-    white_cols = np.ones((image.shape[0], buffer_width, 3), dtype=np.uint8) * 255
-    image = np.hstack([white_cols, image, white_cols])
-
-    white_rows = np.ones((buffer_width, image.shape[1], 3), dtype=np.uint8) * 255
-    image = np.vstack([white_rows, image, white_rows])
+    image = cv2.copyMakeBorder(
+        image,
+        buffer_width,
+        buffer_width,
+        buffer_width,
+        buffer_width,
+        cv2.BORDER_CONSTANT,
+        value=(255, 255, 255),
+    )
 
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     gray = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -47,7 +146,6 @@ def crop_boxes(image, expected_carrots):
     thresh = cv2.erode(thresh, None, iterations=2)
     thresh = cv2.dilate(thresh, None, iterations=2)
 
-    qr_codes = pyzbar.decode(thresh)
     max_codes = expected_carrots
 
     # find contours
@@ -61,18 +159,31 @@ def crop_boxes(image, expected_carrots):
     # cv2.imwrite("/Users/creimers/Downloads/gates.png", image)
 
     # find extreme points in contours
-    boxes = []
+    extremes = []
     for i, c in enumerate(cnts):
         ext_left = tuple(c[c[:, :, 0].argmin()][0])
         ext_right = tuple(c[c[:, :, 0].argmax()][0])
         ext_top = tuple(c[c[:, :, 1].argmin()][0])
         ext_bot = tuple(c[c[:, :, 1].argmax()][0])
+        extremes.append((ext_left, ext_right, ext_top, ext_bot))
+
+    # decode the qr codes of every box at once, unless this is a batch worker
+    box_thresholds = [
+        thresh[ext_top[1] : ext_bot[1], ext_left[0] : ext_right[0]]
+        for ext_left, ext_right, ext_top, ext_bot in extremes
+    ]
+    processes = min(len(box_thresholds), cpu_count())
+    if _decode_qr_serially or processes <= 1:
+        box_codes = [decode_qr_codes(box) for box in box_thresholds]
+    else:
+        with ThreadPool(processes=processes) as pool:
+            box_codes = pool.map(decode_qr_codes, box_thresholds)
 
+    boxes = []
+    for (ext_left, ext_right, ext_top, ext_bot), kode in zip(extremes, box_codes):
         mask = image[ext_top[1] : ext_bot[1], ext_left[0] : ext_right[0]]
-        mask_tresh = thresh[ext_top[1] : ext_bot[1], ext_left[0] : ext_right[0]]
 
         box_code = None
-        kode = pyzbar.decode(mask_tresh)
         if len(kode) > 0:
             box_code = kode[0]
 
@@ -82,7 +193,11 @@ def crop_boxes(image, expected_carrots):
             mask_height = mask.shape[0]
             mask_width = mask.shape[1]
 
-            code_rect = qr_codes[0].rect
+            # position of the code in the image
+            code_rect = box_code.rect._replace(
+                left=box_code.rect.left + ext_left[0],
+                top=box_code.rect.top + ext_top[1],
+            )
 
             if mask_height > mask_width:
                 # barcode on bottom
@@ -110,6 +225,8 @@ def save_box_as_image(box, dest, destdir="Genotype", destsub=""):
         dest - destination directory as string
         destdir: (str) key to be used to name directory
         subdir: (str) key to be used to name sub directory
+    Returns:
+        the path the box was written to, None if it has no qr code
     """
     attributes = box["qr"]
 
@@ -133,27 +250,19 @@ def save_box_as_image(box, dest, destdir="Genotype", destsub=""):
 
         os.makedirs(dest_dir, exist_ok=True)
 
-        existing_files = {}
-        for file in os.listdir(dest_dir):
-            uid_match = re.search(UID_RE, file.lower())
-            if uid_match:
-                existing_uid = uid_match.groupdict().get("uid", None)
-                if existing_uid == uid:
-                    if uid not in existing_files.keys():
-                        existing_files[uid] = []
-                    existing_files[uid].append(file)
-
-        count = len(existing_files.get(uid, []))
-
         kv_pairs = get_kv_pairs(attributes)
 
-        try:
-            scalebar_length = measure_scalebar_new(box["mask"])
-            kv_pairs.append("Scale_%s" % scalebar_length)
-        except:
+        if "scale" in box:
+            scalebar_length = box["scale"]
+        else:
+            scalebar_length = measure_box_scalebar(box)
+
+        if scalebar_length is None:
             click.secho("Could not read scalebar!", fg="red")
+        else:
+            kv_pairs.append("Scale_%s" % scalebar_length)
 
-        kv_pairs.append("Photo_%s" % (count + 1))
+        kv_pairs.append("Photo_%s" % next_photo_number(dest_dir, uid))
 
         attributes = "".join(["{%s}" % pair for pair in kv_pairs])
 
@@ -162,18 +271,120 @@ def save_box_as_image(box, dest, destdir="Genotype", destsub=""):
         msg = " ".join(["writing to disk: ", dest_path])
         click.secho(msg, fg="green")
         cv2.imwrite(dest_path, box["mask"])
+        return dest_path
+
+
+def is_complete_jpeg(image_path):
+    """
+    whether the jpeg ends with its end of image marker
+    """
+    # too short to seek back to the marker, the camera just created it
+    if os.path.getsize(image_path) < len(JPEG_EOI):
+        return False
+    with open(image_path, "rb") as f:
+        f.seek(-2, os.SEEK_END)
+        return f.read(2) == JPEG_EOI
+
+
+def wait_until_written(
+    image_path, settle=WRITE_SETTLE_SECONDS, timeout=WRITE_TIMEOUT_SECONDS, stop=None
+):
+    """
+    wait until the camera has written the photo completely: its size did not
+    change for settle seconds and the jpeg is terminated (or its size did not
+    change for a few times as long).
+
+    Args:
+        stop (threading.Event): give up as soon as it is set
+    Returns:
+        bool - False if the photo was not written within timeout seconds, or
+        if stop was set
+    """
+    deadline = time.time() + timeout
+    last_size = None
+    stable = 0
+    while time.time() < deadline:
+        try:
+            size = os.path.getsize(image_path)
+        except OSError:
+            size = None
+
+        if size and size == last_size:
+            stable += 1
+            if is_complete_jpeg(image_path) or stable >= WRITE_SETTLE_CHECKS:
+                return True
+        else:
+            stable = 0
+
+        last_size = size
+        if stop is None:
+            time.sleep(settle)
+        elif stop.wait(settle):
+            return False
+    return False
 
 
-def do_acquisition(image_path, dest, tmp, destdir, destsub, discard, expected_carrots):
+def prepare_photo(image_path, expected_carrots, pool, preview_scale=1, verbose=True):
     """
+    everything that can be done for a photo before the operator is asked:
+    unskew it, find the boxes and start preparing them in the pool
+
     Args:
-        image_path - path to the image as string
+        image_path (str): path to the photo
+        expected_carrots (int): the number of carrots to be expected in the image
+        pool (ThreadPool): pool the boxes are prepared in
+        preview_scale (int): shrink the boxes by this factor for the preview
+        verbose (bool): tell the operator about every step
+    Returns:
+        dict with image_path, boxes, previews (one AsyncResult of
+        prepare_box per box) and timings
+    """
+    timings = collections.OrderedDict()
+
+    # 1. decode once and unskew in memory
+    start = timeit.default_timer()
+    image = cv2.imread(image_path)
+    lens_key = get_lens_key(image_path, False)
+    timings["decode"] = timeit.default_timer() - start
+
+    if verbose:
+        click.secho("Let me unskew this image real quick... ", fg="white")
+    start = timeit.default_timer()
+    image = unskew_image(image, lens_key)
+    timings["unskew"] = timeit.default_timer() - start
+
+    # 2. find boxes
+    if verbose:
+        click.secho("Let's see if I can find boxes... ", fg="white")
+    start = timeit.default_timer()
+    boxes = crop_boxes(image, expected_carrots)
+    timings["boxes"] = timeit.default_timer() - start
+
+    # 3. prepare all boxes
+    previews = [pool.apply_async(prepare_box, (box, preview_scale)) for box in boxes]
+
+    return {
+        "image_path": image_path,
+        "boxes": boxes,
+        "previews": previews,
+        "timings": timings,
+    }
+
+
+def confirm_photo(photo, dest, tmp, destdir, destsub, discard):
+    """
+    ask the operator about a prepared photo and save the boxes they like
+
+    Args:
+        photo (dict): as returned by prepare_photo
         dest - destination directory as string
+        tmp - directory of the previews as string
         destdir: (str) key to be used to name directory
         destsub: (str) key to be used to name sub directory
         discard: a directory to copy the photo to if not processed (str)
-        expected_carrots (int): the number of carrots to be expected in the image
     """
+    image_path = photo["image_path"]
+    boxes = photo["boxes"]
 
     temp_dest = tmp
     if not os.path.exists(temp_dest):
@@ -181,47 +392,52 @@ def do_acquisition(image_path, dest, tmp, destdir, destsub, discard, expected_ca
     tmp_mask = os.path.join(temp_dest, "mask.png")
     tmp_overlay = os.path.join(temp_dest, "overlay.png")
 
-    # 1. unskew in memory
-    click.secho("Let me unskew this image real quick... ", fg="white")
-    # image = cv2.imread(image_path)
-    image = unskew(image_path, False)
-    # 2. find boxes
-    click.secho("Let's see if I can find boxes... ", fg="white")
-    boxes = crop_boxes(image, expected_carrots)
-    # 3. find qr codes
+    report_timings(photo["timings"])
+
+    # 4. find qr codes
     click.secho("Let me scan for QR codes...", fg="white")
     qr_codes = len([1 for b in boxes if b["qr"] is not None])
     carrot = " 🥕 "
     click.secho(carrot * qr_codes, fg="white")
-    # 4. prompt number of qr codes and ask if it should procede
+
+    # 5. prompt number of qr codes and ask if it should procede
     while True:
         msg = "Found %s QR codes. Procede? [y/N]" % qr_codes
         value = click.prompt(msg)
 
         if value and value.lower() == "y":
 
-            # 5a. generate previews
-            for box in boxes:
-                click.echo(box["qr"])
-                # create mask
-                mask = create_binary_mask(box["mask"])
-                cv2.imwrite(tmp_mask, mask)
+            # 6a. show previews, each as soon as it is ready
+            timings = collections.OrderedDict([("waiting", 0), ("save", 0)])
+            for box, result in zip(boxes, photo["previews"]):
+                start = timeit.default_timer()
+                preview = result.get()
+                timings["waiting"] += timeit.default_timer() - start
 
-                # # create mask overlay
-                overlay = create_mask_overlay(box["mask"])
-                cv2.imwrite(tmp_overlay, overlay)
+                click.echo(box["qr"])
+                if preview["error"] is None:
+                    cv2.imwrite(tmp_mask, preview["mask"], PREVIEW_PNG_PARAMS)
+                    cv2.imwrite(tmp_overlay, preview["overlay"], PREVIEW_PNG_PARAMS)
+                else:
+                    click.secho(
+                        "Could not create a preview: %r" % preview["error"], fg="red"
+                    )
 
                 msg = "Liked what you saw? [y/n]"
                 value = click.prompt(msg)
 
                 if value and value.lower() == "y":
                     # save
-                    # 5b. write to disk
+                    # 6b. write to disk
+                    start = timeit.default_timer()
+                    box["scale"] = preview["scale"]
                     save_box_as_image(box, dest, destdir, destsub)
+                    timings["save"] += timeit.default_timer() - start
                 else:
                     # discard
                     pass
 
+            report_timings(timings)
             break
         elif value and value.lower() == "n":
             click.secho("These are the codes I found:", fg="white")
@@ -241,38 +457,384 @@ def do_acquisition(image_path, dest, tmp, destdir, destsub, discard, expected_ca
             click.secho("Please type either 'y' or 'n', followed by Enter.", fg="white")
 
 
+def do_acquisition(
+    image_path,
+    dest,
+    tmp,
+    destdir,
+    destsub,
+    discard,
+    expected_carrots,
+    preview_scale=1,
+):
+    """
+    Args:
+        image_path - path to the image as string
+        dest - destination directory as string
+        destdir: (str) key to be used to name directory
+        destsub: (str) key to be used to name sub directory
+        discard: a directory to copy the photo to if not processed (str)
+        expected_carrots (int): the number of carrots to be expected in the image
+        preview_scale (int): shrink the boxes by this factor for the preview
+    """
+    # the boxes are prepared while the operator is asked to procede
+    with ThreadPool(processes=cpu_count()) as pool:
+        photo = prepare_photo(image_path, expected_carrots, pool, preview_scale)
+        confirm_photo(photo, dest, tmp, destdir, destsub, discard)
+
+
+def check_qr_count(boxes, expected_carrots):
+    """
+    accept photos with a qr code for every expected carrot
+    """
+    if len(boxes) != expected_carrots:
+        return "found %s of %s qr codes" % (len(boxes), expected_carrots)
+
+
+def check_unique_qr(boxes, expected_carrots):
+    """
+    accept photos without a carrot twice
+    """
+    codes = [box["qr"] for box in boxes]
+    if len(set(codes)) != len(codes):
+        return "duplicate qr codes"
+
+
+def check_scalebar(boxes, expected_carrots):
+    """
+    accept photos with a readable scalebar in every box
+    """
+    missing = len([1 for box in boxes if box["scale"] is None])
+    if missing:
+        return "no scalebar in %s boxes" % missing
+
+
+# the rules a photo has to pass to be acquired in batch mode. Each returns
+# the reason to reject the photo, None to accept it.
+ACCEPTANCE_RULES = collections.OrderedDict(
+    [
+        ("qr-count", check_qr_count),
+        ("unique-qr", check_unique_qr),
+        ("scalebar", check_scalebar),
+    ]
+)
+DEFAULT_ACCEPTANCE_RULES = ("qr-count",)
+
+
+def acquire_photo(
+    image_path,
+    dest,
+    destdir="Genotype",
+    destsub="",
+    expected_carrots=6,
+    rules=DEFAULT_ACCEPTANCE_RULES,
+):
+    """
+    the acquisition of a photo without an operator: the boxes are saved if
+    the photo passes all acceptance rules
+
+    Args:
+        image_path (str): path to the photo
+        dest (str): destination directory
+        destdir (str): key to be used to name directory
+        destsub (str): key to be used to name sub directory
+        expected_carrots (int): the number of carrots to be expected in the image
+        rules (tuple): names of the ACCEPTANCE_RULES to apply
+    Returns:
+        dict with status (accepted or rejected), reason, qr_codes and the
+        paths of the saved boxes
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise Exception("Could not read the photo!")
+    image = unskew_image(image, get_lens_key(image_path, False))
+
+    boxes = crop_boxes(image, expected_carrots)
+    if "scalebar" in rules:
+        for box in boxes:
+            box["scale"] = measure_box_scalebar(box)
+
+    reasons = [ACCEPTANCE_RULES[rule](boxes, expected_carrots) for rule in rules]
+    reasons = [reason for reason in reasons if reason]
+    if not boxes:
+        reasons.append("no qr codes found")
+
+    saved = []
+    if not reasons:
+        for box in boxes:
+            saved.append(save_box_as_image(box, dest, destdir, destsub))
+
+    return {
+        "status": "rejected" if reasons else "accepted",
+        "reason": "; ".join(reasons),
+        "qr_codes": len(boxes),
+        "saved": saved,
+    }
+
+
+def _acquire_photo_safe(image_path, **kwargs):
+    """
+    wrapper around acquire_photo that reports errors instead of raising, so
+    one broken photo does not take down the whole batch
+    """
+    start = timeit.default_timer()
+    try:
+        result = acquire_photo(image_path, **kwargs)
+    except Exception as e:
+        result = {"status": "failed", "reason": str(e), "qr_codes": 0, "saved": []}
+    result["photo"] = image_path
+    result["seconds"] = round(timeit.default_timer() - start, 2)
+    return result
+
+
+def _init_batch_worker():
+    # the photos are processed in parallel, one thread each is enough for cv2
+    # and the qr codes
+    global _decode_qr_serially
+    cv2.setNumThreads(1)
+    _decode_qr_serially = True
+
+
+def get_photos(src):
+    """
+    the jpegs in a directory tree, sorted
+    """
+    photos = []
+    for subdir, dirs, files in os.walk(src):
+        for file in files:
+            if file.lower().endswith((".jpg", ".jpeg")) and not file.startswith("."):
+                photos.append(os.path.join(subdir, file))
+    return sorted(photos)
+
+
+def acquire_batch(paths, dest, workers=None, **kwargs):
+    """
+    acquire a batch of photos in worker processes
+
+    Args:
+        paths (list): paths of the photos
+        dest (str): destination directory
+        workers (int): number of worker processes. Defaults to the cpu count.
+        kwargs: passed on to acquire_photo
+    Yields:
+        the results of acquire_photo, with photo and seconds, in order of
+        completion
+    """
+    if workers is None:
+        workers = cpu_count()
+
+    acquire = functools.partial(_acquire_photo_safe, dest=dest, **kwargs)
+
+    if workers <= 1:
+        for path in paths:
+            yield acquire(path)
+        return
+
+    with Pool(processes=workers, initializer=_init_batch_worker) as pool:
+        for result in pool.imap_unordered(acquire, paths):
+            yield result
+
+
+def write_manifest(results, manifest):
+    """
+    write the results of a batch acquisition to a csv file, one row per photo
+    """
+    with open(manifest, mode="w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for result in sorted(results, key=lambda result: result["photo"]):
+            row = dict(result, saved=";".join(result["saved"]))
+            writer.writerow({field: row[field] for field in MANIFEST_FIELDS})
+
+
+def run_batch(src, dest, manifest=None, workers=None, **kwargs):
+    """
+    acquire all photos of a directory tree without an operator and write a
+    manifest of the accepted and rejected ones
+
+    Args:
+        src (str): directory tree of the photos
+        dest (str): destination directory
+        manifest (str): path of the manifest. Defaults to a timestamped csv
+            file in dest
+        workers (int): number of worker processes
+        kwargs: passed on to acquire_photo
+    """
+    if manifest is None:
+        manifest = os.path.join(
+            dest, "acquisition-%s.csv" % time.strftime("%Y%m%d-%H%M%S")
+        )
+
+    paths = get_photos(src)
+    click.secho("Acquiring %s photos..." % len(paths), fg="white")
+
+    start = timeit.default_timer()
+    results = []
+    statuses = collections.Counter()
+    for result in acquire_batch(paths, dest, workers, **kwargs):
+        results.append(result)
+        statuses[result["status"]] += 1
+        if result["status"] != "accepted":
+            msg = "%s %s: %s" % (result["photo"], result["status"], result["reason"])
+            click.secho(msg, fg="red" if result["status"] == "failed" else "yellow")
+    seconds = timeit.default_timer() - start
+
+    write_manifest(results, manifest)
+
+    click.secho(
+        "%s accepted, %s rejected, %s failed"
+        % (statuses["accepted"], statuses["rejected"], statuses["failed"]),
+        fg="green",
+    )
+    if seconds > 0:
+        click.secho("%.0f photos per hour" % (len(paths) * 3600 / seconds), fg="blue")
+    click.secho("Manifest written to %s" % manifest, fg="green")
+
+
+class IngestQueue:
+    """
+    prepares new photos in the background as soon as they are written. The
+    operator confirms them one after another in the order they arrived.
+    """
+
+    def __init__(
+        self,
+        dest,
+        tmp,
+        destdir,
+        destsub,
+        discard,
+        expected_carrots,
+        preview_scale=1,
+        ahead=MAX_PHOTOS_AHEAD,
+    ):
+        self.dest = dest
+        self.tmp = tmp
+        self.destdir = destdir
+        self.destsub = destsub
+        self.discard = discard
+        self.expected_carrots = expected_carrots
+        self.preview_scale = preview_scale
+
+        self.executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS)
+        self.box_pool = ThreadPool(processes=cpu_count())
+        # photos prepared ahead of the operator, each holds a full frame
+        self.ahead = threading.BoundedSemaphore(ahead)
+        self.photos = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        # set on shutdown, the ingest workers stop waiting once it is
+        self.stopped = threading.Event()
+
+    def add(self, image_path):
+        """
+        queue a new photo, photos that are already queued are ignored
+        """
+        with self.lock:
+            if image_path in self.queued:
+                return
+            self.queued.add(image_path)
+
+        future = self.executor.submit(self.prepare, image_path)
+        self.photos.put((image_path, future))
+        click.secho("%s photos in the queue." % self.photos.qsize(), fg="magenta")
+
+    def prepare(self, image_path):
+        while not self.ahead.acquire(timeout=INGEST_POLL_SECONDS):
+            if self.stopped.is_set():
+                raise Exception("The acquisition was stopped!")
+        if self.stopped.is_set():
+            raise Exception("The acquisition was stopped!")
+        if not wait_until_written(image_path, stop=self.stopped):
+            raise Exception("The photo was not written completely!")
+        return prepare_photo(
+            image_path,
+            self.expected_carrots,
+            self.box_pool,
+            self.preview_scale,
+            verbose=False,
+        )
+
+    def confirm_next(self, timeout=1):
+        """
+        let the operator confirm the next photo in the queue
+
+        Returns:
+            bool - False if no photo arrived within timeout seconds
+        """
+        try:
+            image_path, future = self.photos.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+        click.secho("Next up: %s" % image_path, fg="magenta")
+        try:
+            photo = future.result()
+            confirm_photo(
+                photo, self.dest, self.tmp, self.destdir, self.destsub, self.discard
+            )
+        except Exception as error:
+            click.secho("Could not process %s: %r" % (image_path, error), fg="red")
+        finally:
+            self.ahead.release()
+            with self.lock:
+                self.queued.discard(image_path)
+
+        msg = "🛎   Bing bong! "
+        click.secho(msg, fg="green")
+        click.secho("Ready for the next one.", fg="white")
+        return True
+
+    def close(self):
+        """
+        stop preparing photos. The photos still queued are dropped and the
+        workers waiting for their turn are woken up, so that the interpreter
+        does not wait for them at exit.
+        """
+        self.stopped.set()
+        while True:
+            try:
+                image_path, future = self.photos.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+        for _ in range(INGEST_WORKERS):
+            try:
+                self.ahead.release()
+            except ValueError:
+                # the semaphore is full, nobody is waiting for it
+                break
+        self.executor.shutdown(wait=False)
+        self.box_pool.terminate()
+
+
 class MyHandler(FileSystemEventHandler):
     def __init__(self, *args, **kwargs):
         super(MyHandler, self).__init__()
-        self.dest = kwargs["dest"]
-        self.tmp = kwargs["tmp"]
-        self.destdir = kwargs.get("destdir", None)
-        self.destsub = kwargs.get("destsub", None)
-        self.discard = kwargs.get("discard", None)
-        self.carrots = kwargs.get("carrots", None)
+        self.ingest = kwargs["ingest"]
 
     def on_created(self, event):
         msg = "New file %s detected." % event.src_path
         click.secho(msg, fg="magenta")
 
         if event.src_path.lower().endswith(".jpg"):
-
-            do_acquisition(
-                event.src_path,
-                self.dest,
-                self.tmp,
-                self.destdir,
-                self.destsub,
-                self.discard,
-                self.carrots,
-            )
-
-            msg = "🛎   Bing bong! "
-            click.secho(msg, fg="green")
-            click.secho("Ready for the next one.", fg="white")
+            self.ingest.add(event.src_path)
 
 
 @click.command()
+@click.option(
+    "--accept",
+    "-a",
+    type=click.Choice(list(ACCEPTANCE_RULES)),
+    multiple=True,
+    default=DEFAULT_ACCEPTANCE_RULES,
+    help="rules a photo has to pass in batch mode. Can be given more than once.",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    help="acquire all photos in src without asking, e.g. to re-acquire an archive",
+)
 @click.option(
     "--carrots", "-c", type=click.INT, help="number of carrots to expect", default=6
 )
@@ -294,15 +856,45 @@ class MyHandler(FileSystemEventHandler):
     type=click.Path(exists=True),
     help="a directory to copy the photo to if not processed",
 )
+@click.option(
+    "--manifest",
+    type=click.Path(),
+    help="csv file of the accepted and rejected photos in batch mode",
+)
+@click.option(
+    "--preview-scale",
+    type=click.IntRange(1, 8),
+    default=1,
+    help="shrink the boxes by this factor for a faster preview",
+)
 @click.option("--src", "-s", type=click.Path(exists=True), help="source file")
 @click.option(
     "--tmp",
     "-t",
     type=click.Path(exists=True),
     help="destination of tmp dir. Non dropbox dir is advised.",
-    required=True,
 )
-def run(carrots, dest, destdir, destsub, discard, tmp, src):
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    default=cpu_count(),
+    help="number of worker processes in batch mode",
+)
+def run(
+    accept,
+    batch,
+    carrots,
+    dest,
+    destdir,
+    destsub,
+    discard,
+    manifest,
+    preview_scale,
+    tmp,
+    src,
+    workers,
+):
     if src is None:
         click.secho("No source specified. Use --src option.", fg="red")
         return
@@ -310,6 +902,23 @@ def run(carrots, dest, destdir, destsub, discard, tmp, src):
         click.secho("No destination specified. Use --dest option.", fg="red")
         return
 
+    if batch:
+        run_batch(
+            src,
+            dest,
+            manifest=manifest,
+            workers=workers,
+            destdir=destdir,
+            destsub=destsub,
+            expected_carrots=carrots,
+            rules=accept,
+        )
+        return
+
+    if tmp is None:
+        click.secho("No tmp dir specified. Use --tmp option.", fg="red")
+        return
+
     msg = "I'm observing %s" % src
     click.secho(msg, fg="green")
 
@@ -319,23 +928,27 @@ def run(carrots, dest, destdir, destsub, discard, tmp, src):
     msg = "I'm writing to %s" % dest
     click.secho(msg, fg="blue")
 
-    event_handler = MyHandler(
+    ingest = IngestQueue(
         dest=dest,
-        discard=discard,
+        tmp=tmp,
         destdir=destdir,
         destsub=destsub,
-        carrots=carrots,
-        tmp=tmp,
+        discard=discard,
+        expected_carrots=carrots,
+        preview_scale=preview_scale,
     )
+    event_handler = MyHandler(ingest=ingest)
     observer = Observer()
     observer.schedule(event_handler, src, recursive=True)
     observer.start()
     try:
+        # the operator is asked in this thread, photo after photo
         while True:
-            time.sleep(1)
+            ingest.confirm_next()
     except KeyboardInterrupt:
         click.secho("   I'm shutting down... see ya!", fg="white")
         observer.stop()
+        ingest.close()
     observer.join()
 
 
@@ -0,0 +1,74 @@
+import collections
+import timeit
+
+import click
+import cv2
+import numpy as np
+
+from lib.column_stats import get_column_statistics
+
+# height x width of the masks, from a thumbnail to a full resolution photo
+MASK_SIZES = [(250, 500), (500, 1000), (1000, 2000), (2000, 4000), (3000, 6000)]
+
+
+def create_carrot_mask(height, width):
+    """
+    a white carrot lying on its side on black
+    """
+    mask = np.zeros((height, width), dtype=np.uint8)
+    center = (width // 2, height // 2)
+    axes = (int(width * 0.45), int(height * 0.3))
+    cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+    return mask
+
+
+def get_widths_by_counter(mask):
+    """
+    the widths of the columns the way they were counted before column_stats
+    """
+    width_array = []
+    for column in mask.T:
+        count = collections.Counter(column)
+        if count.get(255, None):
+            width_array.append(count.get(255) / 2)
+        else:
+            width_array.append(0)
+    return width_array
+
+
+def get_widths_by_column_stats(mask):
+    return get_column_statistics(mask).widths.tolist()
+
+
+@click.command()
+@click.option(
+    "--repeat", "-r", type=click.INT, default=3, help="runs per size, best one counts"
+)
+def run(repeat):
+    """
+    compare counting the white pixels of every column of a mask with a
+    Counter per column to the vectorized column statistics
+    """
+    click.echo("%12s %12s %12s %9s" % ("mask", "Counter", "column_stats", "speedup"))
+    for height, width in MASK_SIZES:
+        mask = create_carrot_mask(height, width)
+        assert get_widths_by_counter(mask) == get_widths_by_column_stats(mask)
+
+        seconds = []
+        for function in (get_widths_by_counter, get_widths_by_column_stats):
+            seconds.append(
+                min(timeit.repeat(lambda: function(mask), number=1, repeat=repeat))
+            )
+        click.echo(
+            "%12s %10.1fms %10.1fms %8.0fx"
+            % (
+                "%sx%s" % (height, width),
+                seconds[0] * 1000,
+                seconds[1] * 1000,
+                seconds[0] / seconds[1],
+            )
+        )
+
+
+if __name__ == "__main__":
+    run()
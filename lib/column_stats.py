@@ -0,0 +1,100 @@
+import numpy as np
+
+WHITE = 255
+
+
+def count_white_pixels(array):
+    """
+    count the white pixels in a row or column of a mask
+    """
+    return int(np.count_nonzero(np.asarray(array) == WHITE))
+
+
+class ColumnStatistics:
+    """
+    statistics of every column of a mask, computed at once with numpy instead
+    of counting the pixels column by column
+
+    Attributes:
+        white_counts (np.array): per column, number of white pixels
+        widths (np.array): per column, half the number of white pixels. That
+            is the width of the carrot from its symmetry axis
+        has_white (np.array): per column, whether it has a white pixel
+        first_white (np.array): per column, index of the first white pixel
+            from the top (0 for an empty column)
+        last_white (np.array): per column, index of the last white pixel from
+            the top (-1 for an empty column)
+    """
+
+    def __init__(self, mask):
+        white = np.asarray(mask) == WHITE
+        height = white.shape[0]
+
+        self.white_counts = np.count_nonzero(white, axis=0)
+        self.widths = self.white_counts / 2
+        self.has_white = self.white_counts > 0
+        self.first_white = np.argmax(white, axis=0)
+        self.last_white = np.where(
+            self.has_white, height - 1 - np.argmax(white[::-1], axis=0), -1
+        )
+
+    def get_white_columns(self):
+        """
+        the indices of the columns with white pixels, from left to right
+        """
+        return np.flatnonzero(self.has_white)
+
+
+def get_column_statistics(mask):
+    """
+    returns the ColumnStatistics of a mask. Pass through if the argument
+    already is a ColumnStatistics.
+    """
+    if isinstance(mask, ColumnStatistics):
+        return mask
+    return ColumnStatistics(mask)
+
+
+class ColumnRuns:
+    """
+    run-length encoding of the white pixels of every column of a mask. A run
+    is a bin of consecutive white pixels within a column.
+
+    Attributes:
+        columns (np.array): per run, index of its column. Runs are sorted by
+            column, then from top to bottom
+        starts (np.array): per run, index of its first pixel from the top
+        lengths (np.array): per run, number of pixels
+        longest (np.array): per column, length of its longest run (0 for an
+            empty column)
+    """
+
+    def __init__(self, mask):
+        white = np.asarray(mask) == WHITE
+
+        # the changes between black and white down every column. The padding
+        # makes every column start and end black, so its changes alternate
+        # between the start of a run and the end of it
+        padded = np.pad(white, ((1, 1), (0, 0)), "constant")
+        changes = np.diff(padded, axis=0)
+        columns, rows = np.nonzero(changes.T)
+        self.columns = columns[::2]
+        self.starts = rows[::2]
+        self.lengths = rows[1::2] - self.starts
+
+        self.longest = np.zeros(white.shape[1], dtype=int)
+        if len(self.lengths):
+            first_runs = np.flatnonzero(np.diff(self.columns, prepend=-1))
+            self.longest[self.columns[first_runs]] = np.maximum.reduceat(
+                self.lengths, first_runs
+            )
+
+
+def get_column_runs(mask):
+    """
+    returns the ColumnRuns of a mask. Pass through if the argument already is
+    a ColumnRuns.
+    """
+    if isinstance(mask, ColumnRuns):
+        return mask
+    return ColumnRuns(mask)
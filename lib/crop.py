@@ -4,7 +4,7 @@ import imutils
 from multiprocessing import Pool
 import numpy as np
 import os
-from scipy import ndimage
+import re
 import shutil
 import subprocess
 import timeit
@@ -25,12 +25,24 @@ from phenotype import (
     get_biomass,
     get_index_of_shoulder,
 )
+from lib.manifest import read_manifest, select_changed_files, write_manifest
+from lib.mask_cache import (
+    get_mask_key,
+    get_mask_parameters,
+    hash_parameters,
+    restore_mask,
+    store_mask,
+)
+from lib.straighten import (
+    DEFAULT_SKELETON_BACKEND,
+    skeleton_timings,
+    straighten_mask,
+)
 from lib.utils import (
     get_files_to_process,
     read_file,
     write_file,
     get_attributes_from_filename,
-    count_white_pixels,
     get_threshold_values,
     detect_backdrop,
 )
@@ -283,7 +295,7 @@ def create_binary_mask_by_index(image, threshold=0.1, smoothen=0):
     Detect by using an RGB index
     """
 
-    (B, G, R) = cv2.split(image.astype("float"))
+    B, G, R = cv2.split(image.astype("float"))
 
     blue_index = np.absolute((B - R) / (B + R))
 
@@ -403,8 +415,38 @@ def reduce_to_contour(image, minimize=False):
     return mask
 
 
-# TODO: remove dest argument
-def straighten_binary_masks(src, dest=None):
+def trim_straightened_mask(mask):
+    """
+    crop away the unnecessary black around a straightened mask
+    """
+    black_row = np.zeros((10, mask.shape[1]), dtype=np.uint8)
+    mask = np.vstack([black_row, mask, black_row])
+    black_col = np.zeros((mask.shape[0], 10), dtype=np.uint8)
+    mask = np.hstack([black_col, mask, black_col])
+    return reduce_to_contour(mask, True)
+
+
+def convert_curvature_to_mm(curvature, filename):
+    """
+    convert the curvature to mm if the filename holds a scale.
+    Same conversion (and int division) as the java straightener.
+
+    Args:
+        curvature (int): curvature in px
+        filename (str): name of the mask file
+    """
+    match = re.search(r"{scale_([^}]+)}", filename.lower())
+    if match is None:
+        return curvature
+    try:
+        px_per_10_cm = int(match.group(1))
+    except ValueError:
+        # medium format scales are per mm
+        px_per_10_cm = 100 * int(match.group(1).split("_")[0])
+    return curvature * 100 // px_per_10_cm
+
+
+def straighten_binary_masks_java(src):
     """
     pass the created binary masks into the java straightener
 
@@ -427,15 +469,166 @@ def straighten_binary_masks(src, dest=None):
     for file in os.listdir(src):
         src_filepath = os.path.join(src, file)
         mask = cv2.imread(src_filepath, cv2.IMREAD_GRAYSCALE)
-        # TODO: stack black rows
-        black_row = np.zeros((10, mask.shape[1]), dtype=np.uint8)
-        mask = np.vstack([black_row, mask, black_row])
-        black_col = np.zeros((mask.shape[0], 10), dtype=np.uint8)
-        mask = np.hstack([black_col, mask, black_col])
-        mask = reduce_to_contour(mask, True)
+        mask = trim_straightened_mask(mask)
         cv2.imwrite(src_filepath, mask)
 
 
+def get_masks_to_straighten(src):
+    """
+    the binary masks of a directory that are not straightened masks themselves
+    """
+    return [
+        os.path.join(src, file)
+        for file in os.listdir(src)
+        if not file.startswith(".") and "Curvature" not in file
+    ]
+
+
+def straighten_binary_mask_file(
+    src_filepath, skeleton_backend=DEFAULT_SKELETON_BACKEND
+):
+    """
+    straighten a binary mask along its midline. The straightened mask is
+    written next to it with its {Curvature_n} appended.
+
+    Returns:
+        (masks, seconds) skeletonized for the mask, see skeleton_timings
+    """
+    masks_before, seconds_before = skeleton_timings[skeleton_backend]
+
+    mask = cv2.imread(src_filepath, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        return 0, 0.0
+
+    click.echo("Straightening %s" % src_filepath)
+    try:
+        straight, curvature = straighten_mask(mask, skeleton_backend=skeleton_backend)
+    except Exception as error:
+        click.secho(src_filepath, fg="red")
+        click.secho(repr(error), fg="red")
+    else:
+        src, file = os.path.split(src_filepath)
+        curvature = convert_curvature_to_mm(curvature, file)
+        name, extension = os.path.splitext(file)
+        filename = "%s{Curvature_%s}%s" % (name, curvature, extension)
+        cv2.imwrite(os.path.join(src, filename), trim_straightened_mask(straight))
+
+    masks, seconds = skeleton_timings[skeleton_backend]
+    return masks - masks_before, seconds - seconds_before
+
+
+def report_skeleton_timings(timings, skeleton_backend):
+    """
+    print the time spent skeletonizing
+
+    Args:
+        timings (list): (masks, seconds) as returned by straighten_binary_mask_file
+        skeleton_backend (str): how the masks were skeletonized
+    """
+    masks = sum(masks for masks, seconds in timings)
+    seconds = sum(seconds for masks, seconds in timings)
+    if masks:
+        click.secho(
+            "Skeletonized %s masks with %s in %.2fs (%.3fs per mask)"
+            % (masks, skeleton_backend, seconds, seconds / masks),
+            fg="blue",
+        )
+
+
+# TODO: remove dest argument
+def straighten_binary_masks(
+    src, dest=None, java=False, skeleton_backend=DEFAULT_SKELETON_BACKEND
+):
+    """
+    straighten the binary masks of a directory along their midline.
+    The straightened masks are written next to the binary masks with
+    their {Curvature_n} appended.
+
+    Args:
+        src (str): absolute path to the binary_maks dir
+        java (bool): use the legacy java straightener instead
+        skeleton_backend (str): how to skeletonize the masks
+    """
+    if java:
+        straighten_binary_masks_java(src)
+        return
+
+    timings = [
+        straighten_binary_mask_file(src_filepath, skeleton_backend)
+        for src_filepath in get_masks_to_straighten(src)
+    ]
+    report_skeleton_timings(timings, skeleton_backend)
+
+
+def fill_shoulder_gaps(contour):
+    """
+    fill the gaps in the last columns of the contour, the shoulder, and make
+    the outermost columns about as long as the ones next to them
+
+    Args:
+        contour (np.array): the mask as returned by reduce_to_contour, 0 and
+            255 only. It is changed in place
+    Returns:
+        the repaired contour
+    """
+    white_columns = np.flatnonzero(np.any(contour, axis=0))
+    if not len(white_columns):
+        return contour
+
+    # offset of the last white column from the right edge
+    last_white = white_columns[-1] - contour.shape[1] + 1
+
+    # fill the gaps in the 7 columns up to the last white one: like
+    # binary_fill_holes does for a single column, everything between the
+    # first and the last white pixel of a column becomes white
+    columns = last_white - np.arange(1, 8)
+    shoulder = contour[:, columns] > 0
+    below_first = np.logical_or.accumulate(shoulder, axis=0)
+    above_last = np.logical_or.accumulate(shoulder[::-1], axis=0)[::-1]
+    contour[:, columns] = (below_first & above_last).astype(np.uint8) * 255
+
+    # ensure shoulder symmetry
+
+    # as few magic numbers as possible
+    columns_to_consider = 2
+    length_difference = 0.9
+
+    for i in range(columns_to_consider, 0, -1):
+        column = contour[:, last_white - i].copy()
+        prev_column = contour[:, last_white - i - 1].copy()
+        white_pixels = np.count_nonzero(column)
+        white_pixels_prev = np.count_nonzero(prev_column)
+
+        if white_pixels <= white_pixels_prev * length_difference:
+
+            # this column
+            first_white_pixel_col = column.argmax()
+            last_white_pixel_col = len(column) - 2 - column[::-1].argmax()
+
+            # prev column
+            first_white_pixel_prev_col = prev_column.argmax()
+            last_white_pixel_prev_col = (
+                len(prev_column) - 2 - prev_column[::-1].argmax()
+            )
+
+            # where's the gap?
+            start = abs(first_white_pixel_col - first_white_pixel_prev_col)
+            end = abs(last_white_pixel_col - last_white_pixel_prev_col)
+
+            if start < end:
+                # start at start
+                pixel = white_pixels_prev - start * 2 - 2
+                column[first_white_pixel_col : first_white_pixel_col + pixel] = 255
+                contour[:, last_white - i] = column
+            else:
+                # start at end
+                pixel = white_pixels_prev - end * 2 - 2
+                column[last_white_pixel_col - pixel : last_white_pixel_col] = 255
+                contour[:, last_white - i] = column
+
+    return reduce_to_contour(contour, minimize=False)
+
+
 def create_binary_mask(
     image, smoothen=0, minimize=True, old=False, no_black_tape=False
 ):
@@ -469,63 +662,7 @@ def create_binary_mask(
     else:
         contour = reduce_to_contour(binary_by_thresh, minimize=minimize)
 
-    # find gaps in first shoulder column and fill them
-    trans = contour.T
-    trans_reverse = trans[::-1]
-
-    last_white = None
-    for i, col in enumerate(trans_reverse):
-        white_pixels = count_white_pixels(col)
-        if white_pixels:
-            last_white = i * -1
-            break
-
-    if last_white is not None:
-        for i in range(1, 8):
-            column = contour[:, last_white - i].copy()
-            column_filled = ndimage.binary_fill_holes(column).astype(int) * 255
-            contour[:, last_white - i] = column_filled
-
-        # ensure shoulder symmetry
-
-        # as few magic numbers as possible
-        columns_to_consider = 2
-        length_difference = 0.9
-
-        for i in range(columns_to_consider, 0, -1):
-            column = contour[:, last_white - i].copy()
-            prev_column = contour[:, last_white - i - 1].copy()
-            white_pixels = count_white_pixels(column)
-            white_pixels_prev = count_white_pixels(prev_column)
-
-            if white_pixels <= white_pixels_prev * length_difference:
-
-                # this column
-                first_white_pixel_col = column.argmax()
-                last_white_pixel_col = len(column) - 2 - column[::-1].argmax()
-
-                # prev column
-                first_white_pixel_prev_col = prev_column.argmax()
-                last_white_pixel_prev_col = (
-                    len(prev_column) - 2 - prev_column[::-1].argmax()
-                )
-
-                # where's the gap?
-                start = abs(first_white_pixel_col - first_white_pixel_prev_col)
-                end = abs(last_white_pixel_col - last_white_pixel_prev_col)
-
-                if start < end:
-                    # start at start
-                    pixel = white_pixels_prev - start * 2 - 2
-                    column[first_white_pixel_col : first_white_pixel_col + pixel] = 255
-                    contour[:, last_white - i] = column
-                else:
-                    # start at end
-                    pixel = white_pixels_prev - end * 2 - 2
-                    column[last_white_pixel_col - pixel : last_white_pixel_col] = 255
-                    contour[:, last_white - i] = column
-
-        contour = reduce_to_contour(contour, minimize=False)
+    contour = fill_shoulder_gaps(contour)
 
     # find and eliminate "empty" bins at right edge of image
     shoulder_index = get_index_of_shoulder(contour.T)
@@ -536,7 +673,7 @@ def create_binary_mask(
 
 def create_mask_overlay(image, smoothen=0, old=False, no_black_tape=False):
     """
-    create binary mask and put if over the original image 
+    create binary mask and put if over the original image
     inspiration: https://www.pyimagesearch.com/2016/03/07/transparent-overlays-with-opencv/
 
     Args:
@@ -613,7 +750,7 @@ def create_mask_overlay(image, smoothen=0, old=False, no_black_tape=False):
 
 def get_target_dir(dirpath, method_name, clear=False):
     """
-    create the name of the target dir as a combination of the source dir and 
+    create the name of the target dir as a combination of the source dir and
     the method name
     """
 
@@ -701,20 +838,156 @@ def mask_overlay_parallel(
         dir_name = method
     target = get_target_dir(dir["path"], dir_name, clear)
     for file in dir["files"]:
-        try:
-            log_activity(file, method)
-            image = read_file(file)
-            masked_overlay = create_mask_overlay(
-                image, smoothen=smoothen, old=old, no_black_tape=no_black_tape
-            )
-            filename = file.split("/")[-1]
-            write_file(masked_overlay, target, filename)
-        except:
-            click.secho(file, fg="red")
+        mask_overlay_file(file, target, smoothen, old, no_black_tape)
+
+
+def mask_overlay_file(file, target, smoothen, old, no_black_tape=False):
+    """
+    create the mask overlay of a photo in target
+    """
+    method = MASK_OVERLAYS_DIR
+    try:
+        log_activity(file, method)
+        image = read_file(file)
+        masked_overlay = create_mask_overlay(
+            image, smoothen=smoothen, old=old, no_black_tape=no_black_tape
+        )
+        filename = file.split("/")[-1]
+        write_file(masked_overlay, target, filename)
+    except:
+        click.secho(file, fg="red")
+
+
+def plan_binary_masks(
+    dir,
+    smoothen,
+    old,
+    clear,
+    out_dir_name=None,
+    no_black_tape=False,
+    incremental=False,
+):
+    """
+    prepare the target dir of the binary masks of a directory and decide which
+    photos to mask. See binary_mask_parallel for the arguments.
+
+    Returns:
+        dict with the dir, its target, the files to mask and for incremental
+        runs the manifest and the fingerprints of the files
+    """
+    method = "binary-masks"
+    if out_dir_name is not None:
+        dir_name = "__".join([method, out_dir_name])
+    else:
+        dir_name = method
+    target = get_target_dir(dir["path"], dir_name, clear and not incremental)
+
+    plan = {"dir": dir, "target": target, "files": dir["files"]}
+    if incremental:
+        plan["manifest"] = read_manifest(target)
+        parameters_key = hash_parameters(
+            get_mask_parameters(smoothen, old, no_black_tape)
+        )
+        plan["files"], plan["fingerprints"] = select_changed_files(
+            dir["files"], target, plan["manifest"], parameters_key
+        )
+        click.secho(
+            "%s: %s of %s photos changed"
+            % (dir["path"], len(plan["files"]), len(dir["files"])),
+            fg="blue",
+        )
+    return plan
+
+
+def binary_mask_file(file, target, smoothen, old, no_black_tape=False, cache_dir=None):
+    """
+    create the binary mask of a photo in target
+
+    Returns:
+        dict with whether the mask was written (ok) and came from the cache
+    """
+    method = "binary-masks"
+    log_activity(file, method, False)
+    filename = file.split("/")[-1]
+    try:
+        minimize = True
+        key = None
+        if cache_dir:
+            key = get_mask_key(file, smoothen, old, no_black_tape, minimize)
+            if restore_mask(key, os.path.join(target, filename), cache_dir):
+                return {"ok": True, "cached": True}
+
+        image = read_file(file)
+        binary_mask = create_binary_mask(
+            image,
+            smoothen=smoothen,
+            minimize=minimize,
+            old=old,
+            no_black_tape=no_black_tape,
+        )
+        write_file(binary_mask, target, filename)
+
+        if key:
+            store_mask(key, os.path.join(target, filename), cache_dir)
+
+        return {"ok": True, "cached": False}
+
+    except Exception as error:
+        click.secho(file, fg="red")
+        click.secho(repr(error), fg="red")
+        return {"ok": False, "cached": False}
+
+
+def finish_binary_masks(plan, results, cache_dir=None):
+    """
+    update the manifest of an incremental run with the masks written
+
+    Args:
+        plan (dict): as returned by plan_binary_masks
+        results (list): what binary_mask_file returned for the files of the plan
+        cache_dir (str): directory of the mask cache, None if not used
+    Returns:
+        list of the filenames of the masks written
+    """
+    manifest = plan.get("manifest")
+    written = []
+    for file, result in zip(plan["files"], results):
+        filename = file.split("/")[-1]
+        if result["ok"]:
+            written.append(filename)
+            if manifest is not None:
+                manifest[filename] = plan["fingerprints"][file]
+        elif manifest is not None and manifest.pop(filename, None):
+            # don't keep the mask of the photo before it changed. It may be gone
+            # already, deleted by hand
+            try:
+                os.remove(os.path.join(plan["target"], filename))
+            except FileNotFoundError:
+                pass
+
+    if manifest is not None:
+        write_manifest(plan["target"], manifest)
+
+    if cache_dir:
+        hits = len([1 for result in results if result["cached"]])
+        click.secho(
+            "%s: %s of %s masks from the cache"
+            % (plan["dir"]["path"], hits, len(results)),
+            fg="blue",
+        )
+
+    return written
 
 
 def binary_mask_parallel(
-    dir, smoothen, old, clear, out_dir_name=None, no_black_tape=False
+    dir,
+    smoothen,
+    old,
+    clear,
+    out_dir_name=None,
+    no_black_tape=False,
+    cache_dir=None,
+    incremental=False,
 ):
     """
     create binary masks in parallel
@@ -728,29 +1001,17 @@ def binary_mask_parallel(
         clear           <bool>: should the output dir be cleared?
         out_dir_name    <str>: alternative name for output dir
         no_black_tape   <bool>: no black tape arround carrot
+        cache_dir       <str>: directory of the mask cache, None to not use it
+        incremental     <bool>: only mask new or changed photos and remove the
+                                masks of deleted ones, instead of clearing
+    Returns:
+        list of the filenames of the masks written
     """
-    method = "binary-masks"
-    if out_dir_name is not None:
-        dir_name = "__".join([method, out_dir_name])
-    else:
-        dir_name = method
-    target = get_target_dir(dir["path"], dir_name, clear)
-    for file in dir["files"]:
-        log_activity(file, method, False)
-        try:
-            image = read_file(file)
-            filename = file.split("/")[-1]
-
-            minimize = True
-            binary_mask = create_binary_mask(
-                image,
-                smoothen=smoothen,
-                minimize=minimize,
-                old=old,
-                no_black_tape=no_black_tape,
-            )
-            write_file(binary_mask, target, filename)
-
-        except Exception as error:
-            click.secho(file, fg="red")
-            click.secho(repr(error), fg="red")
+    plan = plan_binary_masks(
+        dir, smoothen, old, clear, out_dir_name, no_black_tape, incremental
+    )
+    results = [
+        binary_mask_file(file, plan["target"], smoothen, old, no_black_tape, cache_dir)
+        for file in plan["files"]
+    ]
+    return finish_binary_masks(plan, results, cache_dir)
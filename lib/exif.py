@@ -0,0 +1,145 @@
+import struct
+
+# tags of IFD0
+MAKE = 0x010F
+MODEL = 0x0110
+EXIF_IFD_POINTER = 0x8769
+
+# tags of the Exif IFD
+FNUMBER = 0x829D
+SUBJECT_DISTANCE = 0x9206
+FOCAL_LENGTH = 0x920A
+LENS_MODEL = 0xA434
+
+# size in bytes per value of the TIFF field types
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+SOI = b"\xff\xd8"
+APP1 = 0xE1
+SOS = 0xDA
+
+
+def read_exif_segment(image_path):
+    """
+    read the Exif APP1 segment of a jpeg. Only the header of the file is read,
+    the image data is not touched.
+
+    Returns:
+        the TIFF structure of the segment as bytes, None if there is none
+    """
+    with open(image_path, "rb") as f:
+        if f.read(2) != SOI:
+            return None
+
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            # standalone markers without a length
+            if 0xD0 <= marker[1] <= 0xD9 or marker[1] == 0x01:
+                continue
+            if marker[1] == SOS:
+                return None
+
+            # a truncated header ends the search like a missing segment
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            (length,) = struct.unpack(">H", length_bytes)
+            if length < 2:
+                return None
+            if marker[1] == APP1:
+                data = f.read(length - 2)
+                if data.startswith(b"Exif\x00\x00"):
+                    return data[6:]
+            else:
+                f.seek(length - 2, 1)
+
+
+def read_ifd(tiff, offset, byte_order):
+    """
+    parse the entries of an image file directory
+
+    Returns:
+        dict of tag: value. Rationals are converted to floats, ascii to str,
+        counts of 1 are unpacked
+    """
+    (count,) = struct.unpack(byte_order + "H", tiff[offset : offset + 2])
+    entries = {}
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, field_type, n = struct.unpack(byte_order + "HHI", tiff[entry : entry + 8])
+        size = TYPE_SIZES.get(field_type)
+        if size is None:
+            continue
+
+        value_offset = entry + 8
+        if size * n > 4:
+            (value_offset,) = struct.unpack(
+                byte_order + "I", tiff[value_offset : value_offset + 4]
+            )
+        raw = tiff[value_offset : value_offset + size * n]
+
+        if field_type == 2:
+            value = raw.split(b"\x00")[0].decode("ascii", "replace").strip()
+        elif field_type in (5, 10):
+            fmt = "I" if field_type == 5 else "i"
+            numbers = struct.unpack(byte_order + fmt * 2 * n, raw)
+            value = [
+                numerator / denominator if denominator else None
+                for numerator, denominator in zip(numbers[::2], numbers[1::2])
+            ]
+        elif field_type in (3, 4, 9):
+            fmt = {3: "H", 4: "I", 9: "i"}[field_type]
+            value = list(struct.unpack(byte_order + fmt * n, raw))
+        else:
+            value = raw
+
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        entries[tag] = value
+
+    return entries
+
+
+def read_exif(image_path):
+    """
+    read the tags of IFD0 and the Exif IFD of a jpeg
+
+    Returns:
+        dict of tag: value, empty if the image has no exif data
+    """
+    tiff = read_exif_segment(image_path)
+    if not tiff or len(tiff) < 8:
+        return {}
+
+    try:
+        byte_order = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        (ifd0_offset,) = struct.unpack(byte_order + "I", tiff[4:8])
+        tags = read_ifd(tiff, ifd0_offset, byte_order)
+        exif_offset = tags.get(EXIF_IFD_POINTER)
+        if exif_offset:
+            tags.update(read_ifd(tiff, exif_offset, byte_order))
+    except (KeyError, struct.error):
+        return {}
+
+    return tags
+
+
+def get_lens_setting(image_path):
+    """
+    the camera and lens settings the photo was taken with
+
+    Returns:
+        dict with camera_maker, camera_model, lens_model, focal_length,
+        aperture and distance, None for the ones not in the exif data
+    """
+    tags = read_exif(image_path)
+    return {
+        "camera_maker": tags.get(MAKE),
+        "camera_model": tags.get(MODEL),
+        "lens_model": tags.get(LENS_MODEL),
+        "focal_length": tags.get(FOCAL_LENGTH),
+        "aperture": tags.get(FNUMBER),
+        "distance": tags.get(SUBJECT_DISTANCE),
+    }
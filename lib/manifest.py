@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+
+# the fingerprints of the sources of the files in an output directory
+MANIFEST_FILE = ".manifest.json"
+
+
+def get_fingerprint(file, parameters_key):
+    """
+    cheap fingerprint of a source file: its size and mtime, together with the
+    parameters it is processed with. Nothing is read from the file.
+    """
+    stat = os.stat(file)
+    return "%s:%s:%s" % (stat.st_size, stat.st_mtime_ns, parameters_key)
+
+
+def read_manifest(target):
+    """
+    Returns:
+        dict of output filename: fingerprint of its source, empty if the
+        directory has no (readable) manifest
+    """
+    try:
+        with open(os.path.join(target, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(target, manifest):
+    """
+    write the manifest atomically, an interrupted run leaves the old one
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=target, suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(target, MANIFEST_FILE))
+
+
+def select_changed_files(files, target, manifest, parameters_key):
+    """
+    the sources that are new or changed since the manifest was written. The
+    outputs of sources that disappeared are removed from target and manifest.
+
+    Args:
+        files (list): paths of the sources. Their output in target has the
+            same filename
+        target (str): output directory
+        manifest (dict): as returned by read_manifest, updated in place
+        parameters_key (str): hash of the parameters the sources are
+            processed with
+    Returns:
+        (changed, fingerprints) - the paths of the changed sources and the
+        fingerprint per path
+    """
+    fingerprints = {file: get_fingerprint(file, parameters_key) for file in files}
+    filenames = {os.path.basename(file) for file in files}
+
+    for filename in list(manifest):
+        if filename not in filenames:
+            try:
+                os.remove(os.path.join(target, filename))
+            except OSError:
+                pass
+            del manifest[filename]
+
+    changed = [
+        file
+        for file in files
+        if manifest.get(os.path.basename(file)) != fingerprints[file]
+        or not os.path.exists(os.path.join(target, os.path.basename(file)))
+    ]
+    return changed, fingerprints
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from lib.utils import get_threshold_values
+
+# bump this whenever create_binary_mask changes its output, so that masks of
+# the old pipeline are not served from the cache anymore
+MASK_PIPELINE_VERSION = 1
+
+# binary masks are cached here, keyed by their raw photo and parameters
+MASK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "carrots", "masks")
+
+# the least recently used masks are evicted beyond this size (bytes)
+MASK_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_mask_parameters(smoothen, old, no_black_tape, minimize=True):
+    """
+    everything a binary mask depends on besides its raw photo
+
+    Args:
+        smoothen (int): erosion iterations
+        old (bool): is this an "old" picture
+        no_black_tape (bool): no black tape arround carrot
+        minimize (bool): see reduce_to_contour
+    Returns:
+        list of the parameters
+    """
+    return [
+        MASK_PIPELINE_VERSION,
+        smoothen,
+        old,
+        no_black_tape,
+        minimize,
+        get_threshold_values("white", old),
+        get_threshold_values("black", old),
+    ]
+
+
+def hash_parameters(parameters):
+    return hashlib.sha1(json.dumps(parameters).encode("utf-8")).hexdigest()
+
+
+def get_mask_key(file, smoothen, old, no_black_tape, minimize=True):
+    """
+    the cache key of the binary mask of a raw photo: a hash of the bytes of the
+    photo and of everything the mask depends on
+
+    Args:
+        file (str): path to the raw photo
+        see get_mask_parameters for the others
+    Returns:
+        the key as hex string
+    """
+    digest = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    parameters = get_mask_parameters(smoothen, old, no_black_tape, minimize) + [
+        digest.hexdigest(),
+        # the mask is written in the format of the photo
+        os.path.splitext(file)[1].lower(),
+    ]
+    return hash_parameters(parameters)
+
+
+def get_cache_path(key, cache_dir):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def restore_mask(key, target_file, cache_dir):
+    """
+    copy a cached mask to its target, without decoding anything
+
+    Returns:
+        bool - whether the mask was in the cache
+    """
+    cache_path = get_cache_path(key, cache_dir)
+    try:
+        shutil.copyfile(cache_path, target_file)
+    except IOError:
+        return False
+
+    # mark as recently used
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return True
+
+
+def store_mask(key, mask_file, cache_dir):
+    """
+    put a mask that has been written to disk into the cache. This is atomic, so
+    that concurrent workers never read a partial mask.
+    """
+    cache_path = get_cache_path(key, cache_dir)
+    directory = os.path.dirname(cache_path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        shutil.copyfile(mask_file, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except (IOError, OSError) as error:
+        click.secho("Could not cache the mask: %s" % error, fg="yellow")
+
+
+def prune_mask_cache(cache_dir=MASK_CACHE_DIR, max_bytes=MASK_CACHE_MAX_BYTES):
+    """
+    evict the least recently used masks until the cache fits into max_bytes
+
+    Returns:
+        int - number of evicted masks
+    """
+    entries = []
+    total = 0
+    for subdir, dirs, files in os.walk(cache_dir):
+        for file in files:
+            path = os.path.join(subdir, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    evicted = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    return evicted
@@ -0,0 +1,112 @@
+import collections
+import os
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks on windows, only the writers of one process are in sync
+    fcntl = None
+
+UID_RE = r"{uid_(?P<uid>.+?)}"
+PHOTO_RE = r"{photo_(?P<photo>\d+)}"
+
+# every photo number handed out for a destination directory is appended to
+# this file, so that processes writing to the same directory see each other's
+# photos without listing the directory again
+INDEX_JOURNAL = ".uid-index"
+
+# per destination directory: the highest photo number per uid and how far the
+# journal has been read
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_uid(filename):
+    """
+    the uid in a filename, None if there is none
+    """
+    uid_match = re.search(UID_RE, filename.lower())
+    if uid_match:
+        return uid_match.groupdict().get("uid", None)
+    return None
+
+
+def scan_photo_numbers(dest_dir):
+    """
+    the photo numbers taken per uid by the files of a directory. That is the
+    number of photos of the uid, or its highest {Photo_n} if that is higher.
+
+    Returns:
+        dict of uid: number
+    """
+    counts = collections.Counter()
+    highest = collections.Counter()
+    for file in os.listdir(dest_dir):
+        uid = get_uid(file)
+        if uid is None:
+            continue
+        counts[uid] += 1
+        photo_match = re.search(PHOTO_RE, file.lower())
+        if photo_match:
+            photo = int(photo_match.group("photo"))
+            highest[uid] = max(highest[uid], photo)
+
+    return {uid: max(count, highest[uid]) for uid, count in counts.items()}
+
+
+def read_journal(journal, index):
+    """
+    apply the photo numbers other writers appended to the journal since it
+    was read last
+    """
+    journal.seek(index["offset"])
+    data = journal.read()
+    # a line is only complete once its newline is written
+    complete = data.rfind(b"\n") + 1
+    for line in data[:complete].decode("utf-8").splitlines():
+        try:
+            uid, number = line.split("\t")
+            number = int(number)
+        except ValueError:
+            continue
+        index["numbers"][uid] = max(index["numbers"].get(uid, 0), number)
+    index["offset"] += complete
+
+
+def next_photo_number(dest_dir, uid):
+    """
+    reserve the next photo number of a uid in a destination directory.
+
+    The directory is scanned once per process, later photos are counted in
+    memory. The journal is locked while a number is handed out, so that
+    concurrent writers never get the same number. Numbers are not reused.
+
+    Args:
+        dest_dir (str): destination directory of the photo
+        uid (str): uid of the carrot, lowercase
+    Returns:
+        int - the n of {Photo_n}
+    """
+    dest_dir = os.path.abspath(dest_dir)
+    with _indexes_lock:
+        with open(os.path.join(dest_dir, INDEX_JOURNAL), "a+b") as journal:
+            if fcntl is not None:
+                fcntl.flock(journal, fcntl.LOCK_EX)
+
+            index = _indexes.get(dest_dir)
+            if index is None:
+                index = {"numbers": scan_photo_numbers(dest_dir), "offset": 0}
+                _indexes[dest_dir] = index
+            read_journal(journal, index)
+
+            number = index["numbers"].get(uid, 0) + 1
+            line = ("%s\t%s\n" % (uid, number)).encode("utf-8")
+            journal.write(line)
+            journal.flush()
+            index["numbers"][uid] = number
+            index["offset"] += len(line)
+
+            # the lock is released when the journal is closed
+    return number
@@ -0,0 +1,149 @@
+import collections
+import os
+import timeit
+
+import click
+import cv2
+
+from lib.constants import BINARY_MASKS_DIR, DETIPPED_MASKS_DIR, STRAIGHTENED_MASKS_DIR
+from lib.crop import convert_curvature_to_mm, create_binary_mask, trim_straightened_mask
+from lib.straighten import DEFAULT_SKELETON_BACKEND, straighten_mask
+from lib.tip_mask import cut_tip, get_tip_index, get_tip_length_and_biomass
+from lib.utils import get_attributes_from_filename, pixel_to_mm, read_file
+from phenotype import assemble_instance_from_mask
+
+# the masks of these stages can be written to disk along the way, into the
+# same directories the separate scripts write them to
+PIPELINE_OUTPUTS = collections.OrderedDict(
+    [
+        ("binary", BINARY_MASKS_DIR),
+        ("straight", STRAIGHTENED_MASKS_DIR),
+        ("detipped", DETIPPED_MASKS_DIR),
+    ]
+)
+
+
+def get_filename(attributes, extension):
+    """
+    the filename of a mask with its attributes as {key_value} pairs
+    """
+    pairs = "".join("{%s_%s}" % (key, value) for key, value in attributes.items())
+    return pairs + extension
+
+
+def write_output(mask, file, output, attributes, outputs):
+    """
+    write the mask of a stage next to the photo, if that output was requested
+    """
+    if output not in outputs:
+        return
+    target = os.path.join(os.path.dirname(file), PIPELINE_OUTPUTS[output])
+    os.makedirs(target, exist_ok=True)
+    extension = os.path.splitext(file)[1]
+    cv2.imwrite(os.path.join(target, get_filename(attributes, extension)), mask)
+
+
+def phenotype_photo(
+    file,
+    model,
+    smoothen=0,
+    old=False,
+    no_black_tape=False,
+    skeleton_backend=DEFAULT_SKELETON_BACKEND,
+    outputs=(),
+):
+    """
+    all stages from a cropped carrot photo to its traits, without writing the
+    masks in between to disk: binary mask, straightened mask, detipped mask
+    and the instance as phenotype.py would store it
+
+    Args:
+        file (str): path to the photo of the carrot as acquired
+        model: the regression model of the tip index
+        smoothen (int): erosion iterations of the binary mask
+        old (bool): is this an "old" picture
+        no_black_tape (bool): no black tape arround carrot
+        skeleton_backend (str): how to skeletonize the mask
+        outputs (tuple): names of PIPELINE_OUTPUTS to write to disk
+    Returns:
+        (instance, timings) - timings are the seconds per stage
+    """
+    timings = collections.OrderedDict()
+
+    # the attributes the mask would have when moved by copy_results
+    file_name = os.path.basename(file)
+    filename = file_name.replace("_px", "px").replace("_ppm", "ppm")
+    attributes = get_attributes_from_filename(filename)
+    scale = attributes.get("Scale", None)
+    if scale is None:
+        raise Exception("No 'Scale' attribute found!")
+
+    start = timeit.default_timer()
+    image = read_file(file)
+    timings["decode"] = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    mask = create_binary_mask(
+        image, smoothen=smoothen, minimize=True, old=old, no_black_tape=no_black_tape
+    )
+    timings["mask"] = timeit.default_timer() - start
+    write_output(mask, file, "binary", attributes, outputs)
+
+    start = timeit.default_timer()
+    straight, curvature = straighten_mask(mask, skeleton_backend=skeleton_backend)
+    attributes["Curvature"] = "%s" % convert_curvature_to_mm(curvature, file_name)
+    mask = trim_straightened_mask(straight)
+    timings["straighten"] = timeit.default_timer() - start
+    write_output(mask, file, "straight", attributes, outputs)
+
+    start = timeit.default_timer()
+    crop_index = get_tip_index(mask, model, pixel_to_mm(scale), filename)
+    mask = cut_tip(mask, crop_index)
+    tip_length, tip_biomass = get_tip_length_and_biomass(mask, crop_index)
+    attributes["TipLength"] = "%s" % tip_length
+    attributes["TipBiomass"] = "%s" % tip_biomass
+    timings["detip"] = timeit.default_timer() - start
+    write_output(mask, file, "detipped", attributes, outputs)
+
+    start = timeit.default_timer()
+    instance = assemble_instance_from_mask(mask, attributes)
+    timings["traits"] = timeit.default_timer() - start
+
+    return instance, timings
+
+
+def phenotype_photo_safe(file, *args):
+    """
+    wrapper around phenotype_photo that reports errors instead of raising, so
+    one broken photo does not take down the whole batch
+
+    Returns:
+        (file, instance, error, timings)
+    """
+    try:
+        instance, timings = phenotype_photo(file, *args)
+        return file, instance, None, timings
+    except Exception as e:
+        return file, None, str(e), {}
+
+
+def report_stage_timings(timings):
+    """
+    print the seconds spent per stage, summed over all photos
+
+    Args:
+        timings (list): the timings of phenotype_photo per photo
+    """
+    totals = collections.OrderedDict()
+    for photo_timings in timings:
+        for stage, seconds in photo_timings.items():
+            totals[stage] = totals.get(stage, 0) + seconds
+
+    photos = len([1 for photo_timings in timings if photo_timings])
+    if not photos:
+        return
+    stages = ", ".join(
+        "%s %.2fs (%.3fs per photo)" % (stage, seconds, seconds / photos)
+        for stage, seconds in totals.items()
+    )
+    click.secho("Timings: %s" % stages, fg="blue")
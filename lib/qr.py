@@ -0,0 +1,99 @@
+import collections
+import hashlib
+import threading
+
+import cv2
+from pyzbar import pyzbar
+
+# the locator looks for finder patterns on the image shrunk to this size (px)
+QR_LOCATE_MAX_SIZE = 1000
+
+# px around a located code that are decoded at full resolution
+QR_REGION_MARGIN = 40
+
+# number of decoded regions remembered
+QR_DECODE_CACHE_SIZE = 256
+
+_decode_cache = collections.OrderedDict()
+_decode_cache_lock = threading.Lock()
+
+
+def locate_qr_code(image, max_size=QR_LOCATE_MAX_SIZE):
+    """
+    find a qr code by its finder patterns on a shrunk copy of the image
+
+    Args:
+        image (np.array): grayscale image
+        max_size (int): size of the longer side of the shrunk copy
+    Returns:
+        (top, bottom, left, right) of the region of the code in the image,
+        None if no code was found
+    """
+    if not hasattr(cv2, "QRCodeDetector"):
+        return None
+
+    height, width = image.shape[:2]
+    scale = min(1.0, max_size / max(height, width))
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    found, points = cv2.QRCodeDetector().detect(small)
+    if not found or points is None:
+        return None
+
+    points = points.reshape(-1, 2) / scale
+    left, top = points.min(axis=0).astype(int) - QR_REGION_MARGIN
+    right, bottom = points.max(axis=0).astype(int) + QR_REGION_MARGIN
+    return max(top, 0), min(bottom, height), max(left, 0), min(right, width)
+
+
+def decode_region(region):
+    """
+    pyzbar.decode, remembering the results of the last regions decoded
+
+    Args:
+        region (np.array): grayscale image
+    Returns:
+        list of the decoded codes, as returned by pyzbar.decode
+    """
+    key = (region.shape, hashlib.sha1(region.tobytes()).hexdigest())
+    with _decode_cache_lock:
+        if key in _decode_cache:
+            _decode_cache.move_to_end(key)
+            return _decode_cache[key]
+
+    codes = pyzbar.decode(region)
+
+    with _decode_cache_lock:
+        _decode_cache[key] = codes
+        if len(_decode_cache) > QR_DECODE_CACHE_SIZE:
+            _decode_cache.popitem(last=False)
+
+    return codes
+
+
+def decode_qr_codes(image):
+    """
+    decode the qr codes of an image. The code is located first and only its
+    region is decoded, the whole image only if that fails.
+
+    Args:
+        image (np.array): grayscale image
+    Returns:
+        list of the decoded codes, as returned by pyzbar.decode. Their rect is
+        relative to the image
+    """
+    region = locate_qr_code(image)
+    if region is not None:
+        top, bottom, left, right = region
+        codes = decode_region(image[top:bottom, left:right])
+        if codes:
+            return [
+                code._replace(
+                    rect=code.rect._replace(
+                        left=code.rect.left + left, top=code.rect.top + top
+                    )
+                )
+                for code in codes
+            ]
+
+    return decode_region(image)
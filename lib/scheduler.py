@@ -0,0 +1,113 @@
+import collections
+from multiprocessing import Pool, cpu_count
+import os
+import timeit
+
+import click
+
+# every worker gets about this many chunks, so that workers that are done
+# early pick up the files of the slow directories
+CHUNKS_PER_WORKER = 16
+
+# files are handed to a worker at most this many at once
+MAX_CHUNKSIZE = 8
+
+
+def get_chunksize(tasks, workers):
+    """
+    the number of tasks handed to a worker at once: small enough to balance
+    the load at the end of a run, large enough to save on overhead for many
+    fast tasks
+    """
+    chunksize = tasks // (workers * CHUNKS_PER_WORKER)
+    return max(1, min(MAX_CHUNKSIZE, chunksize))
+
+
+def _run_task(function_and_task):
+    """
+    run a task in a worker and note which worker ran it for how long
+    """
+    function, task = function_and_task
+    start = timeit.default_timer()
+    result = function(*task)
+    return result, os.getpid(), timeit.default_timer() - start
+
+
+def report_utilisation(busy, seconds, workers, unit="files"):
+    """
+    print how busy every worker was while the tasks ran
+
+    Args:
+        busy (dict): pid of worker: (tasks, seconds busy)
+        seconds (float): wall time of the run
+        workers (int): number of workers
+        unit (str): what a task is, for the report
+    """
+    if seconds <= 0:
+        return
+    for i, (pid, (tasks, busy_seconds)) in enumerate(sorted(busy.items())):
+        click.secho(
+            "worker %s: %s %s, busy %.0f%%"
+            % (i + 1, tasks, unit, 100 * busy_seconds / seconds),
+            fg="blue",
+        )
+    total = sum(busy_seconds for tasks, busy_seconds in busy.values())
+    click.secho(
+        "%s workers busy %.0f%% of %.2fs"
+        % (workers, 100 * total / workers / seconds, seconds),
+        fg="blue",
+    )
+
+
+def run_file_tasks(
+    function, groups, workers=None, chunksize=None, name=None, unit="files"
+):
+    """
+    run the tasks of all directories in one pool, file by file, instead of a
+    directory per worker. A large directory then does not keep a single
+    worker busy while the others are idle.
+
+    Args:
+        function: called as function(*task) for every task. Defined on module
+            level, so that it can be sent to the workers
+        groups (list): per directory the list of its tasks (tuples)
+        workers (int): number of worker processes. Defaults to the cpu count.
+        chunksize (int): tasks handed to a worker at once, see get_chunksize
+        name (str): what is done, to report the utilisation of the workers
+        unit (str): what a task is, for the report
+    Returns:
+        per directory the list of the results of its tasks, in order
+    """
+    if workers is None:
+        workers = cpu_count()
+
+    tasks = [(function, task) for group in groups for task in group]
+    if chunksize is None:
+        chunksize = get_chunksize(len(tasks), workers)
+
+    busy = collections.defaultdict(lambda: [0, 0.0])
+    start = timeit.default_timer()
+
+    if workers <= 1:
+        results = [_run_task(task) for task in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            results = pool.map(_run_task, tasks, chunksize)
+
+    seconds = timeit.default_timer() - start
+    for result, pid, task_seconds in results:
+        busy[pid][0] += 1
+        busy[pid][1] += task_seconds
+
+    if name and tasks:
+        click.secho(
+            "%s: %s %s in chunks of %s" % (name, len(tasks), unit, chunksize),
+            fg="blue",
+        )
+        report_utilisation(busy, seconds, workers, unit)
+
+    grouped = []
+    results = iter(results)
+    for group in groups:
+        grouped.append([next(results)[0] for task in group])
+    return grouped
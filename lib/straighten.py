@@ -1,5 +1,7 @@
 import collections
 import itertools
+import math
+import time
 
 import cv2
 
@@ -7,222 +9,306 @@ import networkx as nx
 import numpy as np
 
 from scipy import interpolate as itp
+from scipy import ndimage
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order
 import skimage.morphology as morphology
 
+from lib.column_stats import get_column_runs, get_column_statistics
 
-######
-# TREE
-######
-
-
-class Vertex:
-    def __init__(self, point, degree=0, edges=None):
-        self.point = np.asarray(point)
-        self.degree = degree
-        self.edges = []
-        self.visited = False
-        if edges is not None:
-            self.edges = edges
-
-    def __str__(self):
-        return str(self.point)
+# runs of white pixels shorter than this many px are root hairs, see
+# Straightener.THRESHOLD
+ROOT_HAIR_THRESHOLD = 100
 
+# number of columns the midline is smoothed over before straightening
+MIDLINE_SMOOTHING_WINDOW = 21
 
-class Edge:
-    def __init__(self, start, end=None, pixels=None):
-        self.start = start
-        self.end = end
-        self.pixels = []
-        if pixels is not None:
-            self.pixels = pixels
-        self.visited = False
+# ways to skeletonize a mask, ximgproc needs opencv-contrib-python
+SKELETON_BACKENDS = ("medial_axis", "thinning", "ximgproc")
+DEFAULT_SKELETON_BACKEND = "medial_axis"
 
+# black px kept around the carrot so that the closing (disk(2)) is not clipped
+SKELETON_CROP_MARGIN = 5
 
-class PosWrapper(dict):
-    def __getitem__(self, key):
-        return [key.point[1], key.point[0]]  # switch x and y
-
-
-def build_tree(img, start=None):
-
-    # copy image since we set visited pixels to black
-    img = img.copy()
-    shape = img.shape
-    nWhitePixels = np.sum(img)
-
-    # neighbor offsets (8 nbors)
-    nbPxOff = np.array(
-        [[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]]
-    )
-
-    queue = collections.deque()
+# masks skeletonized and seconds spent per backend in this process
+skeleton_timings = collections.defaultdict(lambda: [0, 0.0])
 
-    # a list of all graphs extracted from the skeleton
-    graphs = []
 
-    blackedPixels = 0
-    # we build our graph as long as we have not blacked all white pixels!
-    while nWhitePixels != blackedPixels:
+##########
+# SKELETON
+##########
 
-        # if start not given: determine the first white pixel
-        if start is None:
-            it = np.nditer(img, flags=["multi_index"])
-            while not it[0]:
-                it.iternext()
 
-            start = it.multi_index
-
-        startV = Vertex(start)
-        queue.append(startV)
-        # print("Start vertex: ", startV)
-
-        # set start pixel to False (visited)
-        img[startV.point[0], startV.point[1]] = False
-        blackedPixels += 1
-
-        # create a new graph
-        G = nx.Graph()
-        G.add_node(startV)
+def get_skeleton_backends():
+    """
+    the skeleton backends that can be used with the installed packages
+    """
+    return [
+        backend
+        for backend in SKELETON_BACKENDS
+        if backend != "ximgproc" or hasattr(cv2, "ximgproc")
+    ]
 
-        # build graph in a breath-first manner by adding
-        # new nodes to the right and popping handled nodes to the left in queue
-        while len(queue):
-            currV = queue[0]
-            # get current vertex
-            # print("Current vertex: ", currV)
 
-            # check all neigboor pixels
-            for nbOff in nbPxOff:
+def skeletonize(image_bool, backend=DEFAULT_SKELETON_BACKEND):
+    """
+    close small gaps in the mask and reduce it to its skeleton. Only the
+    bounding box of the white pixels is processed, the black margins around
+    the carrot are left alone.
+
+    Args:
+        image_bool (np.array): boolean mask
+        backend (str): one of SKELETON_BACKENDS
+    Returns:
+        boolean skeleton of the same shape as the mask
+    """
+    if backend not in get_skeleton_backends():
+        raise ValueError("Skeleton backend not available: %s" % backend)
 
-                # pixel index
-                pxIdx = currV.point + nbOff
+    start = time.time()
 
-                if (pxIdx[0] < 0 or pxIdx[0] >= shape[0]) or (
-                    pxIdx[1] < 0 or pxIdx[1] >= shape[1]
-                ):
-                    continue
-                    # current neigbor pixel out of image
+    skeleton = np.zeros(image_bool.shape, dtype=bool)
+    rows = np.flatnonzero(image_bool.any(axis=1))
+    cols = np.flatnonzero(image_bool.any(axis=0))
+    if not len(rows):
+        return skeleton
 
-                if img[pxIdx[0], pxIdx[1]]:
-                    # print( "nb: ", pxIdx, " white ")
-                    # pixel is white
-                    newV = Vertex([pxIdx[0], pxIdx[1]])
+    top = max(rows[0] - SKELETON_CROP_MARGIN, 0)
+    bottom = rows[-1] + SKELETON_CROP_MARGIN + 1
+    left = max(cols[0] - SKELETON_CROP_MARGIN, 0)
+    right = cols[-1] + SKELETON_CROP_MARGIN + 1
+    crop = image_bool[top:bottom, left:right]
 
-                    # add edge from currV <-> newV
-                    G.add_edge(currV, newV, object=Edge(currV, newV))
-                    # G.add_edge(newV,currV)
+    d = morphology.disk(2)
+    img = morphology.binary_closing(crop, selem=d)
 
-                    # add node newV
-                    G.add_node(newV)
+    if backend == "medial_axis":
+        crop_skeleton = morphology.medial_axis(img)
+    elif backend == "thinning":
+        crop_skeleton = morphology.thin(img)
+    else:
+        crop_skeleton = cv2.ximgproc.thinning(img.astype(np.uint8) * 255) > 0
 
-                    # push vertex to queue
-                    queue.append(newV)
+    skeleton[top:bottom, left:right] = crop_skeleton
 
-                    # set neighbor pixel to black
-                    img[pxIdx[0], pxIdx[1]] = False
-                    blackedPixels += 1
+    timing = skeleton_timings[backend]
+    timing[0] += 1
+    timing[1] += time.time() - start
 
-            # pop currV
-            queue.popleft()
-        # end while
+    return skeleton
 
-        # empty queue
-        # current graph is finished ->store it
-        graphs.append(G)
 
-        # reset start
-        start = None
+######
+# TREE
+######
 
-    # end while
+# neighbor offsets (8 nbors)
+NEIGHBOR_OFFSETS = np.array(
+    [[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]]
+)
 
-    return graphs, img
 
+def get_adjacency(skeleton):
+    """
+    sparse adjacency matrix of the white pixels of a skeleton, 8-connected.
+    Pixels are numbered in row-major order.
 
-def get_end_nodes(g):
-    return [n for n in nx.nodes(g) if nx.degree(g, n) == 1]
+    Returns:
+        (adjacency, pixel coordinates as (row, col), index image)
+    """
+    shape = skeleton.shape
+    rows, cols = np.nonzero(skeleton)
+    n_pixels = len(rows)
+
+    index = np.full(shape, -1, dtype=np.int64)
+    index[rows, cols] = np.arange(n_pixels)
+    padded = np.pad(index, 1, mode="constant", constant_values=-1)
+
+    sources = []
+    targets = []
+    for row_offset, col_offset in NEIGHBOR_OFFSETS:
+        neighbors = padded[rows + 1 + row_offset, cols + 1 + col_offset]
+        has_neighbor = neighbors >= 0
+        sources.append(np.flatnonzero(has_neighbor))
+        targets.append(neighbors[has_neighbor])
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+
+    adjacency = csr_matrix(
+        (np.ones(len(sources), dtype=np.int8), (sources, targets)),
+        shape=(n_pixels, n_pixels),
+    )
+    adjacency.sort_indices()
 
+    return adjacency, np.stack([rows, cols], axis=1), index
 
-def merge_edges(graph):
 
-    # copy the graph
-    g = graph.copy()
+def build_skeleton_graph(skeleton, start):
+    """
+    build the graph of the skeleton part connected to the start pixel.
+
+    The pixels are visited breadth first, neighbors in row-major order. The
+    resulting spanning tree is reduced to its nodes (degree != 2) and the
+    segments of pixels between them, both held in arrays.
+
+    Args:
+        skeleton (np.array): boolean skeleton image
+        start (tuple): (row, col) of a white pixel of the skeleton
+    Returns:
+        dict with
+            graph (nx.Graph): the reduced graph. Nodes are indexes into
+                nodes, edges carry their weight (the number of pixels between
+                the nodes) and the indexes of these pixels
+            pixels (np.array): (row, col) of every pixel, breadth first order
+            nodes (np.array): (row, col) of every node
+            endNodes (list): the nodes of degree 1
+    """
+    adjacency, coordinates, index = get_adjacency(skeleton)
 
-    # v0 -----edge 0--- v1 ----edge 1---- v2
-    #        pxL0=[]       pxL1=[]           the pixel lists
-    #
-    # becomes:
-    #
-    # v0 -----edge 0--- v1 ----edge 1---- v2
-    # |_________________________________|
-    #               new edge
-    #    pxL = pxL0 + [v.point]  + pxL1      the resulting pixel list on the edge
-    #
-    # an delete the middle one
-    # result:
-    #
-    # v0 --------- new edge ------------ v2
-    #
-    # where new edge contains all pixels in between!
+    # breadth first spanning tree, relabeled so that pixel i is the i-th visited
+    order, predecessors = breadth_first_order(
+        adjacency, index[start[0], start[1]], directed=True, return_predecessors=True
+    )
+    n_pixels = len(order)
+    position = np.full(len(coordinates), -1, dtype=np.int64)
+    position[order] = np.arange(n_pixels)
+    pixels = coordinates[order]
+    parent = np.full(n_pixels, -1, dtype=np.int64)
+    parent[1:] = position[predecessors[order[1:]]]
+
+    children = np.bincount(parent[1:], minlength=n_pixels)
+    degree = children + (parent >= 0)
+
+    # the root is split up during construction and merged back in later on
+    is_node = degree != 2
+    is_node[0] = True
+    interior = np.flatnonzero(~is_node)
+
+    # interior pixels have exactly one child. Following the child pointers
+    # from every pixel ends at the node below its segment.
+    below = np.arange(n_pixels)
+    has_interior_parent = (parent >= 0) & ~is_node[np.maximum(parent, 0)]
+    below[parent[has_interior_parent]] = np.flatnonzero(has_interior_parent)
+    below[is_node] = np.flatnonzero(is_node)
+    while True:
+        jumped = below[below]
+        if np.array_equal(jumped, below):
+            break
+        below = jumped
+
+    # one segment per node but the root, going up towards the root
+    node_ids = np.full(n_pixels, -1, dtype=np.int64)
+    node_pixels = np.flatnonzero(is_node)
+    node_ids[node_pixels] = np.arange(len(node_pixels))
+
+    segment_of = below[interior]
+    sort = np.argsort(segment_of, kind="stable")
+    segment_of = segment_of[sort]
+    segment_interior = interior[sort]
+    bottoms, first = np.unique(segment_of, return_index=True)
+    chains = dict(zip(bottoms.tolist(), np.split(segment_interior, first[1:])))
+
+    graph = nx.Graph()
+    graph.add_nodes_from(range(len(node_pixels)))
+    for bottom in node_pixels[1:].tolist():
+        chain = chains.get(bottom, np.array([], dtype=np.int64))
+        top_pixel = chain.min() if len(chain) else bottom
+        top = int(parent[top_pixel])
+        graph.add_edge(
+            int(node_ids[top]), int(node_ids[bottom]), weight=len(chain), pixels=chain
+        )
+
+    # a root in the middle of a line is no node: merge its two segments
+    if degree[0] == 2:
+        (a, a_data), (b, b_data) = graph[0].items()
+        graph.remove_node(0)
+        pixels_between = np.concatenate([a_data["pixels"], [0], b_data["pixels"]])
+        graph.add_edge(
+            a, b, weight=len(pixels_between), pixels=pixels_between.astype(np.int64)
+        )
+
+    end_nodes = [n for n in graph.nodes() if graph.degree(n) == 1]
+
+    return {
+        "graph": graph,
+        "pixels": pixels,
+        "nodes": pixels[node_pixels],
+        "endNodes": end_nodes,
+    }
+
+
+def get_longest_path(graph, endNodes, mode="auto"):
+    """
+    graph is a fully reachable graph = every node can be reached from every node
 
-    # start not at degree 2 nodes
-    startNodes = [startN for startN in g.nodes() if nx.degree(g, startN) != 2]
+    Args:
+        graph (nx.Graph): weighted graph
+        endNodes (list): nodes the path may start and end in
+        mode (str): "tree" finds the diameter of a tree with a few single
+            source sweeps, "pairs" compares the shortest paths of all pairs
+            of end nodes, "auto" uses "tree" unless the graph has cycles
+    Returns:
+        (path as list of nodes, its length, the mode used)
+    """
 
-    for v0 in startNodes:
+    if len(endNodes) < 2:
+        raise ValueError("endNodes need to contain at least 2 nodes!")
 
-        # start a line traversal from each neighbor
-        startNNbs = list(nx.neighbors(g, v0))
+    if mode == "auto":
+        mode = "tree" if nx.is_tree(graph) else "pairs"
 
-        if not len(startNNbs):
-            continue
+    if mode == "tree":
+        path, length = get_longest_path_tree(graph, endNodes)
+    elif mode == "pairs":
+        path, length = get_longest_path_pairs(graph, endNodes)
+    else:
+        raise ValueError("Unknown longest path mode: %s" % mode)
 
-        counter = 0
-        v1 = startNNbs[counter]  # next nb of v0
-        while True:
+    return path, length, mode
 
-            if nx.degree(g, v1) == 2:
-                # we have a node which has 2 edges = this is a line segement
-                # make new edge from the two neighbors
-                nbs = list(nx.neighbors(g, v1))
 
-                # if the first neihbor is not n, make it so!
-                if nbs[0] != v0:
-                    nbs.reverse()
+def get_longest_path_tree(graph, endNodes):
+    """
+    the longest path between end nodes of a tree (its diameter).
 
-                pxL0 = g[v0][v1]["object"].pixels  # the pixel list of the edge 0
-                pxL1 = g[v1][nbs[1]]["object"].pixels  # the pixel list of the edge 1
+    Two sweeps find the length: the end node u farthest from any end node is
+    an end of a longest path, the end node farthest from u the other one.
+    As every node is farthest away from u or v, two more sweeps pick the same
+    pair of end nodes as get_longest_path_pairs on ties.
+    """
 
-                # fuse the pixel list from right and left and add our pixel n.point
-                g.add_edge(
-                    v0, nbs[1], object=Edge(v0, nbs[1], pixels=pxL0 + [v1.point] + pxL1)
-                )
+    def sweep(source):
+        return nx.single_source_dijkstra_path_length(graph, source)
 
-                # delete the node n
-                g.remove_node(v1)
+    distances_first = sweep(endNodes[0])
+    u = max(endNodes, key=lambda n: distances_first[n])
+    distances_u = sweep(u)
+    v = max(endNodes, key=lambda n: distances_u[n])
+    maxLength = distances_u[v]
 
-                # set v1 to new left node
-                v1 = nbs[1]
+    if not maxLength > 0:
+        raise ValueError("No path found!")
 
-            else:
-                counter += 1
-                if counter == len(startNNbs):
-                    break
-                v1 = startNNbs[counter]  # next nb of v0
+    # first end node (in endNodes order) that is an end of a longest path
+    distances_v = sweep(v)
+    start = next(
+        n for n in endNodes if max(distances_u[n], distances_v[n]) == maxLength
+    )
 
-    # weight the edges according to their number of pixels
-    for u, v, o in g.edges(data="object"):
-        g[u][v]["weight"] = len(o.pixels)
+    # first end node after it at the other end of a longest path
+    distances, paths = nx.single_source_dijkstra(graph, start)
+    end = next(
+        n for n in endNodes[endNodes.index(start) + 1 :] if distances[n] == maxLength
+    )
 
-    return g
+    return paths[end], maxLength
 
 
-def get_longest_path(graph, endNodes):
+def get_longest_path_pairs(graph, endNodes):
     """
-    graph is a fully reachable graph = every node can be reached from every node
+    the longest of the shortest paths between all pairs of end nodes.
     """
 
-    if len(endNodes) < 2:
-        raise ValueError("endNodes need to contain at least 2 nodes!")
-
     # get all shortest paths from each endpoint to another endpoint
     allEndPointsComb = itertools.combinations(endNodes, 2)
 
@@ -247,9 +333,17 @@ def get_longest_path(graph, endNodes):
     return nx.dijkstra_path(graph, source=maxPath[0], target=maxPath[1]), maxLength
 
 
-def assemble_graph(binary_mask):
+def assemble_graph(binary_mask, skeleton_backend=DEFAULT_SKELETON_BACKEND):
     """
-    goes about the whole graph business 
+    goes about the whole graph business
+
+    Args:
+        binary_mask (np.array): binary mask of the carrot
+        skeleton_backend (str): one of SKELETON_BACKENDS
+
+    Returns:
+        the graph of the skeleton (see build_skeleton_graph) along with its
+        longestPath and the longestPathMode used to find it
     """
 
     WHITE = 255
@@ -260,73 +354,54 @@ def assemble_graph(binary_mask):
     # SKELETONIZATION
     #################
 
-    d = morphology.disk(2)
-    img = morphology.binary_closing(image_bool, selem=d)
-    skeleton = morphology.medial_axis(img)
+    skeleton = skeletonize(image_bool, skeleton_backend)
 
     # Find a start pixel (not necessary)
     y = int(skeleton.shape[1] / 2)
     x = np.where(skeleton[:, y] == True)[0][0]
 
-    # disconnect
-    skeleton_copy = skeleton.copy()
-
-    graphs, imgB = build_tree(skeleton_copy, np.array([x, y]))
-    for i, g in enumerate(graphs):
-        endNodes = get_end_nodes(g)
-        graphs[i] = {"graph": g, "endNodes": endNodes}
-
-    simple_graphs = []
-    for g in graphs:
-        newG = merge_edges(g["graph"])
-
-        simple_graphs.append({"graph": newG, "endNodes": get_end_nodes(newG)})
-
-    for i, g in enumerate(simple_graphs):
-        path = get_longest_path(g["graph"], g["endNodes"])
-        simple_graphs[i]["longestPath"] = path
+    skeleton_graph = build_skeleton_graph(skeleton, (x, y))
+    path, length, mode = get_longest_path(
+        skeleton_graph["graph"], skeleton_graph["endNodes"]
+    )
+    skeleton_graph["longestPath"] = (path, length)
+    skeleton_graph["longestPathMode"] = mode
 
-    return simple_graphs
+    return skeleton_graph
 
 
 def get_shoulder_point_and_radius(image_grey):
-    WHITE = 255
-
     ############################
     # TAKE CARE OF THAT SHOULDER
     ############################
 
-    mask = image_grey[::-1]
-    mask_trans = mask.T
-    mask_reversed = mask_trans[::-1]
+    columns = get_column_statistics(image_grey)
     shoulder_midpoint = None
     radius = None
 
-    for i, column in enumerate(mask_reversed):
-        count = collections.Counter(column)
-
-        if count.get(WHITE, None):
+    white_columns = columns.get_white_columns()
+    if len(white_columns):
+        # the last column with white pixels
+        shoulder = int(white_columns[-1])
 
-            white_pixels = count.get(WHITE)
-            radius = round(white_pixels / 2)
+        white_pixels = int(columns.white_counts[shoulder])
+        radius = round(white_pixels / 2)
 
-            first_white = column[::-1].argmax()
+        first_white = columns.first_white[shoulder]
 
-            shoulder_midpoint_y = first_white + radius
-            shoulder_midpoint_x = len(mask_reversed) - i
-            shoulder_midpoint = np.array([shoulder_midpoint_x, shoulder_midpoint_y])
-
-            break
+        shoulder_midpoint_y = first_white + radius
+        shoulder_midpoint_x = shoulder + 1
+        shoulder_midpoint = np.array([shoulder_midpoint_x, shoulder_midpoint_y])
 
     return (shoulder_midpoint[0], shoulder_midpoint[1]), radius
 
 
-def get_midline(image_grey):
+def get_midline(image_grey, skeleton_backend=DEFAULT_SKELETON_BACKEND):
     """
     determines the midline of the image
     """
 
-    nodes, points = get_graph(image_grey)
+    nodes, points = get_graph(image_grey, skeleton_backend)
 
     points = np.concatenate((nodes, points))
 
@@ -369,7 +444,7 @@ def get_midline(image_grey):
     return list(zip(xnew, ynew))
 
 
-def get_graph(binary_mask):
+def get_graph(binary_mask, skeleton_backend=DEFAULT_SKELETON_BACKEND):
     WHITE = 255
     shoulder_midpoint, shoulder_radius = get_shoulder_point_and_radius(binary_mask)
 
@@ -387,36 +462,207 @@ def get_graph(binary_mask):
     )
     # return binary_mask
 
-    simple_graphs = assemble_graph(binary_mask)
+    skeleton_graph = assemble_graph(binary_mask, skeleton_backend)
 
-    for g in simple_graphs:
+    graph = skeleton_graph["graph"]
+    pixels = skeleton_graph["pixels"]
 
-        graph = g["graph"]
+    longestPathNodes = skeleton_graph["longestPath"][0]
+    nodes = skeleton_graph["nodes"][longestPathNodes]
+    nodes = nodes[np.argsort(nodes[:, 1], kind="stable")][:, ::-1]
 
-        longestPathNodes = g["longestPath"][0]
-        longestPathEdges = [
-            (longestPathNodes[i], longestPathNodes[i + 1])
-            for i in range(0, len(longestPathNodes) - 1)
+    line = np.concatenate(
+        [
+            graph[u][v]["pixels"]
+            for u, v in zip(longestPathNodes[:-1], longestPathNodes[1:])
         ]
-        nodes = []
-        for node in longestPathNodes:
-            nodes.append(node.point)
-        nodes = np.array(sorted(nodes, key=lambda x: x[1]))
-        nodes = np.array([np.array([p[1], p[0]]) for p in nodes])
-
-        line = None
-        for e in longestPathEdges:
-            px = np.array(graph[e[0]][e[1]]["object"].pixels)
-            if line is None:
-                line = px
-            if len(px):
-                line = np.concatenate((line, px))
-
-        # get the x, y ordering right
-        line = np.array([np.array([p[1], p[0]]) for p in line])
-        line = np.array(sorted(line, key=lambda x: x[0]))
-
-        return nodes, line
+    )
+
+    # get the x, y ordering right
+    line = pixels[line][:, ::-1]
+    line = line[np.argsort(line[:, 0], kind="stable")]
+
+    return nodes, line
+
+
+def _choose_run(start, end, run_start, run_end):
+    """
+    the next step of Straightener.findCarrot: switch to the new run if it is
+    longer and the one so far is small enough to be a root hair, merge both
+    if neither is
+    """
+    if start < 0 or (
+        end - start < run_end - run_start and end - start < ROOT_HAIR_THRESHOLD
+    ):
+        return run_start, run_end
+    if (
+        run_end - run_start >= ROOT_HAIR_THRESHOLD
+        and end - start >= ROOT_HAIR_THRESHOLD
+    ):
+        return start, run_end
+    return start, end
+
+
+def get_carrot_rows(binary_mask):
+    """
+    per column, the first and last row of the carrot without its root hairs,
+    like Straightener.findCarrot: of the runs of white pixels in a column,
+    the one most likely to be the carrot is taken, runs both too long to be
+    root hairs are merged with everything in between.
+
+    Args:
+        binary_mask (np.array): binary mask of the carrot
+    Returns:
+        (starts, ends) - np.arrays, -1 and the last row for an empty column
+    """
+    height, width = binary_mask.shape
+    runs = get_column_runs(binary_mask)
+    run_ends = runs.starts + runs.lengths - 1
+
+    starts = np.full(width, -1, dtype=int)
+    ends = np.full(width, height - 1, dtype=int)
+
+    # most columns have a single run, only the others need to be walked
+    runs_per_column = np.bincount(runs.columns, minlength=width)
+    single = runs_per_column[runs.columns] == 1
+    starts[runs.columns[single]] = runs.starts[single]
+    ends[runs.columns[single]] = run_ends[single]
+
+    for index in np.flatnonzero(~single):
+        column = runs.columns[index]
+        starts[column], ends[column] = _choose_run(
+            starts[column], ends[column], runs.starts[index], run_ends[index]
+        )
+
+    return starts, ends
+
+
+def trim_root_hairs(binary_mask):
+    """
+    the mask with only the carrot rows of get_carrot_rows left in every
+    column, like the java straightener trims the root hairs
+    """
+    starts, ends = get_carrot_rows(binary_mask)
+    rows = np.arange(binary_mask.shape[0])[:, np.newaxis]
+    carrot = (starts >= 0) & (rows >= starts) & (rows <= ends)
+    return np.where(carrot, 255, 0).astype(np.uint8)
+
+
+def get_curvature(binary_mask):
+    """
+    the curvature of the carrot in px, as reported by the java straightener:
+    the square root of the area between the centers of the columns and the
+    straight line from the shoulder to the tip.
+
+    Like Straightener.getColumnData, the center of a column is halfway
+    between the first and last row of the carrot (see get_carrot_rows), in
+    int arithmetic.
+
+    Args:
+        binary_mask (np.array): binary mask of the carrot, shoulder on the right
+    Returns:
+        curvature (int)
+    """
+    starts, ends = get_carrot_rows(binary_mask)
+    occupied = np.flatnonzero(starts >= 0)
+    if not len(occupied):
+        return 0
+
+    starts, ends = starts[occupied], ends[occupied]
+    centers = (ends - starts) // 2 + starts
+
+    # the java straightener walks from the shoulder to the tip
+    first_x, first_y = int(occupied[-1]), int(centers[-1])
+    last_x, last_y = int(occupied[0]), int(centers[0])
+
+    # in general, modest S curves are treated as "straighter" than a C curve,
+    # so the adjustments are not absolute
+    total_adjustment = int(np.sum(centers - first_y))
+
+    # the adjustment because of the diagonal angle, which is subtracted out.
+    # java's int division truncates towards zero
+    integral_of_diagonal = abs((last_x - first_x - 1) * (first_y - last_y)) // 2
+
+    return int(math.sqrt(abs(total_adjustment - integral_of_diagonal)))
+
+
+def straighten_mask(
+    binary_mask,
+    smoothing_window=MIDLINE_SMOOTHING_WINDOW,
+    skeleton_backend=DEFAULT_SKELETON_BACKEND,
+):
+    """
+    straighten the carrot along its midline.
+
+    The root hairs are trimmed first, like the java straightener does. Cross
+    sections perpendicular to the midline are then sampled at every px of
+    its arc length and stacked next to each other, centered on the middle
+    row of the new mask.
+
+    Args:
+        binary_mask (np.array): binary mask of the carrot, shoulder on the right
+        smoothing_window (int): number of columns to smooth the midline over
+        skeleton_backend (str): one of SKELETON_BACKENDS
+    Returns:
+        (straightened mask, curvature in px)
+    """
+    WHITE = 255
+    height, width = binary_mask.shape
+
+    binary_mask = trim_root_hairs(binary_mask)
+    curvature = get_curvature(binary_mask)
+
+    midline = get_midline(binary_mask, skeleton_backend)
+    xs = midline[:, 0].astype(int)
+    ys = midline[:, 1].astype(float)
+    inside = (xs >= 0) & (xs < width)
+    xs, ys = xs[inside], ys[inside]
+
+    # one midline point per column
+    x_min = xs.min()
+    counts = np.bincount(xs - x_min)
+    sums = np.bincount(xs - x_min, weights=ys)
+    known = counts > 0
+    midline_columns = np.arange(x_min, x_min + len(counts))
+    midline_centers = sums[known] / counts[known]
+
+    # the medial axis stops short of the tip, so carry it on to the ends
+    occupied = np.flatnonzero(np.any(binary_mask == WHITE, axis=0))
+    columns = np.arange(occupied[0], occupied[-1] + 1)
+    centers = np.interp(columns, midline_columns[known], midline_centers)
+
+    centers = ndimage.uniform_filter1d(centers, smoothing_window, mode="nearest")
+
+    # sample the midline at unit steps along its arc length
+    arc_length = np.concatenate(
+        ([0], np.cumsum(np.hypot(np.diff(columns), np.diff(centers))))
+    )
+    steps = np.arange(0, arc_length[-1] + 1)
+    sample_x = np.interp(steps, arc_length, columns)
+    sample_y = np.interp(steps, arc_length, centers)
+
+    tangent_x = np.gradient(sample_x)
+    tangent_y = np.gradient(sample_y)
+    tangent_norm = np.hypot(tangent_x, tangent_y)
+    normal_x = -tangent_y / tangent_norm
+    normal_y = tangent_x / tangent_norm
+
+    # one cross section per column
+    offsets = np.arange(height) - height // 2
+    map_x = sample_x[np.newaxis, :] + offsets[:, np.newaxis] * normal_x
+    map_y = sample_y[np.newaxis, :] + offsets[:, np.newaxis] * normal_y
+
+    straight = cv2.remap(
+        binary_mask,
+        map_x.astype(np.float32),
+        map_y.astype(np.float32),
+        cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+    straight = np.where(straight > 127, WHITE, 0).astype(np.uint8)
+
+    return straight, curvature
 
 
 if __name__ == "__main__":
@@ -1,5 +1,3 @@
-import collections
-from itertools import groupby
 import os
 import shutil
 
@@ -9,6 +7,7 @@ import cv2
 import numpy as np
 
 from append import append_or_change_filename
+from lib.column_stats import get_column_runs, get_column_statistics
 from lib.crop import reduce_to_contour
 from lib.constants import (
     METHODS,
@@ -17,12 +16,12 @@ from lib.constants import (
     TIP_MASK_PSEUDO_MAX_LENGTH,
 )
 from lib.utils import (
-    count_white_pixels,
     write_file,
     get_attributes_from_filename,
     pixel_to_mm,
 )
 from phenotype import (
+    get_mask_profile,
     get_length,
     get_max_width_unstraightened,
     get_index_of_tip,
@@ -49,21 +48,10 @@ def find_tip_brute_force(mask, pixel_threshold=15):
     threshold value
     """
 
-    mask_trans = mask.T
-    mask_reversed = mask_trans[::-1]
+    white_counts = get_column_statistics(mask).white_counts
 
-    index = 0
-
-    for i, column in enumerate(mask_reversed):
-        # TODO: find bins
-        white_pixel = count_white_pixels(column)
-        if white_pixel > 0 and white_pixel <= pixel_threshold:
-            index = i
-            break
-
-    if index != 0:
-        return len(mask_reversed) - index - 1
-    return index
+    # TODO: find bins
+    return find_last_thin_column(white_counts, pixel_threshold)
 
 
 def find_tip_brute_force_by_bins(mask, pixel_threshold=15):
@@ -72,30 +60,25 @@ def find_tip_brute_force_by_bins(mask, pixel_threshold=15):
     threshold value
     """
 
-    mask_trans = mask.T
-    mask_reversed = mask_trans[::-1]
-
-    index = 0
+    bin_heights = get_column_runs(mask).longest
+    return find_last_thin_column(bin_heights, pixel_threshold)
 
-    for i, column in enumerate(mask_reversed):
-        # all white cells
-        bin_indexes = [x[0] for x in np.argwhere(column == 255)]
 
-        # detect the number of bins
-        bins = []
-        for k, g in groupby(enumerate(bin_indexes), lambda ix: ix[0] - ix[1]):
-            bins.append(list(g))
+def find_last_thin_column(heights, pixel_threshold):
+    """
+    the index of the column closest to the right edge that is not empty and at
+    most pixel_threshold high. 0 if there is none, or if it is the edge itself
 
-        if bins:
-            sorted_bins = sorted(bins, key=lambda x: len(x), reverse=True)
-            largest_bin = sorted_bins[0]
-            if len(largest_bin) > 0 and len(largest_bin) <= pixel_threshold:
-                index = i
-                break
+    Args:
+        heights (np.array): per column, its white pixels or longest bin
+        pixel_threshold (int): the pixel threshold
+    """
+    thin = (heights > 0) & (heights <= pixel_threshold)
+    thin_columns = np.flatnonzero(thin)
 
-    if index != 0:
-        return len(mask_reversed) - index - 1
-    return index
+    if len(thin_columns) and thin_columns[-1] != len(heights) - 1:
+        return int(thin_columns[-1])
+    return 0
 
 
 def find_tip_pseudo_dynamic(mask, pure=False):
@@ -107,8 +90,9 @@ def find_tip_pseudo_dynamic(mask, pure=False):
         mask - the binary mask as a numpy array
         pure - if true, only the threshold will be applied
     """
-    length = get_length(mask)
-    max_width = get_max_width_unstraightened(mask)
+    profile = get_mask_profile(mask)
+    length = get_length(profile)
+    max_width = get_max_width_unstraightened(profile)
 
     length_width_ratio = length / max_width
     length_width_ratio = round(length_width_ratio, 2)
@@ -125,54 +109,49 @@ def find_tip_pseudo_dynamic(mask, pure=False):
     else:
         pixel_threshold = 10
 
-    mask_trans = mask.T
-    mask_reversed = mask_trans[::-1]
+    # the longest bin per column, from right to left
+    bin_heights = get_column_runs(profile.mask).longest[::-1]
 
     index = 0
 
     # 0. find a bin that is smaller or equal to the threshold
-    for i, column in enumerate(mask_reversed):
-        bin_height = count_bins_in_column(column)
-        if bin_height > 0 and bin_height <= pixel_threshold:
-            index = i
-            break
+    thin = (bin_heights > 0) & (bin_heights <= pixel_threshold)
+    if thin.any():
+        i = int(np.argmax(thin))
+        index = i
 
     if index != 0:
         # look back and ahead!
         # 1. look ahead 20px. if any bin has white count of 0, then just return 0
         columns_lookahead = 13
-        for j in range(columns_lookahead):
-            try:
-                bin_height = count_bins_in_column(mask_reversed[i + j])
-                if bin_height == 0:
-                    return 0
-            except IndexError:
-                return 0
+        lookahead = bin_heights[i : i + columns_lookahead]
+        if len(lookahead) < columns_lookahead or not lookahead.all():
+            return 0
 
         if pure is False:
             # 2. look back
             # back_index_avg = check_back_average(
-            #     mask_reversed, length, i, pixel_threshold
+            #     bin_heights, length, i, pixel_threshold
             # )
             back_index_avg = check_back_abrupt_change(
-                mask_reversed, length, i, pixel_threshold, carrot_type
+                bin_heights, length, i, pixel_threshold, carrot_type
             )
             if back_index_avg > 0:
                 index = back_index_avg
             else:
                 return 0
 
-        return len(mask_reversed) - index - 1
+        return len(bin_heights) - index - 1
     return index
 
 
-def check_back_average(mask, length, start_index, pixel_threshold):
+def check_back_average(bin_heights, length, start_index, pixel_threshold):
     """
     Tries to find some back corrected index by using an average
     of bin heights as it walks back...
 
     Args:
-        mask: np.array - the binary mask
+        bin_heights: np.array - the longest bin per column, from right to left
         length: int - the length of the carrot
         start_index: int - the index where the threshold was met
         pixel_threshold: int - the pixel threshold
@@ -184,11 +163,12 @@ def check_back_average(mask, length, start_index, pixel_threshold):
     # the difference has to be at least 25 px
     min_back = 25
 
+    bin_heights = bin_heights.tolist()
     bin_sum = 0
     count = 0
     for k in range(start_index, start_index - back_length, -1):
         count += 1
-        bin_height = count_bins_in_column(mask[k])
+        bin_height = bin_heights[k]
         bin_sum += bin_height
         bin_avg = bin_sum / count
 
@@ -200,12 +180,14 @@ def check_back_average(mask, length, start_index, pixel_threshold):
     return 0
 
 
-def check_back_abrupt_change(mask, length, start_index, pixel_threshold, carrot_type):
+def check_back_abrupt_change(
+    bin_heights, length, start_index, pixel_threshold, carrot_type
+):
     """
     Looks back to see if an aprupt change in bin width can be detected
 
     Args:
-        mask: np.array - the binary mask
+        bin_heights: np.array - the longest bin per column, from right to left
         length: int - the length of the carrot
         start_index: int - the index where the threshold was met
         pixel_threshold: int - the pixel threshold
@@ -225,10 +207,11 @@ def check_back_abrupt_change(mask, length, start_index, pixel_threshold, carrot_
     min_back = 35
     max_back = 500
 
+    bin_heights = bin_heights.tolist()
     count = 0
     for k in range(start_index, start_index - back_length, -1):
         count += 1
-        bin_height = count_bins_in_column(mask[k])
+        bin_height = bin_heights[k]
         if bin_height > pixel_threshold * factor:
             if count < min_back or count > max_back:
                 return 0
@@ -244,43 +227,136 @@ def count_bins_in_column(column):
     Returns:
         length of largest bin - int
     """
-    # count of white cells
-    bin_indexes = [x[0] for x in np.argwhere(column == 255)]
+    return int(get_column_runs(np.reshape(column, (-1, 1))).longest[0])
 
-    # detect the number of bins
-    bins = []
-    for k, g in groupby(enumerate(bin_indexes), lambda ix: ix[0] - ix[1]):
-        bins.append(list(g))
 
-    if bins:
-        sorted_bins = sorted(bins, key=lambda x: len(x), reverse=True)
-        largest_bin = sorted_bins[0]
-        return len(largest_bin)
-    return 0
+def get_tip_features(mask, mm_per_px, row=None):
+    """
+    the features of a straightened mask for the tip model: its widths in mm
+    from the shoulder to the tip, normalized by the largest width and padded
+    with zeros to TIP_MASK_PSEUDO_MAX_LENGTH
+
+    Args:
+        mask (np.array): the straightened mask
+        mm_per_px (float): see pixel_to_mm
+        row (np.array): float32 row of TIP_MASK_PSEUDO_MAX_LENGTH the features
+            are written to. A new one if None
+    Returns:
+        the row
+    """
+    if row is None:
+        row = np.zeros(TIP_MASK_PSEUDO_MAX_LENGTH, dtype=np.float32)
 
+    # reverse, so the thick end is at 0
+    widths = get_column_statistics(mask).widths[::-1] * mm_per_px
+    if len(widths) > len(row):
+        raise ValueError("The mask is longer than %s px" % len(row))
 
-def tip_mask_ml(mask, model, mm_per_px):
+    max_width = widths.max()
+    if not max_width:
+        raise ZeroDivisionError("The mask has no white pixels")
 
-    width_array = get_width_array_mm(mask, mm_per_px)[::-1]
-    normalized_width_array = normalize_width_array(width_array)
-    max_length = TIP_MASK_PSEUDO_MAX_LENGTH
+    # the model predicts on float32, the widths are normalized before the cast
+    row[: len(widths)] = widths / max_width
+    row[len(widths) :] = 0
+    return row
 
-    missing_len = max_length - len(normalized_width_array)
-    widths = normalized_width_array + [0] * missing_len
 
-    index = model.predict([widths])
+def tip_mask_ml(mask, model, mm_per_px):
+    features = get_tip_features(mask, mm_per_px)
+    index = model.predict(features[np.newaxis])
     return index
 
 
-def tip_mask(src, model, visualize=False):
+def predict_tip_indices(masks, model, mm_per_px, files):
     """
-    mask the tips of the straightened carrots
+    index of the column where the tip starts for every mask, predicted by the
+    model in a single call. Masks whose tip cannot be predicted keep their
+    tip.
 
     Args:
-        src (str) - absolute path to the binary mask
-        visualize (bool) - only visualize the masking
+        masks (list): the straightened masks
+        model: the regression model of the tip index
+        mm_per_px (list): per mask, see pixel_to_mm
+        files (list): per mask its name, for the error messages
+    Returns:
+        list of the indices
+    """
+    features = np.zeros((len(masks), TIP_MASK_PSEUDO_MAX_LENGTH), dtype=np.float32)
+    # the length of the tip in px, as predicted by the model
+    tip_lengths = np.zeros(len(masks))
+
+    predictable = []
+    for i, (mask, mask_mm_per_px, file) in enumerate(zip(masks, mm_per_px, files)):
+        try:
+            get_tip_features(mask, mask_mm_per_px, features[i])
+        except Exception as e:
+            click.secho(file, fg="red")
+            print(e)
+        else:
+            predictable.append(i)
+
+    if predictable:
+        try:
+            tip_lengths[predictable] = model.predict(features[predictable])
+        except Exception as e:
+            for i in predictable:
+                click.secho(files[i], fg="red")
+            print(e)
+
+    return [
+        mask.shape[1] - int(tip_length) for mask, tip_length in zip(masks, tip_lengths)
+    ]
+
+
+def get_tip_index(mask, model, mm_per_px, file=""):
+    """
+    index of the column where the tip starts, as predicted by the model
+
+    Args:
+        mask (np.array): the straightened mask
+        model: the regression model of the tip index
+        mm_per_px (float): see pixel_to_mm
+        file (str): name of the mask, for the error message
+    """
+    # get index from ml model
+    return predict_tip_indices([mask], model, [mm_per_px], [file])[0]
+
+
+def cut_tip(mask, crop_index):
+    """
+    cut the tip off at crop_index and buffer the mask with black columns
+    """
+    mask = mask[:, crop_index:]
+
+    black_col = np.zeros((mask.shape[0], 10), dtype=np.uint8)
+    mask = np.hstack([black_col, mask])
+
+    # another round of contour reduction to remove dangling white pixels
+    return reduce_to_contour(mask, minimize=False)
+
+
+def get_tip_length_and_biomass(mask, crop_index):
     """
+    the length and biomass of the tip that was cut off, in px
 
+    Args:
+        mask (np.array): the detipped mask
+        crop_index (int): where the tip was cut off
+    """
+    old_tip_index = get_index_of_tip(mask.T)
+    tip_length = crop_index - old_tip_index
+    if tip_length < 0:
+        tip_length = 0
+    tip_biomass = get_biomass(mask[:, old_tip_index:crop_index])
+    return tip_length, tip_biomass
+
+
+def get_tip_mask_target(src):
+    """
+    clear and create the directory of the detipped masks next to the
+    straightened masks in src
+    """
     # if not dest:
     dest = src.split(STRAIGHTENED_MASKS_DIR)[0]
     dest = os.path.join(dest, DETIPPED_MASKS_DIR)
@@ -290,73 +366,128 @@ def tip_mask(src, model, visualize=False):
     if not os.path.exists(dest):
         os.makedirs(dest)
 
-    for file in os.listdir(src):
-        print(file)
-        src_filepath = os.path.join(src, file)
-        dest_filepath = os.path.join(dest, file)
+    return dest
 
-        mask = cv2.imread(src_filepath, cv2.IMREAD_GRAYSCALE)
 
-        attributes = get_attributes_from_filename(src_filepath)
-        scale = attributes.get("Scale", None)
-        mm_per_px = pixel_to_mm(scale)
+def read_straight_mask(src_filepath):
+    """
+    read a straightened mask and the mm per px of its scale
 
-        if mask is None:
-            msg = "File %s is empty!" % src_filepath
-            click.secho(msg, fg="red")
-            continue
+    Returns:
+        (mask, mm_per_px) - mask is None if the file could not be read
+    """
+    print(os.path.basename(src_filepath))
 
-        # get index from ml model
-        try:
-            tip_index = tip_mask_ml(mask, model, mm_per_px)
-        except Exception as e:
-            click.secho(file, fg="red")
-            print(e)
-            tip_index = [0]
-        tip_index = int(tip_index[0])
-        # print(tip_index)
-        # print(mask.shape[1])
-        tip_index = mask.shape[1] - tip_index
-
-        # get index based on threshold
-        # tip_index = find_tip_pseudo_dynamic(mask, pure=True)
-        # tip_index_advanced = find_tip_pseudo_dynamic(mask, pure=False)
-
-        # if tip_index_advanced > 0:
-        #     crop_index = tip_index_advanced
-        # else:
-        #     crop_index = tip_index
-        crop_index = tip_index
-
-        if visualize:
-            # paint only
-            tip = mark_start_of_tail(mask.copy(), tip_index, [0, 0, 255])
-            # tip = mark_start_of_tail(tip, tip_index_advanced, [0, 255, 0])
-            # print(dest)
-            write_file(tip, dest, file)
-            continue
+    mask = cv2.imread(src_filepath, cv2.IMREAD_GRAYSCALE)
 
-        else:
-            # crop + buffer + wirte
-            mask = mask[:, crop_index:]
+    attributes = get_attributes_from_filename(src_filepath)
+    scale = attributes.get("Scale", None)
+    mm_per_px = pixel_to_mm(scale)
+
+    if mask is None:
+        msg = "File %s is empty!" % src_filepath
+        click.secho(msg, fg="red")
+
+    return mask, mm_per_px
+
+
+def write_tip_mask(mask, tip_index, dest, file, visualize=False):
+    """
+    cut the tip off a straightened mask and write it with its TipLength and
+    TipBiomass to dest
+
+    Args:
+        mask (np.array) - the straightened mask
+        tip_index (int) - index of the column where the tip starts
+        dest (str) - directory of the detipped masks
+        file (str) - filename of the straightened mask
+        visualize (bool) - only paint where the tip starts
+    """
+    dest_filepath = os.path.join(dest, file)
+
+    # get index based on threshold
+    # tip_index = find_tip_pseudo_dynamic(mask, pure=True)
+    # tip_index_advanced = find_tip_pseudo_dynamic(mask, pure=False)
+
+    # if tip_index_advanced > 0:
+    #     crop_index = tip_index_advanced
+    # else:
+    #     crop_index = tip_index
+    crop_index = tip_index
+
+    if visualize:
+        # paint only
+        tip = mark_start_of_tail(mask.copy(), tip_index, [0, 0, 255])
+        # tip = mark_start_of_tail(tip, tip_index_advanced, [0, 255, 0])
+        # print(dest)
+        write_file(tip, dest, file)
+        return
+
+    else:
+        # crop + buffer + wirte
+        mask = cut_tip(mask, crop_index)
 
-            black_col = np.zeros((mask.shape[0], 10), dtype=np.uint8)
-            mask = np.hstack([black_col, mask])
+        cv2.imwrite(dest_filepath, mask)
 
-            # another round of contour reduction to remove dangling white pixels
-            mask = reduce_to_contour(mask, minimize=False)
+    tip_length, tip_biomass = get_tip_length_and_biomass(mask, crop_index)
+    new_filepath = append_or_change_filename(
+        dest_filepath, "TipLength", None, tip_length
+    )
+    append_or_change_filename(new_filepath, "TipBiomass", None, tip_biomass)
 
-            cv2.imwrite(dest_filepath, mask)
 
-        old_tip_index = get_index_of_tip(mask.T)
-        tip_length = crop_index - old_tip_index
-        if tip_length < 0:
-            tip_length = 0
-        tip_biomass = get_biomass(mask[:, old_tip_index:crop_index])
-        new_filepath = append_or_change_filename(
-            dest_filepath, "TipLength", None, tip_length
-        )
-        append_or_change_filename(new_filepath, "TipBiomass", None, tip_biomass)
+def tip_mask_files(src_filepaths, dest, model, visualize=False):
+    """
+    mask the tips of straightened carrots. The tips of all of them are
+    predicted in a single call of the model
+
+    Args:
+        src_filepaths (list) - absolute paths to the straightened masks
+        dest (str) - directory of the detipped masks
+        model - the regression model of the tip index
+        visualize (bool) - only visualize the masking
+    """
+    files = []
+    masks = []
+    mm_per_px = []
+    for src_filepath in src_filepaths:
+        mask, mask_mm_per_px = read_straight_mask(src_filepath)
+        if mask is not None:
+            files.append(os.path.basename(src_filepath))
+            masks.append(mask)
+            mm_per_px.append(mask_mm_per_px)
+
+    tip_indices = predict_tip_indices(masks, model, mm_per_px, files)
+    for mask, tip_index, file in zip(masks, tip_indices, files):
+        write_tip_mask(mask, tip_index, dest, file, visualize)
+
+
+def tip_mask_file(src_filepath, dest, model, visualize=False):
+    """
+    mask the tip of a straightened carrot
+
+    Args:
+        src_filepath (str) - absolute path to the straightened mask
+        dest (str) - directory of the detipped masks
+        model - the regression model of the tip index
+        visualize (bool) - only visualize the masking
+    """
+    tip_mask_files([src_filepath], dest, model, visualize)
+
+
+def tip_mask(src, model, visualize=False):
+    """
+    mask the tips of the straightened carrots, with one prediction of the
+    model for the whole directory
+
+    Args:
+        src (str) - absolute path to the binary mask
+        visualize (bool) - only visualize the masking
+    """
+    dest = get_tip_mask_target(src)
+
+    src_filepaths = [os.path.join(src, file) for file in os.listdir(src)]
+    tip_mask_files(src_filepaths, dest, model, visualize)
 
 
 def get_width_array(image):
@@ -369,15 +500,7 @@ def get_width_array(image):
         width_array (list)
     """
 
-    width_array = []
-
-    for column in image.T:
-        count = collections.Counter(column)
-        if count.get(255, None):
-            width_array.append(count.get(255) / 2)
-        else:
-            width_array.append(0)
-    return width_array
+    return get_column_statistics(image).widths.tolist()
 
 
 def get_width_array_mm(image, mm_per_px):
@@ -391,15 +514,7 @@ def get_width_array_mm(image, mm_per_px):
         width_array (list)
     """
 
-    width_array = []
-
-    for column in image.T:
-        count = collections.Counter(column)
-        if count.get(255, None):
-            width_array.append(count.get(255) / 2)
-        else:
-            width_array.append(0)
-    return [w * mm_per_px for w in width_array]
+    return (get_column_statistics(image).widths * mm_per_px).tolist()
 
 
 def normalize_width_array(width_array):
@@ -1,22 +1,44 @@
+import collections
+import hashlib
+import os
+import re
+import tempfile
+
 import click
 import cv2
 import lensfunpy
+import numpy as np
 
 from lib.constants import config
+from lib.exif import get_lens_setting
 
+# number of remap tables kept in memory (one per lens setting and image size)
+REMAP_CACHE_SIZE = 4
 
-def unskew(image_path, old):
-    cam_maker = config["camera_maker"]
-    cam_model = config["camera_model"]
+# remap tables are persisted here so that they survive a restart
+REMAP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "carrots", "remap")
 
-    lens_maker = config["lens_maker"]
-    lens_model = config["lens_model"]
+# the least recently used remaps are evicted beyond this size (bytes). A remap
+# of a full resolution photo takes about 144 MB
+REMAP_CACHE_MAX_BYTES = 1024 ** 3
 
-    # TODO: this would have to be removed...
-    if old:
-        cam_model = 'Nikon D3300'
-        lens_model = "Nikon AF-S DX Zoom-Nikkor 18-55mm f/3.5-5.6G VR"
+# the maps are written to temporary files first, see save_remap
+REMAP_TMP_PREFIX = ".tmp-"
+REMAP_FILE_RE = re.compile(r"^([0-9a-f]{40})_map[12]\.npy$")
 
+# lens setting used for photos without exif data
+DEFAULT_FOCAL_LENGTH = 30
+DEFAULT_APERTURE = 4.2
+# TODO: what's the unit here?
+DEFAULT_DISTANCE = 10
+
+_remap_cache = collections.OrderedDict()
+
+
+def get_camera_and_lens(cam_maker, cam_model, lens_maker, lens_model):
+    """
+    look up camera and lens in the lensfun database
+    """
     db = lensfunpy.Database()
 
     try:
@@ -28,22 +50,256 @@ def unskew(image_path, old):
     except Exception:
         raise(Exception("Lens not found!"))
 
-    #  focal_length = lens.min_focal
+    return cam, lens
 
-    # TODO: read from exif
 
-    focal_length = 30
-    aperture = 4.2
+def compute_remap(key):
+    """
+    compute the undistortion maps with lensfun, converted to fixed point maps
+    for a faster cv2.remap
 
-    # TODO: what's the unit here?
-    distance = 10
-
-    im = cv2.imread(image_path)
-    height, width = im.shape[0], im.shape[1]
+    Args:
+        key (tuple): (camera maker, camera model, lens maker, lens model,
+            focal length, aperture, distance, width, height)
+    Returns:
+        (map1, map2) as returned by cv2.convertMaps
+    """
+    (
+        cam_maker,
+        cam_model,
+        lens_maker,
+        lens_model,
+        focal_length,
+        aperture,
+        distance,
+        width,
+        height,
+    ) = key
+    cam, lens = get_camera_and_lens(cam_maker, cam_model, lens_maker, lens_model)
 
     mod = lensfunpy.Modifier(lens, cam.crop_factor, width, height)
     mod.initialize(focal_length, aperture, distance)
 
     undist_coords = mod.apply_geometry_distortion()
-    unskewed = cv2.remap(im, undist_coords, None, cv2.INTER_LANCZOS4)
+    return cv2.convertMaps(undist_coords, None, cv2.CV_16SC2)
+
+
+def get_remap_path(key, cache_dir):
+    """
+    the paths of the .npy files of a remap on disk
+    """
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return (
+        os.path.join(cache_dir, "%s_map1.npy" % digest),
+        os.path.join(cache_dir, "%s_map2.npy" % digest),
+    )
+
+
+def save_remap(maps, paths):
+    """
+    write the maps to disk, atomically so that concurrent readers never see
+    a partial file
+    """
+    for data, path in zip(maps, paths):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=REMAP_TMP_PREFIX)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp_path, path)
+
+
+def prune_remap_cache(cache_dir=REMAP_CACHE_DIR, max_bytes=REMAP_CACHE_MAX_BYTES):
+    """
+    evict the least recently used remaps until the cache fits into max_bytes.
+    Both maps of a remap are evicted together. Only the maps count, the
+    temporary files save_remap is still writing are left alone.
+
+    Returns:
+        int - number of evicted remaps
+    """
+    entries = {}
+    total = 0
+    try:
+        files = os.listdir(cache_dir)
+    except OSError:
+        return 0
+    for file in files:
+        match = REMAP_FILE_RE.match(file)
+        if match is None:
+            continue
+        path = os.path.join(cache_dir, file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest = match.group(1)
+        mtime, size, paths = entries.get(digest, (0, 0, []))
+        entries[digest] = (max(mtime, stat.st_mtime), size + stat.st_size, paths)
+        paths.append(path)
+        total += stat.st_size
+
+    evicted = 0
+    for mtime, size, paths in sorted(entries.values()):
+        if total <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+        evicted += 1
+    return evicted
+
+
+def get_remap(key, cache_dir=REMAP_CACHE_DIR):
+    """
+    the undistortion maps for a lens setting and image size. They are looked
+    up in memory, then on disk and only computed if neither has them.
+
+    Args:
+        key (tuple): see compute_remap
+        cache_dir (str): directory of the remaps on disk, None to not use it
+    Returns:
+        (map1, map2) fixed point maps for cv2.remap
+    """
+    if key in _remap_cache:
+        _remap_cache.move_to_end(key)
+        return _remap_cache[key]
+
+    maps = None
+    if cache_dir:
+        paths = get_remap_path(key, cache_dir)
+        try:
+            maps = tuple(np.load(path, mmap_mode="r") for path in paths)
+        except (IOError, ValueError):
+            maps = None
+        else:
+            # mark as recently used
+            for path in paths:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+
+    if maps is None:
+        click.secho("Computing the undistortion maps for %s" % (key,), fg="white")
+        maps = compute_remap(key)
+        if cache_dir:
+            try:
+                save_remap(maps, paths)
+            except OSError as error:
+                click.secho("Could not cache the maps: %s" % error, fg="yellow")
+            evicted = prune_remap_cache(cache_dir)
+            if evicted:
+                click.secho("Evicted %s remaps from the cache" % evicted, fg="blue")
+
+    _remap_cache[key] = maps
+    if len(_remap_cache) > REMAP_CACHE_SIZE:
+        _remap_cache.popitem(last=False)
+
+    return maps
+
+
+def get_lens_key(image_path, old):
+    """
+    camera, lens and the setting the photo was taken with. Focal length and
+    aperture are read from the exif data of the photo.
+
+    Returns:
+        (camera maker, camera model, lens maker, lens model, focal length,
+        aperture, distance)
+    """
+    cam_maker = config["camera_maker"]
+    cam_model = config["camera_model"]
+
+    lens_maker = config["lens_maker"]
+    lens_model = config["lens_model"]
+
+    # TODO: this would have to be removed...
+    if old:
+        cam_model = "Nikon D3300"
+        lens_model = "Nikon AF-S DX Zoom-Nikkor 18-55mm f/3.5-5.6G VR"
+
+    setting = get_lens_setting(image_path)
+    focal_length = setting["focal_length"] or DEFAULT_FOCAL_LENGTH
+    aperture = setting["aperture"] or DEFAULT_APERTURE
+    # the distortion of the geometry does not depend on the subject distance.
+    # Keep it constant, so that photos focused at slightly different distances
+    # share one remap instead of each computing and caching their own
+    distance = DEFAULT_DISTANCE
+
+    return (
+        cam_maker,
+        cam_model,
+        lens_maker,
+        lens_model,
+        focal_length,
+        aperture,
+        distance,
+    )
+
+
+def unskew(image_path, old, lens_key=None):
+    """
+    correct the lens distortion of a photo
+
+    Args:
+        image_path (str): path to the photo
+        old (bool): photo was taken with the old camera and zoom lens
+        lens_key (tuple): see get_lens_key, read from the photo if not given
+    Returns:
+        the corrected image
+    """
+    if lens_key is None:
+        lens_key = get_lens_key(image_path, old)
+
+    im = cv2.imread(image_path)
+    return unskew_image(im, lens_key)
+
+
+def unskew_image(im, lens_key):
+    """
+    correct the lens distortion of an already decoded photo
+
+    Args:
+        im (np.array): the photo
+        lens_key (tuple): see get_lens_key
+    Returns:
+        the corrected image
+    """
+    height, width = im.shape[0], im.shape[1]
+
+    map1, map2 = get_remap(lens_key + (width, height))
+
+    unskewed = cv2.remap(im, map1, map2, cv2.INTER_LANCZOS4)
     return unskewed
+
+
+def unskew_directory(src, dest, old=False):
+    """
+    correct the lens distortion of all jpegs in a directory. The photos are
+    processed grouped by their lens setting so that every map is built once.
+
+    Args:
+        src (str): directory of the photos
+        dest (str): directory to write the corrected photos to
+        old (bool): photos were taken with the old camera and zoom lens
+    """
+    groups = collections.OrderedDict()
+    for file in sorted(os.listdir(src)):
+        if file.startswith(".") or not file.lower().endswith((".jpg", ".jpeg")):
+            continue
+        image_path = os.path.join(src, file)
+        groups.setdefault(get_lens_key(image_path, old), []).append(file)
+
+    os.makedirs(dest, exist_ok=True)
+    for lens_key, files in groups.items():
+        click.secho(
+            "%s photos at %smm f/%s" % (len(files), lens_key[4], lens_key[5]),
+            fg="blue",
+        )
+        for file in files:
+            unskewed = unskew(os.path.join(src, file), old, lens_key)
+            cv2.imwrite(os.path.join(dest, file), unskewed)
@@ -1,9 +1,9 @@
-import collections
 import cv2
 import os
 import re
 import shutil
 
+from lib.column_stats import count_white_pixels
 from lib.constants import METHODS, config
 
 
@@ -97,17 +97,6 @@ def show_image(image):
     cv2.destroyAllWindows()
 
 
-def count_white_pixels(array):
-    """
-    count the amount of pixels in an array
-    """
-    count = collections.Counter(array)
-
-    if count.get(255, None):
-        return count.get(255)
-    return 0
-
-
 def get_threshold_values(backdrop, old):
     # threshold values for new images
     # lower --> more orange is detected
@@ -7,10 +7,15 @@ import warnings
 import click
 import cv2
 
-from lib.constants import BINARY_MASKS_DIR
+from lib.constants import BINARY_MASKS_DIR, MASK_OVERLAYS_DIR
+from lib.mask_cache import MASK_CACHE_DIR, prune_mask_cache
+from lib.scheduler import run_file_tasks
 from lib.crop import (
-    binary_mask_parallel,
-    mask_overlay_parallel,
+    binary_mask_file,
+    finish_binary_masks,
+    get_target_dir,
+    mask_overlay_file,
+    plan_binary_masks,
     straighten_binary_masks,
 )
 from lib.utils import (
@@ -21,7 +26,7 @@ from lib.utils import (
 )
 
 
-def copy_results(source, dest, dest_dir_key="Genotype", dest_sub_key=None):
+def copy_results(source, dest, dest_dir_key="Genotype", dest_sub_key=None, files=None):
     """
     move the straightened masks to their final destination
 
@@ -30,9 +35,15 @@ def copy_results(source, dest, dest_dir_key="Genotype", dest_sub_key=None):
         dest (str): absolute path to the dest directory
         dest_dir_key (str): key to be used to name the directory
         dest_sub_key (str): key to be used to name the subdirectory
+        files (list): filenames to copy, all files of source if None
     """
 
-    for file in os.listdir(source):
+    if files is None:
+        files = os.listdir(source)
+
+    for file in files:
+        if file.startswith("."):
+            continue
         corrected_file = file.replace("_px", "px").replace("_ppm", "ppm")
         # extract info from file
         attributes = get_attributes_from_filename(corrected_file)
@@ -87,8 +98,16 @@ def clear_intermediate_dir(dir):
     default="",
     help="The key to be used to name the destination sub directory",
 )
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="only mask new or changed photos, remove the masks of deleted ones",
+)
 @click.option("--keep", is_flag=True, help="keep binary masks in source directory")
 @click.option("--no-black-tape", is_flag=True, help="no black tape around carrot")
+@click.option(
+    "--no-cache", is_flag=True, help="recompute all masks instead of using the cache"
+)
 @click.option("--old", is_flag=True, help="the old pictures")
 @click.option(
     "--smoothen", default=0, help="smoothen the mask. Erosion iterations count."
@@ -100,7 +119,19 @@ def clear_intermediate_dir(dir):
     help="source directory of images to process",
 )
 @click.option("--visualize", is_flag=True, help="create the mask overlay")
-def run(dest, destdir, destsub, keep, no_black_tape, old, smoothen, src, visualize):
+def run(
+    dest,
+    destdir,
+    destsub,
+    incremental,
+    keep,
+    no_black_tape,
+    no_cache,
+    old,
+    smoothen,
+    src,
+    visualize,
+):
     if not src:
         click.secho("No source specified. Use --src", fg="red")
         return
@@ -111,22 +142,49 @@ def run(dest, destdir, destsub, keep, no_black_tape, old, smoothen, src, visuali
     subdirs = get_files_to_process(src)
 
     if visualize is True:
-        name = None
         clear = True
-        with Pool(processes=cpu_count()) as pool:
-            pool.starmap(
-                mask_overlay_parallel,
-                [(dir, smoothen, old, clear, name, no_black_tape) for dir in subdirs],
+        groups = []
+        for dir in subdirs:
+            target = get_target_dir(dir["path"], MASK_OVERLAYS_DIR, clear)
+            groups.append(
+                [(file, target, smoothen, old, no_black_tape) for file in dir["files"]]
             )
+        run_file_tasks(mask_overlay_file, groups, name="mask overlays")
         return
 
+    if incremental and dest and not keep:
+        click.secho(
+            "Keeping the binary masks in the source directory for the next run.",
+            fg="yellow",
+        )
+        keep = True
+
     clear = True
     name = None
-    with Pool(processes=cpu_count()) as pool:
-        pool.starmap(
-            binary_mask_parallel,
-            [(dir, smoothen, old, clear, name, no_black_tape) for dir in subdirs],
-        )
+    cache_dir = None if no_cache else MASK_CACHE_DIR
+    plans = [
+        plan_binary_masks(dir, smoothen, old, clear, name, no_black_tape, incremental)
+        for dir in subdirs
+    ]
+    results = run_file_tasks(
+        binary_mask_file,
+        [
+            [
+                (file, plan["target"], smoothen, old, no_black_tape, cache_dir)
+                for file in plan["files"]
+            ]
+            for plan in plans
+        ],
+        name="binary masks",
+    )
+    written = [
+        finish_binary_masks(plan, plan_results, cache_dir)
+        for plan, plan_results in zip(plans, results)
+    ]
+    if cache_dir:
+        evicted = prune_mask_cache(cache_dir)
+        if evicted:
+            click.secho("Evicted %s masks from the cache" % evicted, fg="blue")
 
     # move result to final destination
     if dest:
@@ -139,8 +197,9 @@ def run(dest, destdir, destsub, keep, no_black_tape, old, smoothen, src, visuali
                         dest,
                         destdir,
                         destsub,
+                        files if incremental else None,
                     )
-                    for dir in subdirs
+                    for dir, files in zip(subdirs, written)
                 ],
             )
 
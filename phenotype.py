@@ -3,13 +3,16 @@ import collections
 import csv
 import math
 from datetime import datetime
+from multiprocessing import Pool, cpu_count
 import pytz
 import timeit
 
 import cv2
 import numpy as np
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 
+from lib.column_stats import ColumnStatistics
 from lib.constants import (
     config,
     DETIPPED_MASKS_DIR,
@@ -24,13 +27,43 @@ from lib.utils import (
 )
 
 
-def get_collection(collection_name):
-    client = MongoClient()
+BULK_WRITE_BATCH_SIZE = 1000
+CSV_PROGRESS_INTERVAL = 10000
+
+_client = None
+
+
+def get_client():
+    """
+    returns the MongoClient of this process. The client keeps its own
+    connection pool, so it is created once and reused.
+    """
+    global _client
+    if _client is None:
+        _client = MongoClient()
+    return _client
+
+
+def get_collection(collection_name, client=None):
+    """
+    Args:
+        collection_name (str): name of the collection in the carrots database
+        client: the client to use. Defaults to the pooled client of this process
+    """
+    if client is None:
+        client = get_client()
     db = client.carrots
     collection = db[collection_name]
     return collection
 
 
+def ensure_indexes(collection):
+    """
+    create the compound (UID, Photo) index the upserts look carrots up by
+    """
+    collection.create_index([("UID", ASCENDING), ("Photo", ASCENDING)])
+
+
 def insert_or_update_instance(collection, instance, verbose: bool) -> str:
     """
     insert a carrot (represented as a dict) into a mongodb collection 
@@ -61,6 +94,134 @@ def insert_or_update_instance(collection, instance, verbose: bool) -> str:
         return "updated"
 
 
+def bulk_insert_or_update_instances(collection, instances, verbose=False):
+    """
+    insert or update a batch of carrots with a single bulk write.
+
+    A carrot is matched by UID and Photo. If there is no such document,
+    a document of the same UID without a Photo (e.g. from a csv import) is
+    updated instead. Carrots without a Photo are matched by UID alone.
+    The existing documents of the whole batch are fetched with one query.
+
+    Args:
+        collection: the mongodb collection
+        instances (list): the carrots (represented as dicts)
+        verbose (bool): output details about the updated instances
+    Returns:
+        (inserted, updated) counts
+    """
+    if not instances:
+        return 0, 0
+
+    now = datetime.now(pytz.utc)
+
+    # (UID, Photo) -> document, Photo is None for documents without a photo
+    existing = {}
+    photoless = collections.Counter()
+    uids = list({instance["UID"] for instance in instances})
+    for doc in collection.find(
+        {"UID": {"$in": uids}}, {"UID": 1, "Photo": 1, "genotype": 1}
+    ):
+        photo = doc.get("Photo", None) or None
+        existing.setdefault((doc["UID"], photo), doc)
+        existing.setdefault((doc["UID"], "*"), doc)
+        if photo is None:
+            photoless[doc["UID"]] += 1
+
+    operations = []
+    for instance in instances:
+        uid = instance["UID"]
+        photo = instance.get("Photo", None) or None
+
+        if photo is None:
+            query = {"UID": uid}
+            match = existing.get((uid, "*"), None)
+        elif (uid, photo) in existing:
+            query = {"UID": uid, "Photo": photo}
+            match = existing[(uid, photo)]
+        elif photoless[uid]:
+            # the carrot will have a photo from now on
+            query = {"UID": uid, "Photo": None}
+            match = existing[(uid, None)]
+            photoless[uid] -= 1
+            if not photoless[uid]:
+                del existing[(uid, None)]
+        else:
+            query = {"UID": uid, "Photo": photo}
+            match = None
+
+        if match is None:
+            update = {"$set": instance, "$setOnInsert": {"created": now}}
+            if photo is None:
+                photoless[uid] += 1
+        else:
+            update = {"$set": dict(instance, modified=now)}
+            if verbose:
+                print("updated UID:", uid)
+                print("genotype before update:", match.get("genotype", None))
+                print("genotype after update:", instance.get("genotype", None))
+
+        operations.append(UpdateOne(query, update, upsert=True))
+
+        # later carrots of the same batch have to see this one
+        existing[(uid, photo)] = instance
+        existing.setdefault((uid, "*"), instance)
+
+    try:
+        result = collection.bulk_write(operations)
+    except BulkWriteError as e:
+        details = e.details
+        for error in details["writeErrors"]:
+            uid = instances[error["index"]]["UID"]
+            click.secho(f"failed to insert UID {uid}: {error['errmsg']}", fg="red")
+        skipped = (
+            len(operations)
+            - details["nUpserted"]
+            - details["nMatched"]
+            - len(details["writeErrors"])
+        )
+        if skipped > 0:
+            click.secho(f"skipped {skipped} carrots after the error", fg="red")
+        return details["nUpserted"], details["nMatched"]
+    return result.upserted_count, result.matched_count
+
+
+def _chunks(iterable, size):
+    """
+    split an iterable into lists of at most `size` items
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_write_instances(
+    collection, instances, verbose=False, batch_size=BULK_WRITE_BATCH_SIZE
+):
+    """
+    write an iterable of carrots to mongodb in batches of `batch_size`
+
+    Returns:
+        (inserted, updated) counts
+    """
+    ensure_indexes(collection)
+
+    inserted = 0
+    updated = 0
+    for batch in _chunks(instances, batch_size):
+        batch_inserted, batch_updated = bulk_insert_or_update_instances(
+            collection, batch, verbose
+        )
+        inserted += batch_inserted
+        updated += batch_updated
+    return inserted, updated
+
+
 def convert_length_to_mm(scale, length_px):
     mm_per_pixel = pixel_to_mm(scale)
     length_mm = length_px * mm_per_pixel
@@ -74,24 +235,87 @@ def convert_surface_to_mm2(scale, surface_px):
     return round(surface_mm2, 4)
 
 
-def count_white_pixels(row):
+def get_biomass(binary_mask):
     """
-    count the amount of pixels in an array
+    counts the number of white pixels
     """
-    count = collections.Counter(row)
 
-    if count.get(255, None):
-        return count.get(255)
-    return 0
+    white_pixels = cv2.countNonZero(binary_mask)
+    return white_pixels
 
 
-def get_biomass(binary_mask):
+def _index_of_first(flags):
     """
-    counts the number of white pixels
+    index of the first True entry in a boolean array, 0 if there is none
     """
+    if not flags.any():
+        return 0
+    return int(np.argmax(flags))
 
-    white_pixels = cv2.countNonZero(binary_mask)
-    return white_pixels
+
+def _occupied(array_2d):
+    """
+    flags every row of the array whose first maximum is not at index 0
+
+    this is the vectorized version of `np.argmax(row) > 0` for every row
+    """
+    return np.argmax(array_2d.reshape(array_2d.shape[0], -1), axis=1) > 0
+
+
+class MaskProfile(ColumnStatistics):
+    """
+    the column statistics of a binary mask, with the traits the trait
+    functions derive from them over and over again
+
+    Attributes:
+        mask (np.array): the binary mask
+        first_white (np.array): per column, index of its first brightest
+            pixel from the top (0 for an empty column)
+        first_white_from_bottom (np.array): per column, index of its first
+            brightest pixel counted from the bottom (0 for an empty column)
+        last_white (np.array): per column, index of its last brightest pixel
+            from the top (-1 for an empty column)
+        tip_index (int): index of the first column containing the carrot
+        shoulder_index (int): index after the last column containing the carrot
+        length (int): length of the carrot in px
+        max_width (int): width of the carrot in px
+
+    and the attributes of ColumnStatistics
+    """
+
+    def __init__(self, binary_mask):
+        super().__init__(binary_mask)
+        self.mask = binary_mask
+        self.height = binary_mask.shape[0]
+        self.width = binary_mask.shape[1]
+
+        # the traits have always taken the brightest pixel of a column as its
+        # first white one, so the grey pixels of a lossy mask count as carrot
+        self.first_white = np.argmax(binary_mask, axis=0)
+        self.first_white_from_bottom = np.argmax(binary_mask[::-1], axis=0)
+        self.last_white = np.where(
+            binary_mask.any(axis=0), self.height - 1 - self.first_white_from_bottom, -1
+        )
+
+        occupied_columns = self.first_white > 0
+        self.tip_index = get_index_of_tip(occupied_columns)
+        self.shoulder_index = get_index_of_shoulder(occupied_columns)
+        self.length = self.shoulder_index - self.tip_index
+
+        occupied_rows = _occupied(binary_mask)
+        start_px = _index_of_first(occupied_rows)
+        end_px = _index_of_first(occupied_rows[::-1])
+        self.max_width = self.height - start_px - end_px
+
+
+def get_mask_profile(binary_mask):
+    """
+    returns the MaskProfile of a binary mask. Pass through if the argument
+    already is a MaskProfile.
+    """
+    if isinstance(binary_mask, MaskProfile):
+        return binary_mask
+    return MaskProfile(binary_mask)
 
 
 def get_max_width(binary_mask):
@@ -103,105 +327,96 @@ def get_max_width(binary_mask):
     ###################################
 
     """
-    start_px = 0
-    end_px = 0
-
-    for i, row in enumerate(binary_mask):
-        max = np.argmax(row)
-        if max > 0:
-            start_px = i
-            break
+    if isinstance(binary_mask, MaskProfile):
+        return binary_mask.max_width
 
-    for i, row in enumerate(binary_mask[::-1]):
-        max = np.argmax(row)
-        if max > 0:
-            end_px = i
-            break
+    occupied_rows = _occupied(binary_mask)
+    start_px = _index_of_first(occupied_rows)
+    end_px = _index_of_first(occupied_rows[::-1])
 
     return binary_mask.shape[0] - start_px - end_px
 
 
 def get_decile_widths(binary_mask, scale):
-    mask_T = binary_mask.T
+    profile = get_mask_profile(binary_mask)
 
-    tip_index = get_index_of_tip(mask_T)
-    shoulder_index = get_index_of_shoulder(mask_T)
-    # print("t", tip_index, "s", shoulder_index)
+    tip_index = profile.tip_index
+    shoulder_index = profile.shoulder_index
     decile = int((shoulder_index - tip_index) / 10)
     decile_indices = [i for i in range(tip_index, tip_index + decile * 10, decile)] + [
         shoulder_index - 1
     ]
-    decile_widths = [count_white_pixels(mask_T[i]) for i in decile_indices]
+    decile_widths = profile.white_counts[decile_indices]
     mm_per_pixel = pixel_to_mm(scale)
-    decile_widths_mm = [round(i * mm_per_pixel, 2) for i in decile_widths]
+    decile_widths_mm = [round(int(i) * mm_per_pixel, 2) for i in decile_widths]
 
     # shoulder to tip, that's why it's reversed here.
     return decile_widths_mm[::-1]
 
 
 def get_max_width_unstraightened(binary_mask):
-    mask_transposed = binary_mask.T
-    white = [count_white_pixels(c) for c in mask_transposed]
-    return max(white)
+    profile = get_mask_profile(binary_mask)
+    return int(profile.white_counts.max())
 
 
 def get_index_of_tip(transposed_mask):
-    start_px = 0
-    for i, row in enumerate(transposed_mask):
-        max = np.argmax(row)
-        if max > 0:
-            start_px = i
-            break
-    return start_px
+    """
+    index of the first column of the carrot
+
+    Args:
+        transposed_mask (np.array): the transposed mask, or a precomputed
+            boolean array flagging the columns that contain the carrot
+    """
+    if transposed_mask.ndim == 1:
+        return _index_of_first(transposed_mask)
+    return _index_of_first(_occupied(transposed_mask))
 
 
 def get_index_of_shoulder(transposed_mask):
-    end_px = 0
-    for i, row in enumerate(transposed_mask[::-1]):
-        max = np.argmax(row)
-        if max > 0:
-            end_px = i
-            break
+    """
+    index after the last column of the carrot
+
+    Args:
+        transposed_mask (np.array): the transposed mask, or a precomputed
+            boolean array flagging the columns that contain the carrot
+    """
+    if transposed_mask.ndim == 1:
+        occupied_columns = transposed_mask
+    else:
+        occupied_columns = _occupied(transposed_mask)
+    end_px = _index_of_first(occupied_columns[::-1])
     return transposed_mask.shape[0] - end_px
-    # return end_px
 
 
 def get_length(binary_mask):
     """
     returns the length of the carrot in pixel
     """
-    mask_T = binary_mask.T
-
-    tip_index = get_index_of_tip(mask_T)
-    shoulder_index = get_index_of_shoulder(mask_T)
-
-    return shoulder_index - tip_index
+    profile = get_mask_profile(binary_mask)
+    return profile.length
 
 
 def get_length_width_ratio(binary_mask):
-    width = get_max_width(binary_mask)
-    length = get_length(binary_mask)
+    profile = get_mask_profile(binary_mask)
+    width = get_max_width(profile)
+    length = get_length(profile)
     ratio = length / width
     return round(ratio, 2)
 
 
 def get_tip_angle_points(binary_mask, tip_length=0.16):
-    mask_T = binary_mask.T
-    tip_index = get_index_of_tip(mask_T)
-    shoulder_index = get_index_of_shoulder(mask_T)
+    profile = get_mask_profile(binary_mask)
+    tip_index = profile.tip_index
 
-    length = shoulder_index - tip_index
+    length = profile.length
     one_quarter = round(length * tip_length)
 
-    first_quarter = binary_mask[:, tip_index : (tip_index + one_quarter)]
-
-    first_quarter_T = first_quarter.T
-
     #####
     # TOP
     #####
-    tip_y = np.argmax(first_quarter_T[0])
-    quarter_y = np.argmax(first_quarter_T[-1])
+    first_quarter_top = profile.first_white[tip_index : (tip_index + one_quarter)]
+    tip_y = int(first_quarter_top[0])
+    quarter_y = int(first_quarter_top[-1])
 
     A_top = (tip_index, tip_y)
     B_top = (tip_index + one_quarter, quarter_y)
@@ -209,13 +424,13 @@ def get_tip_angle_points(binary_mask, tip_length=0.16):
     ########
     # BOTTOM
     ########
-
-    tip_y = np.argmax(first_quarter_T[0][::-1])
-    quarter_y = np.argmax(first_quarter_T[-1][::-1])
+    first_quarter_bottom = profile.first_white_from_bottom[
+        tip_index : (tip_index + one_quarter)
+    ]
 
     # here a conversion has to take place
-    tip_y = len(first_quarter_T[0]) - 1 - tip_y
-    quarter_y = len(first_quarter_T[0]) - 1 - quarter_y
+    tip_y = profile.height - 1 - int(first_quarter_bottom[0])
+    quarter_y = profile.height - 1 - int(first_quarter_bottom[-1])
 
     A_bottom = (tip_index, tip_y)
     B_bottom = (tip_index + one_quarter, quarter_y)
@@ -226,30 +441,33 @@ def get_tip_angle_points(binary_mask, tip_length=0.16):
 def get_biomass_above_tip_angle(binary_mask, tip_length=0.16):
     """
     count the amount of white pixels above the tip angle line.
+
+    the top and bottom edges of the tip are read from the mask profile in
+    one go and compared against the tip angle lines as array arithmetic.
     """
-    A_top, B_top, A_bottom, B_bottom = get_tip_angle_points(binary_mask, tip_length)
+    profile = get_mask_profile(binary_mask)
+    A_top, B_top, A_bottom, B_bottom = get_tip_angle_points(profile, tip_length)
 
-    mask_T = binary_mask.T
+    tip_index = A_top[0]
+    x = np.arange(0, B_top[0] - A_top[0])
 
+    # y coordinate of the top and bottom edge of every tip column
+    edges = np.stack(
+        [profile.first_white, profile.height - 1 - profile.first_white_from_bottom]
+    )[:, tip_index : tip_index + len(x)].astype(np.int64)
+
+    # np.round rounds half to even, just like the built-in round
     m_top = (B_top[1] - A_top[1]) / (B_top[0] - A_top[0]) * -1
-    access_top = 0
-    for x in range(0, B_top[0] - A_top[0]):
-        y_calc = round(m_top * x)
-        y_meas = A_top[1] - np.argmax(mask_T[x + A_top[0]])
-        if y_meas > y_calc:
-            access_top += y_meas - y_calc
+    y_calc_top = np.round(m_top * x).astype(np.int64)
+    y_meas_top = A_top[1] - edges[0]
+    access_top = np.clip(y_meas_top - y_calc_top, 0, None).sum()
 
     m_bottom = (B_bottom[1] - A_bottom[1]) / (B_bottom[0] - A_bottom[0]) * -1
-    access_bottom = 0
-    for x in range(0, B_bottom[0] - A_bottom[0]):
-        y_meas = (
-            len(mask_T[0]) - 1 - np.argmax(mask_T[x + A_bottom[0]][::-1]) - A_bottom[1]
-        )
-        y_calc = round(m_bottom * x) * -1
-        if y_meas > y_calc:
-            access_bottom += y_meas - y_calc
+    y_calc_bottom = np.round(m_bottom * x).astype(np.int64) * -1
+    y_meas_bottom = edges[1] - A_bottom[1]
+    access_bottom = np.clip(y_meas_bottom - y_calc_bottom, 0, None).sum()
 
-    return access_top, access_bottom
+    return int(access_top), int(access_bottom)
 
 
 def get_tip_angles(binary_mask, tip_length=0.16):
@@ -275,45 +493,52 @@ def get_tip_angles(binary_mask, tip_length=0.16):
     return theta_top_deg, theta_bottom_deg
 
 
+def _index_of_min_from_right(values, ceiling=1000):
+    """
+    walks the values from right to left and returns the smallest value
+    and its position counted from the right (1-based). Mimics a loop that
+    only accepts values smaller than `ceiling`.
+    """
+    reversed_values = values[::-1]
+    if not len(reversed_values):
+        return ceiling, 0
+    i = int(np.argmin(reversed_values))
+    if reversed_values[i] >= ceiling:
+        return ceiling, 0
+    return int(reversed_values[i]), len(values) - i
+
+
 def get_shoulders(binary_mask):
-    mask_T = binary_mask.T
+    profile = get_mask_profile(binary_mask)
 
-    length = get_length(binary_mask)
-    shoulder_index = get_index_of_shoulder(mask_T)
+    length = profile.length
+    shoulder_index = profile.shoulder_index
 
     one_quarter = round(length / 4)
-    last_quarter = binary_mask[:, (shoulder_index - one_quarter) : shoulder_index]
-
-    last_quarter_T = last_quarter.T
-
-    max_white_top = 1000
-    max_white_top_index = 0
-    for i, column in enumerate(last_quarter_T[::-1]):
-        col_index = np.argmax(column)
-        if col_index < max_white_top:
-            max_white_top = col_index
-            max_white_top_index = last_quarter.shape[1] - i
-
-    max_white_bottom = 1000
-    max_white_bottom_index = 0
-    for i, column in enumerate(last_quarter_T[::-1]):
-        col_index = np.argmax(column[::-1])
-        if col_index < max_white_bottom:
-            max_white_bottom = col_index
-            max_white_bottom_index = last_quarter.shape[1] - i
-    max_white_bottom = last_quarter.shape[0] - max_white_bottom - 1
+    quarter_from = shoulder_index - one_quarter
+    quarter_height = profile.height
+    quarter_width = len(profile.first_white[quarter_from:shoulder_index])
+
+    max_white_top, max_white_top_index = _index_of_min_from_right(
+        profile.first_white[quarter_from:shoulder_index]
+    )
+
+    max_white_bottom, max_white_bottom_index = _index_of_min_from_right(
+        profile.first_white_from_bottom[quarter_from:shoulder_index]
+    )
+    max_white_bottom = quarter_height - max_white_bottom - 1
 
     top_y_min = max_white_top
-    top_y_max = last_quarter.shape[0] // 2
+    top_y_max = quarter_height // 2
 
-    top_x_min = shoulder_index - last_quarter.shape[1] + max_white_top_index - 1
+    top_x_min = shoulder_index - quarter_width + max_white_top_index - 1
 
     top_x_max = shoulder_index
 
-    bottom_y_min = last_quarter.shape[0] // 2
+    bottom_y_min = quarter_height // 2
     bottom_y_max = max_white_bottom
 
-    bottom_x_min = shoulder_index - last_quarter.shape[1] + max_white_bottom_index - 1
+    bottom_x_min = shoulder_index - quarter_width + max_white_bottom_index - 1
 
     bottom_x_max = shoulder_index
 
@@ -333,7 +558,9 @@ def get_shouldering(binary_mask):
     """
     a heuristic for the shouldering of the carrot.
     """
-    shoulder_dict = get_shoulders(binary_mask)
+    profile = get_mask_profile(binary_mask)
+    binary_mask = profile.mask
+    shoulder_dict = get_shoulders(profile)
 
     top_y_min = shoulder_dict["top_y_min"]
     top_y_max = shoulder_dict["top_y_max"]
@@ -368,16 +595,34 @@ def assemble_instance(file):
         return
 
     image = cv2.imread(file, cv2.IMREAD_GRAYSCALE)
+    return assemble_instance_from_mask(image, instance)
+
+
+def assemble_instance_from_mask(image, instance):
+    """
+    add the traits of a mask to its instance
+
+    Args:
+        image (np.array): the binary mask
+        instance (dict): the attributes of the mask, as parsed from its
+            filename. Needs a Scale
+    Returns:
+        the instance
+    """
+    scale = instance["Scale"]
+
+    # none of the traits alter the mask, so they can all share one profile
+    profile = MaskProfile(image)
 
-    width_px = get_max_width(image.copy())
+    width_px = get_max_width(profile)
     width_mm = convert_length_to_mm(scale, width_px)
 
-    decile_widths = get_decile_widths(image.copy(), scale)
+    decile_widths = get_decile_widths(profile, scale)
 
-    length_px = get_length(image.copy())
+    length_px = get_length(profile)
     length_mm = convert_length_to_mm(scale, length_px)
 
-    biomass_px = get_biomass(image.copy())
+    biomass_px = get_biomass(image)
     biomass_mm2 = convert_surface_to_mm2(scale, biomass_px)
 
     instance["biomass"] = biomass_mm2
@@ -394,21 +639,21 @@ def assemble_instance(file):
     instance["width_90"] = decile_widths[9]
     instance["width_100"] = decile_widths[10]
     instance["length"] = length_mm
-    instance["length_width_ratio"] = get_length_width_ratio(image.copy())
+    instance["length_width_ratio"] = get_length_width_ratio(profile)
 
-    shoulder_top_px, shoulder_bottom_px = get_shouldering(image.copy())
+    shoulder_top_px, shoulder_bottom_px = get_shouldering(profile)
     shoulder_top_mm2 = convert_surface_to_mm2(scale, shoulder_top_px)
     shoulder_bottom_mm2 = convert_surface_to_mm2(scale, shoulder_bottom_px)
 
     instance["shoulder_top"] = shoulder_top_mm2
     instance["shoulder_bottom"] = shoulder_bottom_mm2
 
-    tip_angle_top, tip_angle_bottom = get_tip_angles(image.copy())
+    tip_angle_top, tip_angle_bottom = get_tip_angles(profile)
     instance["tip_angle_top"] = tip_angle_top
     instance["tip_angle_bottom"] = tip_angle_bottom
 
     above_tipangle_top_px, above_tipangle_bottom_px = get_biomass_above_tip_angle(
-        image.copy()
+        profile
     )
     above_tipangle_top_mm2 = convert_surface_to_mm2(scale, above_tipangle_top_px)
     above_tipangle_bottom_mm2 = convert_surface_to_mm2(scale, above_tipangle_bottom_px)
@@ -418,26 +663,79 @@ def assemble_instance(file):
     return instance
 
 
-def assemble_instance_from_csv(csv_file):
-    instances = {}
-    header = []
+def _assemble_instance_safe(file):
+    """
+    wrapper around assemble_instance that reports errors instead of raising,
+    so one broken mask does not take down the whole batch
+    """
+    try:
+        return file, assemble_instance(file), None
+    except Exception as e:
+        return file, None, str(e)
+
+
+def phenotype_batch(paths, workers=None, chunksize=1):
+    """
+    phenotype a batch of masks in worker processes
+
+    Args:
+        paths (list): absolute paths of the masks to phenotype
+        workers (int): number of worker processes. Defaults to the cpu count.
+        chunksize (int): number of masks handed to a worker at once
+    Yields:
+        (file, instance, error) tuples in order of completion. instance is
+        None if the mask could not be phenotyped.
+    """
+    if workers is None:
+        workers = cpu_count()
+
+    if workers <= 1:
+        for file in paths:
+            yield _assemble_instance_safe(file)
+        return
+
+    with Pool(processes=workers) as pool:
+        for result in pool.imap_unordered(_assemble_instance_safe, paths, chunksize):
+            yield result
+
+
+def _successful_instances(results):
+    """
+    report the failed masks of a phenotype_batch and pass on the instances
+    """
+    for file, instance, error in results:
+        if error is not None:
+            print(error)
+            click.secho(file, fg="red")
+        if instance is not None:
+            yield instance
+
+
+def read_csv_rows(csv_file):
+    """
+    stream the rows of a csv file one by one
+
+    Yields:
+        (uid, row) tuples where row is a dict of the remaining columns
+    """
     with open(csv_file, mode="r", encoding="utf-8-sig") as f:
         reader = csv.reader(f, dialect="excel")
-        lines_read = 0
+        header = next(reader, None)
+        if header is None:
+            return
+        if header[0] != "UID":
+            raise Exception("Looks like the first column does not contain the UIDs.")
         for row in reader:
-            lines_read += 1
-            if lines_read == 1:
-                if row[0] != "UID":
-                    raise Exception(
-                        "Looks like the first column does not contain the UIDs."
-                    )
-                header = row
-                continue
             uid = row[0].strip()
-            if uid not in instances.keys():
-                instances[uid] = {}
-            for i, key in enumerate(header[1:]):
-                instances[uid][key] = row[i + 1].strip()
+            yield uid, {key: row[i + 1].strip() for i, key in enumerate(header[1:])}
+
+
+def assemble_instance_from_csv(csv_file):
+    instances = {}
+    for uid, row in read_csv_rows(csv_file):
+        if uid not in instances.keys():
+            instances[uid] = {}
+        instances[uid].update(row)
 
     instances_list = []
     for uid in instances.keys():
@@ -447,6 +745,50 @@ def assemble_instance_from_csv(csv_file):
     return instances_list
 
 
+def stream_instances_from_csv(
+    csv_file, window=BULK_WRITE_BATCH_SIZE, progress_every=CSV_PROGRESS_INTERVAL
+):
+    """
+    stream the carrots of a csv file without reading the whole file first.
+
+    Rows are collected in a window of `window` UIDs. Rows of the same UID
+    within a window are merged, the last row wins. Across windows the last
+    row wins once the carrots are written to the database in order.
+
+    Args:
+        csv_file (str): path to the csv file
+        window (int): number of UIDs to collect before passing them on
+        progress_every (int): report the progress every n rows
+    Yields:
+        instances (dict)
+    """
+    tic = timeit.default_timer()
+    rows_read = 0
+    instances = {}
+
+    for uid, row in read_csv_rows(csv_file):
+        rows_read += 1
+        if uid not in instances.keys():
+            if len(instances) == window:
+                yield from instances.values()
+                instances = {}
+            instances[uid] = {}
+        instances[uid].update(row)
+        instances[uid]["UID"] = uid
+
+        if progress_every and rows_read % progress_every == 0:
+            rate = rows_read / (timeit.default_timer() - tic)
+            click.echo("Read %s rows (%.0f rows/sec)" % (rows_read, rate))
+
+    yield from instances.values()
+
+    duration = timeit.default_timer() - tic
+    rate = rows_read / duration if duration else 0
+    click.echo(
+        "Read %s rows in %.2f seconds (%.0f rows/sec)" % (rows_read, duration, rate)
+    )
+
+
 @click.command()
 @click.option(
     "--collection",
@@ -476,7 +818,14 @@ def assemble_instance_from_csv(csv_file):
     is_flag=True,
     help="Output details about the instances that are updated in the database.",
 )
-def run(collection, csv, dry, src, type, verbose):
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    default=cpu_count(),
+    help="number of worker processes used to phenotype the masks",
+)
+def run(collection, csv, dry, src, type, verbose, workers):
     """
 
     Curvature: mm (describing the number of mm the carrot has been pulled down to center)  
@@ -528,6 +877,7 @@ def run(collection, csv, dry, src, type, verbose):
 
     inserted = 0
     updated = 0
+    instances = []
 
     if src is not None:
         type_map = {
@@ -536,40 +886,17 @@ def run(collection, csv, dry, src, type, verbose):
             "detipped": DETIPPED_MASKS_DIR,
         }
         subdirs = get_masks_to_process(src, type_map[mask_type])
-        for dir in subdirs:
-            for file in dir["files"]:
-                try:
-                    instance = assemble_instance(file)
-                except Exception as e:
-                    print(e)
-                    instance = None
-                    click.secho(file, fg="red")
-                if instance is not None:
-                    if dry:
-                        print(instance)
-                    else:
-                        try:
-                            action = insert_or_update_instance(
-                                collection, instance, verbose
-                            )
-                        except Exception as e:
-                            click.secho(f"failed to insert {file}", fg="red")
-                        if action == "inserted":
-                            inserted += 1
-                        elif action == "updated":
-                            updated += 1
+        files = [file for dir in subdirs for file in dir["files"]]
+        instances = _successful_instances(phenotype_batch(files, workers=workers))
 
     if csv is not None:
-        instances = assemble_instance_from_csv(csv)
+        instances = stream_instances_from_csv(csv)
+
+    if dry:
         for instance in instances:
-            if dry:
-                print(instance)
-            else:
-                action = insert_or_update_instance(collection, instance)
-                if action == "inserted":
-                    inserted += 1
-                elif action == "updated":
-                    updated += 1
+            print(instance)
+    else:
+        inserted, updated = bulk_write_instances(collection, instances, verbose)
 
     toc = timeit.default_timer()
     duration = toc - tic
@@ -0,0 +1,137 @@
+from multiprocessing import cpu_count
+import os
+import timeit
+import warnings
+
+import click
+from joblib import load
+
+from lib.pipeline import PIPELINE_OUTPUTS, phenotype_photo_safe, report_stage_timings
+from lib.scheduler import run_file_tasks
+from lib.straighten import (
+    DEFAULT_SKELETON_BACKEND,
+    SKELETON_BACKENDS,
+    get_skeleton_backends,
+)
+from lib.utils import get_files_to_process
+from phenotype import bulk_write_instances, get_collection
+
+
+@click.command()
+@click.option(
+    "--collection",
+    "-c",
+    default="test_collection",
+    help="name of the database collection",
+)
+@click.option("--dry", "-d", is_flag=True, help="don't touch the database")
+@click.option(
+    "--src",
+    "-s",
+    type=click.Path(exists=True),
+    help="source directory of images to process",
+)
+@click.option(
+    "--write",
+    type=click.Choice(list(PIPELINE_OUTPUTS)),
+    multiple=True,
+    help="also write these masks next to the photos, can be given more than once",
+)
+@click.option(
+    "--skeleton",
+    type=click.Choice(SKELETON_BACKENDS),
+    default=DEFAULT_SKELETON_BACKEND,
+    help="how the masks are skeletonized",
+)
+@click.option(
+    "--smoothen", type=click.INT, default=0, help="erosion iterations of the masks"
+)
+@click.option("--old", is_flag=True, help="process old images")
+@click.option("--no-black-tape", is_flag=True, help="no black tape arround carrot")
+@click.option(
+    "--verbose",
+    "-v",
+    is_flag=True,
+    help="Output details about the instances that are updated in the database.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    default=cpu_count(),
+    help="number of worker processes",
+)
+def run(
+    collection,
+    dry,
+    src,
+    write,
+    skeleton,
+    smoothen,
+    old,
+    no_black_tape,
+    verbose,
+    workers,
+):
+    """
+    phenotype the photos of the carrots in one go: binary mask, straightened
+    mask, detipped mask and traits are computed in memory, photo by photo.
+    The masks are only written to disk if asked for with --write.
+    """
+    if not src:
+        click.secho("No source specified. Use --src", fg="red")
+        return
+
+    if skeleton not in get_skeleton_backends():
+        click.secho("%s needs opencv-contrib-python" % skeleton, fg="red")
+        return
+
+    tic = timeit.default_timer()
+    if dry:
+        collection = None
+    else:
+        collection = get_collection(collection)
+
+    regr = load("tip-mask-model.joblib")
+
+    groups = [
+        [
+            (file, regr, smoothen, old, no_black_tape, skeleton, write)
+            for file in dir["files"]
+        ]
+        for dir in get_files_to_process(src)
+    ]
+    results = run_file_tasks(
+        phenotype_photo_safe, groups, workers=workers, name="pipeline"
+    )
+
+    instances = []
+    timings = []
+    for group in results:
+        for file, instance, error, photo_timings in group:
+            if error is not None:
+                print(error)
+                click.secho(file, fg="red")
+            else:
+                instances.append(instance)
+                timings.append(photo_timings)
+    report_stage_timings(timings)
+
+    inserted = 0
+    updated = 0
+    if dry:
+        for instance in instances:
+            print(instance)
+    else:
+        inserted, updated = bulk_write_instances(collection, instances, verbose)
+
+    toc = timeit.default_timer()
+    duration = toc - tic
+    msg = "Inserted %s and updated %s in %.2f seconds." % (inserted, updated, duration)
+    click.secho(msg, fg="green")
+
+
+if __name__ == "__main__":
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        run()
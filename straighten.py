@@ -8,7 +8,18 @@ import click
 import cv2
 
 from lib.constants import BINARY_MASKS_DIR, STRAIGHTENED_MASKS_DIR, config
-from lib.crop import binary_mask_parallel, straighten_binary_masks
+from lib.crop import (
+    get_masks_to_straighten,
+    report_skeleton_timings,
+    straighten_binary_mask_file,
+    straighten_binary_masks_java,
+)
+from lib.scheduler import run_file_tasks
+from lib.straighten import (
+    DEFAULT_SKELETON_BACKEND,
+    SKELETON_BACKENDS,
+    get_skeleton_backends,
+)
 from lib.utils import (
     clear_and_create,
     get_threshold_values,
@@ -93,7 +104,14 @@ def copy_results(
     default="",
     help="The key to be used to name the destination sub directory",
 )
+@click.option("--java", is_flag=True, help="use the legacy java straightener instead")
 @click.option("--keep", is_flag=True, help="keep binary masks in source directory")
+@click.option(
+    "--skeleton",
+    type=click.Choice(SKELETON_BACKENDS),
+    default=DEFAULT_SKELETON_BACKEND,
+    help="how to skeletonize the masks to find their midline",
+)
 @click.option("--smoothen", is_flag=True, help="smoothen the mask")
 @click.option(
     "--src",
@@ -101,16 +119,33 @@ def copy_results(
     type=click.Path(exists=True),
     help="source directory of binary masks to process",
 )
-def run(dest, destdir, destsub, keep, smoothen, src):
+def run(dest, destdir, destsub, java, keep, skeleton, smoothen, src):
     if not src:
         click.secho("No source specified. Use --src", fg="red")
         return
 
+    if skeleton not in get_skeleton_backends():
+        click.secho("%s needs opencv-contrib-python" % skeleton, fg="red")
+        return
+
     subdirs = get_masks_to_process(src, BINARY_MASKS_DIR)
 
     # straighten masks
-    with Pool(processes=cpu_count()) as pool:
-        pool.starmap(straighten_binary_masks, [(dir["path"],) for dir in subdirs])
+    if java:
+        # the java straightener takes a whole directory
+        run_file_tasks(
+            straighten_binary_masks_java, [[(dir["path"],)] for dir in subdirs]
+        )
+    else:
+        timings = run_file_tasks(
+            straighten_binary_mask_file,
+            [
+                [(file, skeleton) for file in get_masks_to_straighten(dir["path"])]
+                for dir in subdirs
+            ],
+            name="straightening",
+        )
+        report_skeleton_timings(sum(timings, []), skeleton)
 
     if dest and not os.path.exists(dest):
         pathlib.Path(dest).mkdir(parents=True)
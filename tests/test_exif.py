@@ -0,0 +1,60 @@
+import struct
+
+import pytest
+
+from lib.exif import FNUMBER, FOCAL_LENGTH, get_lens_setting
+
+
+def create_tiff(focal_length, aperture):
+    """
+    a little endian TIFF structure with the focal length and aperture in IFD0
+    """
+    entries = [(FOCAL_LENGTH, focal_length), (FNUMBER, aperture)]
+    ifd_size = 2 + 12 * len(entries) + 4
+    values_offset = 8 + ifd_size
+
+    ifd = struct.pack("<H", len(entries))
+    values = b""
+    for index, (tag, value) in enumerate(entries):
+        offset = values_offset + 8 * index
+        ifd += struct.pack("<HHII", tag, 5, 1, offset)
+        values += struct.pack("<II", int(value * 10), 10)
+    ifd += struct.pack("<I", 0)
+
+    return b"II*\x00" + struct.pack("<I", 8) + ifd + values
+
+
+def create_jpeg_header(tiff):
+    data = b"Exif\x00\x00" + tiff
+    return b"\xff\xd8\xff\xe1" + struct.pack(">H", len(data) + 2) + data
+
+
+def write(tmpdir, data):
+    path = tmpdir.join("photo.jpg")
+    path.write_binary(data)
+    return str(path)
+
+
+def test_lens_setting_is_read_from_the_exif_data(tmpdir):
+    path = write(tmpdir, create_jpeg_header(create_tiff(35, 5.6)))
+    setting = get_lens_setting(path)
+    assert setting["focal_length"] == 35
+    assert setting["aperture"] == 5.6
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\xff\xd8",
+        b"\xff\xd8\xff\xe1",
+        b"\xff\xd8\xff\xe1\x00",
+        b"\xff\xd8\xff\xe1\x00\x00",
+        b"\xff\xd8\xff\xe1\x00\x01",
+        b"\xff\xd8\xff\xe0\x00",
+        create_jpeg_header(create_tiff(35, 5.6))[:30],
+    ],
+)
+def test_truncated_header_has_no_lens_setting(tmpdir, data):
+    path = write(tmpdir, data)
+    assert set(get_lens_setting(path).values()) == {None}
@@ -0,0 +1,207 @@
+import cv2
+import mongomock
+import numpy as np
+import pytest
+
+from phenotype import (
+    BULK_WRITE_BATCH_SIZE,
+    bulk_write_instances,
+    get_biomass_above_tip_angle,
+    get_mask_profile,
+    get_tip_angle_points,
+)
+
+
+def loop_biomass_above_tip_angle(binary_mask, tip_length=0.16):
+    """
+    the column by column loop get_biomass_above_tip_angle was vectorized from,
+    kept as the reference
+    """
+    profile = get_mask_profile(binary_mask)
+    A_top, B_top, A_bottom, B_bottom = get_tip_angle_points(profile, tip_length)
+
+    m_top = (B_top[1] - A_top[1]) / (B_top[0] - A_top[0]) * -1
+    access_top = 0
+    for x in range(0, B_top[0] - A_top[0]):
+        y_calc = round(m_top * x)
+        y_meas = A_top[1] - int(profile.first_white[x + A_top[0]])
+        if y_meas > y_calc:
+            access_top += y_meas - y_calc
+
+    m_bottom = (B_bottom[1] - A_bottom[1]) / (B_bottom[0] - A_bottom[0]) * -1
+    access_bottom = 0
+    for x in range(0, B_bottom[0] - A_bottom[0]):
+        y_meas = (
+            profile.height
+            - 1
+            - int(profile.first_white_from_bottom[x + A_bottom[0]])
+            - A_bottom[1]
+        )
+        y_calc = round(m_bottom * x) * -1
+        if y_meas > y_calc:
+            access_bottom += y_meas - y_calc
+
+    return access_top, access_bottom
+
+
+def create_carrot(length, tip=20, height=120, max_width=60, bulge=0.0, offset=0):
+    """
+    a carrot lying on its side, tip on the left. bulge pushes the edges of
+    the tip outwards (> 0) or inwards (< 0), offset moves it up or down
+    """
+    mask = np.zeros((height, tip + length + 20), dtype=np.uint8)
+    for i in range(length):
+        position = i / length
+        half_width = max_width / 2 * (position + bulge * np.sin(np.pi * position))
+        half_width = int(round(min(max(half_width, 1), height / 2 - 1)))
+        center = height // 2 + offset
+        top = max(center - half_width, 0)
+        mask[top : center + half_width + 1, tip + i] = 255
+    return mask
+
+
+def create_random_carrots(count, seed=0):
+    """
+    carrots with ragged edges, to hit both signs of the difference to the
+    tip angle lines
+    """
+    random = np.random.RandomState(seed)
+    masks = []
+    for _ in range(count):
+        mask = create_carrot(random.randint(40, 400), bulge=random.uniform(-0.5, 1))
+        occupied = np.flatnonzero(mask.any(axis=0))
+        for column in occupied:
+            rows = np.flatnonzero(mask[:, column])
+            jitter = random.randint(-3, 4, 2)
+            mask[:, column] = 0
+            top = max(rows[0] + jitter[0], 0)
+            bottom = max(rows[-1] + jitter[1], top)
+            mask[top : bottom + 1, column] = 255
+        masks.append(mask)
+    return masks
+
+
+MASKS = {
+    "empty": np.zeros((50, 80), dtype=np.uint8),
+    "single column": create_carrot(1),
+    "short": create_carrot(7),
+    "straight edges": create_carrot(300),
+    "bulging tip": create_carrot(300, bulge=0.8),
+    "hollow tip": create_carrot(300, bulge=-0.4),
+    "off center": create_carrot(300, bulge=0.3, offset=25),
+    "tip at the left edge": create_carrot(300, tip=0, bulge=0.5),
+    "tip at the right edge": create_carrot(300, bulge=0.5)[:, : 20 + 300 // 8],
+    "touching the top": create_carrot(300, height=61, bulge=0.5, offset=-30),
+    "touching the bottom": create_carrot(300, height=61, bulge=0.5, offset=30),
+}
+for index, mask in enumerate(create_random_carrots(20)):
+    MASKS["random %s" % index] = mask
+
+
+@pytest.mark.parametrize("name", sorted(MASKS))
+@pytest.mark.parametrize("tip_length", [0.16, 0.5])
+def test_biomass_above_tip_angle_matches_loop(name, tip_length):
+    mask = MASKS[name]
+    try:
+        expected = loop_biomass_above_tip_angle(mask, tip_length)
+    except Exception as e:
+        with pytest.raises(type(e)):
+            get_biomass_above_tip_angle(mask, tip_length)
+        return
+
+    biomass = get_biomass_above_tip_angle(mask, tip_length)
+    assert biomass == expected
+    assert all(type(access) is int for access in biomass)
+
+
+def test_mask_profile_keeps_the_grey_pixels_of_lossy_masks():
+    mask = create_carrot(300)
+    # like the masks mask.py and tipmask.py write as jpeg
+    ok, jpeg = cv2.imencode(".jpg", mask)
+    mask = cv2.imdecode(jpeg, cv2.IMREAD_GRAYSCALE)
+    # a column with nothing but grey pixels
+    mask[40:50, 325] = 128
+    assert ((mask > 0) & (mask < 255)).any()
+
+    profile = get_mask_profile(mask)
+    assert profile.first_white.tolist() == np.argmax(mask, axis=0).tolist()
+    assert (
+        profile.first_white_from_bottom.tolist()
+        == np.argmax(mask[::-1], axis=0).tolist()
+    )
+    assert (
+        profile.white_counts.tolist() == np.count_nonzero(mask == 255, axis=0).tolist()
+    )
+    assert profile.first_white[325] == 40
+    assert profile.shoulder_index == 326
+
+
+def create_instances(count, photo=1, genotype="G1"):
+    return [
+        {"UID": "%s-2018" % uid, "Photo": photo, "genotype": genotype, "length": uid}
+        for uid in range(count)
+    ]
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().carrots.test_collection
+
+
+def test_bulk_write_creates_the_uid_photo_index(collection):
+    bulk_write_instances(collection, create_instances(3))
+
+    keys = [index["key"] for index in collection.index_information().values()]
+    assert [("UID", 1), ("Photo", 1)] in keys
+
+
+def test_bulk_write_updates_on_reimport(collection):
+    assert bulk_write_instances(collection, create_instances(5)) == (5, 0)
+    assert bulk_write_instances(collection, create_instances(5, genotype="G2")) == (
+        0,
+        5,
+    )
+
+    documents = list(collection.find())
+    assert len(documents) == 5
+    assert {document["genotype"] for document in documents} == {"G2"}
+    assert all("created" in document for document in documents)
+    assert all("modified" in document for document in documents)
+
+
+def test_bulk_write_keeps_photos_of_one_carrot_apart(collection):
+    bulk_write_instances(collection, create_instances(3, photo=1))
+    assert bulk_write_instances(collection, create_instances(3, photo=2)) == (3, 0)
+    assert collection.count_documents({}) == 6
+
+
+def test_bulk_write_gives_photoless_documents_a_photo(collection):
+    # a carrot imported from a csv, before it was photographed
+    collection.insert_one({"UID": "0-2018", "genotype": "G1"})
+
+    assert bulk_write_instances(collection, create_instances(1)) == (0, 1)
+    assert list(collection.find({}, {"_id": 0, "UID": 1, "Photo": 1})) == [
+        {"UID": "0-2018", "Photo": 1}
+    ]
+
+
+def test_bulk_write_in_batches(collection, monkeypatch):
+    batches = []
+    bulk_write = collection.bulk_write
+
+    def count_bulk_write(operations, *args, **kwargs):
+        batches.append(len(operations))
+        return bulk_write(operations, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", count_bulk_write)
+    count = BULK_WRITE_BATCH_SIZE + 5
+
+    assert bulk_write_instances(collection, iter(create_instances(count))) == (
+        count,
+        0,
+    )
+    assert batches == [BULK_WRITE_BATCH_SIZE, 5]
+    assert collection.count_documents({}) == count
+
+    assert bulk_write_instances(collection, create_instances(count)) == (0, count)
+    assert batches[2:] == [BULK_WRITE_BATCH_SIZE, 5]
@@ -0,0 +1,307 @@
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+from lib.straighten import get_carrot_rows, get_curvature, straighten_mask
+
+# root hairs are less than this many px, see Straightener.THRESHOLD
+JAVA_THRESHOLD = 100
+# see Straightener.WINDOW_SIZE and Straightener.SMOOTHING_WINDOW
+JAVA_WINDOW_SIZE = 12
+JAVA_SMOOTHING_WINDOW = 20
+
+
+def java_find_carrot(mask, x):
+    """
+    port of Straightener.findCarrot: first and last row of the carrot in a
+    column, (-1, height - 1) if there is none
+    """
+    height = mask.shape[0]
+    start, end = -1, height - 1
+    cur_start, cur_end = -1, height - 1
+
+    def choose(start, end, cur_start, cur_end):
+        if start < 0 or (
+            (end - start) < (cur_end - cur_start) and (end - start) < JAVA_THRESHOLD
+        ):
+            return cur_start, cur_end
+        if cur_end - cur_start >= JAVA_THRESHOLD and end - start >= JAVA_THRESHOLD:
+            return start, cur_end
+        return start, end
+
+    for y in range(height):
+        carrot = mask[y, x] > 128
+        if carrot and cur_start < 0:
+            cur_start = y
+        if not carrot and cur_start >= 0:
+            cur_end = y - 1
+            start, end = choose(start, end, cur_start, cur_end)
+            cur_start, cur_end = -1, height - 1
+
+    if cur_start >= 0:
+        start, end = choose(start, end, cur_start, cur_end)
+    return start, end
+
+
+def java_column_data(mask):
+    """
+    port of Straightener.getColumnData: [x, center, width, relative
+    adjustment] of the columns with a carrot, from the shoulder to the tip
+    """
+    centerline = mask.shape[0] // 2
+    columns = []
+    previous = None
+    for x in range(mask.shape[1] - 1, -1, -1):
+        start, end = java_find_carrot(mask, x)
+        if start < 0:
+            continue
+        center = int((end - start) / 2) + start
+        adjust = centerline - center
+        relative = 0 if previous is None else previous - adjust
+        columns.append([x, center, end - start, relative])
+        previous = adjust
+    return columns
+
+
+def java_curvature(mask):
+    """
+    port of the curvature of Straightener.process
+    """
+    columns = java_column_data(mask)
+    first_x, first_y = columns[0][:2]
+    last_x, last_y = columns[-1][:2]
+    total_adjustment = sum(center - first_y for x, center, _, _ in columns)
+
+    # int division in java truncates towards zero
+    integral_of_diagonal = abs(int((last_x - first_x - 1) * (first_y - last_y) / 2))
+    return int(math.sqrt(abs(total_adjustment - integral_of_diagonal)))
+
+
+def java_find_slope(columns, index):
+    """
+    port of Straightener.findSlope
+    """
+    total = 0
+    num = 0
+    for half in (JAVA_WINDOW_SIZE // 2, JAVA_WINDOW_SIZE // 4):
+        for i in range(max(index - half, 0), min(index + half, len(columns))):
+            total += columns[i][3]
+            num += 1
+    return 0 if total == 0 else total / (-1.0 * num)
+
+
+def java_find_width(mask, slope, x, y):
+    """
+    port of Straightener.findWidth
+    """
+    height, width = mask.shape
+
+    def is_carrot(x, y):
+        return 0 <= x < width and 0 <= y < height and mask[y, x] > 128
+
+    x_right, y_right = x, float(y)
+    while is_carrot(x_right, int(y_right)):
+        x_right += 1
+        y_right += slope
+    if not is_carrot(x_right, int(y_right - slope / 2)):
+        x_right -= 1
+        y_right -= slope
+
+    x_left, y_left = x, float(y)
+    while is_carrot(x_left, int(y_left)):
+        x_left -= 1
+        y_left -= slope
+    if not is_carrot(x_left, int(y_left + slope / 2)):
+        x_left += 1
+        y_left += slope
+
+    return int(math.sqrt((x_right - x_left) ** 2 + (y_right - y_left) ** 2))
+
+
+def java_straightened_widths(mask):
+    """
+    port of the straightening of Straightener.process: the width of every
+    column of the straightened mask, from the tip to the shoulder
+    """
+    columns = java_column_data(mask)
+
+    def balance(a, b):
+        adj1, adj2 = columns[a][3], columns[b][3]
+        if abs(adj1 + adj2) < abs(adj1) + abs(adj2):
+            delta = min(abs(adj1), abs(adj2))
+            if columns[a][3] < 0:
+                columns[a][3] += delta
+                columns[b][3] -= delta
+            else:
+                columns[a][3] -= delta
+                columns[b][3] += delta
+
+    for i in range(1, len(columns)):
+        balance(i - 1, i)
+    for i in range(1, len(columns) - 1):
+        balance(i - 1, i + 1)
+
+    unsmoothed = []
+    for index, (x, center, width, _) in enumerate(columns):
+        slope = java_find_slope(columns, index)
+        if slope != 0:
+            width = max(1, java_find_width(mask, -1 * (1.0 / slope), x, center))
+        unsmoothed.append(width)
+
+    widths = []
+    adjust_row = 0.0
+    half = JAVA_SMOOTHING_WINDOW // 2
+    for index in range(len(columns)):
+        window = unsmoothed[max(index - half, 0) : min(index + half, len(columns))]
+        width = sum(window) // len(window)
+        widths.append(width)
+
+        slope = java_find_slope(columns, index)
+        adjust_row += math.sqrt(slope * slope + 1) - 1.0
+        if adjust_row > 0.5:
+            widths.append(width)
+            adjust_row -= 1
+
+    return np.array(widths[::-1])
+
+
+def create_carrot(length, bend=None, slope=0.0, height=400, max_width=60):
+    """
+    a tapered carrot, tip on the left. bend shifts the center of every column
+    by bend(position), position going from 0 at the tip to 1 at the shoulder
+    """
+    mask = np.zeros((height, length + 40), dtype=np.uint8)
+    for i in range(length):
+        position = i / length
+        center = height // 2 + slope * i
+        if bend is not None:
+            center += bend(position)
+        half_width = int(3 + max_width / 2 * position)
+        top = int(round(center)) - half_width
+        mask[top : top + 2 * half_width + 1, 20 + i] = 255
+    return mask
+
+
+def c_bend(position):
+    return 80 * math.sin(math.pi * position)
+
+
+def add_root_hairs(mask, length, bend=None, height=400, max_width=60):
+    """
+    thin root hairs above and below a carrot of create_carrot, detached from
+    it, so that they are runs of their own in the columns they cross
+    """
+    mask = mask.copy()
+    for i in range(80, length - 100, 97):
+        position = i / length
+        center = height // 2 + (bend(position) if bend else 0)
+        half_width = 3 + max_width / 2 * position
+        x = 20 + i
+        top = int(center - half_width) - 6
+        bottom = int(center + half_width) + 6
+        cv2.line(mask, (x, top), (x + 25, top - 40), 255, 2)
+        cv2.line(mask, (x + 30, bottom), (x + 10, bottom + 50), 255, 2)
+    return mask
+
+
+def create_carrot_with_long_runs(stray_runs=True):
+    """
+    a thick carrot with a spot cutting it in two runs of more than
+    JAVA_THRESHOLD px. The stray runs are longer than that, one above the
+    thin part of the carrot and one below the thick part
+    """
+    mask = create_carrot(600, height=800, max_width=300)
+    mask[395:406, 480:521] = 0
+    if stray_runs:
+        mask[150:281, 60:81] = 255
+        mask[600:721, 500:541] = 255
+    return mask
+
+
+CARROTS = {
+    "straight 340": create_carrot(340),
+    "straight 1500": create_carrot(1500),
+    "straight 3000": create_carrot(3000),
+    "rising": create_carrot(1500, slope=-0.05),
+    "falling": create_carrot(1500, slope=0.05),
+    "c bend": create_carrot(1500, bend=c_bend),
+    "s bend": create_carrot(1500, bend=lambda p: 80 * math.sin(2 * math.pi * p)),
+    "bent tip": create_carrot(1500, bend=lambda p: 120 * (1 - p) ** 3),
+    "root hairs": add_root_hairs(create_carrot(1500, bend=c_bend), 1500, c_bend),
+    "hair longer than the tip": cv2.rectangle(
+        create_carrot(1500), (28, 150), (45, 190), 255, -1
+    ),
+    "long runs": create_carrot_with_long_runs(),
+    "spot": create_carrot_with_long_runs(stray_runs=False),
+}
+
+# the carrots with runs the java straightener leaves out or merges
+STRAY_RUNS = ["root hairs", "hair longer than the tip", "long runs", "spot"]
+
+
+@pytest.mark.parametrize("name", STRAY_RUNS)
+def test_carrot_rows_match_java(name):
+    mask = CARROTS[name]
+    starts, ends = get_carrot_rows(mask)
+    java = [java_find_carrot(mask, x) for x in range(mask.shape[1])]
+
+    assert list(zip(starts.tolist(), ends.tolist())) == java
+
+    # some columns have to hold several runs, or this test proves nothing
+    white = np.pad(mask == 255, ((1, 0), (0, 0)), "constant")
+    runs_per_column = np.count_nonzero(white[1:] & ~white[:-1], axis=0)
+    assert (runs_per_column > 1).sum() >= 10
+
+
+@pytest.mark.parametrize("name", sorted(CARROTS))
+def test_curvature_matches_java(name):
+    mask = CARROTS[name]
+    assert get_curvature(mask) == java_curvature(mask)
+
+
+@pytest.mark.parametrize("name", ["straight 340", "straight 1500", "straight 3000"])
+def test_straight_carrot_has_no_curvature(name):
+    assert get_curvature(CARROTS[name]) == 0
+
+
+def test_bent_carrots_are_more_curved_than_straight_ones():
+    straight = get_curvature(CARROTS["straight 1500"])
+    for name in ("c bend", "bent tip"):
+        assert get_curvature(CARROTS[name]) > straight + 100
+
+
+def test_root_hairs_do_not_change_the_curvature():
+    assert get_curvature(CARROTS["root hairs"]) == get_curvature(CARROTS["c bend"])
+
+
+def test_empty_mask_has_no_curvature():
+    assert get_curvature(np.zeros((50, 80), dtype=np.uint8)) == 0
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["straight 1500", "c bend", "s bend", "bent tip", "root hairs", "spot"],
+)
+def test_straightened_mask_matches_java(name):
+    mask = CARROTS[name]
+    straight, curvature = straighten_mask(mask)
+    widths = np.count_nonzero(straight == 255, axis=0)
+    widths = widths[widths > 0]
+
+    # java counts a run from its first to its last row, one px short
+    java_widths = java_straightened_widths(mask) + 1
+    java_widths = java_widths[java_widths > 1]
+
+    assert abs(len(widths) - len(java_widths)) <= 0.01 * len(java_widths)
+    assert abs(int(widths.max()) - int(java_widths.max())) <= 5
+
+    # java smooths the widths over 20 columns and both cut the ends
+    # differently, so only the body of the carrot is compared
+    positions = np.linspace(0, 1, len(widths))
+    java_widths = np.interp(positions, np.linspace(0, 1, len(java_widths)), java_widths)
+    body = slice(int(0.05 * len(widths)), int(0.95 * len(widths)))
+    assert np.mean(np.abs(widths[body] - java_widths[body])) <= 2.5
+
+    assert curvature == java_curvature(mask)
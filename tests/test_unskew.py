@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+from lib.unskew import (
+    REMAP_TMP_PREFIX,
+    get_remap_path,
+    prune_remap_cache,
+    save_remap,
+)
+
+
+def cache_remaps(cache_dir, count):
+    """
+    cache count remaps of 1000 bytes per map, the first one the least
+    recently used
+    """
+    keys = []
+    for index in range(count):
+        key = ("camera", "lens", index)
+        paths = get_remap_path(key, cache_dir)
+        save_remap((np.zeros(1000 - 128, dtype=np.uint8),) * 2, paths)
+        for path in paths:
+            os.utime(path, (index, index))
+        keys.append(key)
+    return keys
+
+
+def is_cached(key, cache_dir):
+    return [os.path.exists(path) for path in get_remap_path(key, cache_dir)]
+
+
+def test_prune_remap_cache_evicts_least_recently_used(tmpdir):
+    cache_dir = str(tmpdir)
+    keys = cache_remaps(cache_dir, 5)
+
+    assert prune_remap_cache(cache_dir, max_bytes=6000) == 2
+    assert [is_cached(key, cache_dir) for key in keys] == (
+        [[False, False]] * 2 + [[True, True]] * 3
+    )
+
+
+def test_prune_remap_cache_keeps_a_cache_that_fits(tmpdir):
+    cache_dir = str(tmpdir)
+    keys = cache_remaps(cache_dir, 3)
+
+    assert prune_remap_cache(cache_dir, max_bytes=6000) == 0
+    assert all(all(is_cached(key, cache_dir)) for key in keys)
+
+
+def test_prune_remap_cache_without_cache(tmpdir):
+    assert prune_remap_cache(os.path.join(str(tmpdir), "missing")) == 0
+
+
+def test_prune_remap_cache_leaves_temporary_files_alone(tmpdir):
+    cache_dir = str(tmpdir)
+    keys = cache_remaps(cache_dir, 2)
+    # a map another process is still writing, and a file that is no map
+    others = [os.path.join(cache_dir, name) for name in (".tmp-abc123", "notes.txt")]
+    for path in others:
+        with open(path, "wb") as f:
+            f.write(b"\x00" * 5000)
+        os.utime(path, (0, 0))
+
+    assert prune_remap_cache(cache_dir, max_bytes=2000) == 1
+    assert is_cached(keys[0], cache_dir) == [False, False]
+    assert is_cached(keys[1], cache_dir) == [True, True]
+    assert all(os.path.exists(path) for path in others)
+
+
+def test_save_remap_writes_through_temporary_files(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir)
+    paths = get_remap_path(("camera", "lens", 0), cache_dir)
+    seen = []
+
+    def replace(source, target):
+        seen.append(os.path.basename(source))
+        os.rename(source, target)
+
+    monkeypatch.setattr(os, "replace", replace)
+    save_remap((np.zeros(10, dtype=np.uint8),) * 2, paths)
+
+    assert all(name.startswith(REMAP_TMP_PREFIX) for name in seen)
+    assert prune_remap_cache(cache_dir, max_bytes=0) == 1
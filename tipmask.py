@@ -8,9 +8,14 @@ import click
 from joblib import load
 
 from lib.constants import DETIPPED_MASKS_DIR, STRAIGHTENED_MASKS_DIR, config
-from lib.tip_mask import tip_mask
+from lib.scheduler import run_file_tasks
+from lib.tip_mask import get_tip_mask_target, tip_mask_files
 from lib.utils import get_masks_to_process, get_attributes_from_filename
 
+# the tips of this many masks of a directory are predicted in one call of
+# the model, batches are handed to the workers like files
+TIP_MASK_BATCH_SIZE = 16
+
 
 def copy_results(source, dest, dest_dir_key="Genotype", dest_sub_key=None):
     """
@@ -91,8 +96,17 @@ def run(dest, destdir, destsub, visualize, keep, src):
     regr = load("tip-mask-model.joblib")
 
     # detip masks
-    with Pool(processes=cpu_count()) as pool:
-        pool.starmap(tip_mask, [(dir["path"], regr, visualize) for dir in subdirs])
+    groups = []
+    for dir in subdirs:
+        target = get_tip_mask_target(dir["path"])
+        files = [os.path.join(dir["path"], file) for file in os.listdir(dir["path"])]
+        groups.append(
+            [
+                (files[i : i + TIP_MASK_BATCH_SIZE], target, regr, visualize)
+                for i in range(0, len(files), TIP_MASK_BATCH_SIZE)
+            ]
+        )
+    run_file_tasks(tip_mask_files, groups, name="tip masks", unit="batches")
 
     if dest:
 
@@ -1,7 +1,6 @@
 from joblib import dump, load
 import os
 import click
-import collections
 import timeit
 import warnings
 
@@ -11,6 +10,7 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
 
+from lib.column_stats import get_column_statistics
 from lib.utils import get_files_to_process, pixel_to_mm, get_attributes_from_filename
 from lib.constants import STRAIGHTENED_MASKS_DIR, TIP_MASK_PSEUDO_MAX_LENGTH
 from lib.tip_mask import get_width_array, get_width_array_mm, normalize_width_array
@@ -47,10 +47,9 @@ def get_index_first_white_pixel(image):
     Returns:
         index (int)
     """
-    for i, column in enumerate(image.T):
-        count = collections.Counter(column)
-        if count.get(255, None):
-            return i
+    white_columns = get_column_statistics(image).get_white_columns()
+    if len(white_columns):
+        return int(white_columns[0])
 
 
 def equalize_lengths(raw_data):
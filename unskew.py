@@ -0,0 +1,37 @@
+import warnings
+
+import click
+
+from lib.unskew import unskew_directory
+
+
+@click.command()
+@click.option(
+    "--dest",
+    "-d",
+    type=click.Path(),
+    help="destination directory of the corrected photos",
+)
+@click.option("--old", is_flag=True, help="the old pictures")
+@click.option(
+    "--src",
+    "-s",
+    type=click.Path(exists=True),
+    help="source directory of the photos to correct",
+)
+def run(dest, old, src):
+    if not src or not dest:
+        click.secho(
+            "Specify a source and a destination. Use --src and --dest", fg="red"
+        )
+        return
+
+    click.secho("Correcting the lens distortion...", fg="white")
+    unskew_directory(src, dest, old)
+    click.secho("Done!", fg="green")
+
+
+if __name__ == "__main__":
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        run()
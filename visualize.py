@@ -16,6 +16,7 @@ from lib.crop import (
     crop_black_tape,
     trim_tape_edges,
 )
+from lib.scheduler import run_file_tasks
 from lib.tip_mask import tip_mask
 from lib.utils import (
     get_files_to_process,
@@ -33,52 +34,65 @@ VISUALS = ["blue-line", "black-box", "midline", "graph", "tip-angle", "shoulderi
 def draw_blue_line(target, old=False):
     outdir = get_target_dir(target["path"], "blue-line", True)
     for file in target["files"]:
-        filename = file.split("/")[-1]
-        outfile = os.path.join(outdir, filename)
-        print(filename)
-        try:
-            image = read_file(file)
-            backdrop = detect_backdrop(image)
-            if backdrop == "white":
-                image = trim_tape_edges(image)
-            with_blue_line = crop_black_tape(image, backdrop, False)
-            with_blue_line = crop_left_of_blue_line_hsv(
-                with_blue_line, backdrop, old, True
-            )
-            # outfile = os.path.join(outdir, filename)
-            # print(outfile)
-            cv2.imwrite(outfile, with_blue_line)
-        except Exception as e:
-            print(e)
-            click.secho(file, fg="red")
+        draw_blue_line_file(file, outdir, old)
 
 
-def draw_black_box(target, old=False):
-    outdir = get_target_dir(target["path"], "black-box", True)
-    for file in target["files"]:
+def draw_blue_line_file(file, outdir, old=False):
+    filename = file.split("/")[-1]
+    outfile = os.path.join(outdir, filename)
+    print(filename)
+    try:
         image = read_file(file)
         backdrop = detect_backdrop(image)
         if backdrop == "white":
             image = trim_tape_edges(image)
-        with_blue_line = crop_black_tape(image, backdrop, True)
-        filename = file.split("/")[-1]
-        outfile = os.path.join(outdir, filename)
-        print(outfile)
+        with_blue_line = crop_black_tape(image, backdrop, False)
+        with_blue_line = crop_left_of_blue_line_hsv(with_blue_line, backdrop, old, True)
+        # outfile = os.path.join(outdir, filename)
+        # print(outfile)
         cv2.imwrite(outfile, with_blue_line)
+    except Exception as e:
+        print(e)
+        click.secho(file, fg="red")
 
 
-def draw_midline(target):
+def draw_black_box(target, old=False):
+    outdir = get_target_dir(target["path"], "black-box", True)
+    for file in target["files"]:
+        draw_black_box_file(file, outdir, old)
+
+
+def draw_black_box_file(file, outdir, old=False):
+    image = read_file(file)
+    backdrop = detect_backdrop(image)
+    if backdrop == "white":
+        image = trim_tape_edges(image)
+    with_blue_line = crop_black_tape(image, backdrop, True)
+    filename = file.split("/")[-1]
+    outfile = os.path.join(outdir, filename)
+    print(outfile)
+    cv2.imwrite(outfile, with_blue_line)
+
+
+def get_visual_dirs(target, masks_dir, visual):
     """
-    Draws midlines using existing binary masks.
+    the directory of the masks to visualize and the cleared directory of the
+    visualizations
+
+    Args:
+        target (str): directory of the photos
+        masks_dir (str): name of the directory of the masks in target
+        visual (str): name of the directory of the visualizations in target
+    Returns:
+        (masks, new_folder_name)
     """
-
-    masks = os.path.join(target, BINARY_MASKS_DIR)
-    # check for existing binary masks
+    masks = os.path.join(target, masks_dir)
+    # check for existing masks
     if not os.path.exists(masks):
-        raise Exception(f"No {BINARY_MASKS_DIR} folder in {target}!")
+        raise Exception(f"No {masks_dir} folder in {target}!")
 
-    # create midline folder
-    new_folder_name = os.path.join(target, "midline")
+    # create visual folder
+    new_folder_name = os.path.join(target, visual)
 
     if os.path.exists(new_folder_name):
         shutil.rmtree(new_folder_name)
@@ -86,72 +100,77 @@ def draw_midline(target):
     if not os.path.exists(new_folder_name):
         os.makedirs(new_folder_name)
 
-    for file in os.listdir(masks):
-        filepath = os.path.join(masks, file)
-        mask = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
-        midline = get_midline(mask)
-        color_image = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+    return masks, new_folder_name
 
-        for point in midline:
-            x = point[0]
-            y = point[1]
-            try:
-                color_image[int(y), :][int(x)] = np.array([0, 0, 255])
-            except:
-                pass
 
-        output_filepath = os.path.join(new_folder_name, file)
-        click.secho(f"Visualized midline for {filepath}")
-        cv2.imwrite(output_filepath, color_image)
+def draw_midline(target):
+    """
+    Draws midlines using existing binary masks.
+    """
+    masks, new_folder_name = get_visual_dirs(target, BINARY_MASKS_DIR, "midline")
+
+    for file in os.listdir(masks):
+        draw_midline_file(os.path.join(masks, file), new_folder_name)
 
 
-def visualize_shouldering(target):
+def draw_midline_file(filepath, new_folder_name):
+    mask = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+    midline = get_midline(mask)
+    color_image = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
 
-    masks = os.path.join(target, STRAIGHTENED_MASKS_DIR)
-    # check for existing binary masks
-    if not os.path.exists(masks):
-        raise Exception(f"No {STRAIGHTENED_MASKS_DIR} folder in {target}!")
+    for point in midline:
+        x = point[0]
+        y = point[1]
+        try:
+            color_image[int(y), :][int(x)] = np.array([0, 0, 255])
+        except:
+            pass
 
-    # create shouldering folder
-    new_folder_name = os.path.join(target, "shouldering")
-    if os.path.exists(new_folder_name):
-        shutil.rmtree(new_folder_name)
+    output_filepath = os.path.join(new_folder_name, os.path.basename(filepath))
+    click.secho(f"Visualized midline for {filepath}")
+    cv2.imwrite(output_filepath, color_image)
 
-    if not os.path.exists(new_folder_name):
-        os.makedirs(new_folder_name)
+
+def visualize_shouldering(target):
+    masks, new_folder_name = get_visual_dirs(
+        target, STRAIGHTENED_MASKS_DIR, "shouldering"
+    )
 
     for file in os.listdir(masks):
-        filepath = os.path.join(masks, file)
-        mask = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
-        color_image = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+        visualize_shouldering_file(os.path.join(masks, file), new_folder_name)
 
-        shoulder_dict = get_shoulders(mask)
 
-        top_y_min = shoulder_dict["top_y_min"]
-        top_y_max = shoulder_dict["top_y_max"]
-        top_x_min = shoulder_dict["top_x_min"]
-        top_x_max = shoulder_dict["top_x_max"]
+def visualize_shouldering_file(filepath, new_folder_name):
+    mask = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+    color_image = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
 
-        bottom_y_min = shoulder_dict["bottom_y_min"]
-        bottom_y_max = shoulder_dict["bottom_y_max"]
-        bottom_x_min = shoulder_dict["bottom_x_min"]
-        bottom_x_max = shoulder_dict["bottom_x_max"]
+    shoulder_dict = get_shoulders(mask)
 
-        output_filepath = os.path.join(new_folder_name, file)
-        click.secho(f"Visualized shouldering for {filepath}")
+    top_y_min = shoulder_dict["top_y_min"]
+    top_y_max = shoulder_dict["top_y_max"]
+    top_x_min = shoulder_dict["top_x_min"]
+    top_x_max = shoulder_dict["top_x_max"]
 
-        cv2.rectangle(
-            color_image, (top_x_min, top_y_min), (top_x_max, top_y_max), [0, 0, 255], 1
-        )
-        cv2.rectangle(
-            color_image,
-            (bottom_x_min, bottom_y_min),
-            (bottom_x_max, bottom_y_max),
-            [0, 0, 255],
-            1,
-        )
+    bottom_y_min = shoulder_dict["bottom_y_min"]
+    bottom_y_max = shoulder_dict["bottom_y_max"]
+    bottom_x_min = shoulder_dict["bottom_x_min"]
+    bottom_x_max = shoulder_dict["bottom_x_max"]
 
-        cv2.imwrite(output_filepath, color_image)
+    output_filepath = os.path.join(new_folder_name, os.path.basename(filepath))
+    click.secho(f"Visualized shouldering for {filepath}")
+
+    cv2.rectangle(
+        color_image, (top_x_min, top_y_min), (top_x_max, top_y_max), [0, 0, 255], 1
+    )
+    cv2.rectangle(
+        color_image,
+        (bottom_x_min, bottom_y_min),
+        (bottom_x_max, bottom_y_max),
+        [0, 0, 255],
+        1,
+    )
+
+    cv2.imwrite(output_filepath, color_image)
 
 
 def draw_graph(target):
@@ -238,30 +257,29 @@ def run(aspect, length, old, smoothen, src):
     mask_dest = BINARY_MASKS_DIR
     straight_dest = STRAIGHTENED_MASKS_DIR
 
-    if aspect == "blue-line":
-        name = None
+    if aspect in ["blue-line", "black-box"]:
+        draw = draw_blue_line_file if aspect == "blue-line" else draw_black_box_file
         subdirs = get_files_to_process(src)
-        with Pool(processes=cpu_count()) as pool:
-            pool.starmap(draw_blue_line, [(dir, old) for dir in subdirs])
-        return
-
-    if aspect == "black-box":
-        name = None
-        subdirs = get_files_to_process(src)
-        with Pool(processes=cpu_count()) as pool:
-            pool.starmap(draw_black_box, [(dir, old) for dir in subdirs])
+        groups = []
+        for dir in subdirs:
+            outdir = get_target_dir(dir["path"], aspect, True)
+            groups.append([(file, outdir, old) for file in dir["files"]])
+        run_file_tasks(draw, groups, name=aspect)
         return
 
-    if aspect == "midline":
+    if aspect in ["midline", "shouldering"]:
+        if aspect == "midline":
+            draw, masks_dir = draw_midline_file, BINARY_MASKS_DIR
+        else:
+            draw, masks_dir = visualize_shouldering_file, STRAIGHTENED_MASKS_DIR
         subdirs = get_files_to_process(src)
-        with Pool(processes=cpu_count()) as pool:
-            pool.starmap(draw_midline, [(dir["path"],) for dir in subdirs])
-        return
-
-    if aspect == "shouldering":
-        subdirs = get_files_to_process(src)
-        with Pool(processes=cpu_count()) as pool:
-            pool.starmap(visualize_shouldering, [(dir["path"],) for dir in subdirs])
+        groups = []
+        for dir in subdirs:
+            masks, outdir = get_visual_dirs(dir["path"], masks_dir, aspect)
+            groups.append(
+                [(os.path.join(masks, file), outdir) for file in os.listdir(masks)]
+            )
+        run_file_tasks(draw, groups, name=aspect)
         return
 
     # TODO: is this working??